@@ -1,31 +1,292 @@
 from typing import Dict
-from chalice import Chalice, Cron
+import dataclasses
+import datetime
+import json
+import time
+from chalice import Cron
+from chalice import Rate
+from chalice import Response
+from chalicelib.application import app
+from chalicelib.config import get_config
+from chalicelib.controllers import BacklogSyncController
+from chalicelib.controllers import SyncQueueController
+from chalicelib.controllers import TogglAggregateController
+from chalicelib.controllers import TogglBackfillController
+from chalicelib.controllers import TogglEventController
+from chalicelib.controllers import TogglPartitionController
+from chalicelib.controllers import TogglSummaryController
 from chalicelib.controllers import WorkTimeController
+from chalicelib.http_client import get_http_client
+from chalicelib.rate_limiter import rate_limiter_stats
 from chalicelib.repositories import TogglReportSummaryRepository
 from chalicelib.repositories import DbTogglReportRepository
+from chalicelib.repositories import AGGREGATE_GROUP_COLUMNS
 from chalicelib.repositories import BacklogIssueRepository
+from chalicelib.repositories import DbBacklogIssueRepository
+from chalicelib.repositories import DbSyncQueueRepository
+from chalicelib.repositories import DbTogglAggregateRepository
+from chalicelib.repositories import DbTogglPartitionRepository
+from chalicelib.usecases import BackfillFromTogglUsecase
+from chalicelib.usecases import CheckTogglSummaryUsecase
+from chalicelib.usecases import CoordinateBacklogSyncUsecase
+from chalicelib.usecases import EnqueueIssueEventsUsecase
+from chalicelib.usecases import GetTogglAggregatesUsecase
 from chalicelib.usecases import ImportFromTogglUsecase
-
-app = Chalice(app_name='ExamApp')
-# productionでもcloudwatchにlog出力する
-app.debug = True
+from chalicelib.usecases import MaintainTogglPartitionsUsecase
+from chalicelib.usecases import SyncBacklogShardUsecase
+from chalicelib.usecases import SyncQueuedIssuesUsecase
+from chalicelib.webhooks import SIGNATURE_HEADER
+from chalicelib.webhooks import extract_issue_keys
+from chalicelib.webhooks import extract_toggl_ids
+from chalicelib.webhooks import verify_signature
+from chalicelib.work_queue import get_work_queue
 
 
 @app.schedule(Cron(0, 23, '*', '*', '?', '*'))
 # @app.schedule(Cron('0/2', '*', '*', '*', '?', '*')) #for debug
 def main(event: Dict):
     app.log.info('Exec Start')
+    if get_config().sync_mode == 'distributed':
+        return _coordinate_backlog_sync(False, event.context.get_remaining_time_in_millis)
+    return _import_from_toggl(False, event.context.get_remaining_time_in_millis)
+
+
+@app.lambda_function(name='reconcile')
+def reconcile(event: Dict, context):
+    """全件同期（手動実行用）
+    合計時間の変化に関わらず、toggl登録のあるすべてのBacklog issueを同期する
+    """
+    app.log.info('Reconcile Start')
+    return _import_from_toggl(True, context.get_remaining_time_in_millis)
+
+
+def _import_from_toggl(full_reconcile: bool, get_remaining_time_in_millis=None) -> bool:
+    # handler開始から最初のAPIレスポンスまでの時間（初期化コスト）を計測
+    _started = time.monotonic()
+    get_http_client().reset_stats()
     try:
         # Create Usecase
         toggl_usecase: ImportFromTogglUsecase = ImportFromTogglUsecase(
                                 TogglReportSummaryRepository(),
                                 DbTogglReportRepository(),
-                                BacklogIssueRepository())
+                                BacklogIssueRepository(DbBacklogIssueRepository()))
 
         wt_controlller: WorkTimeController = WorkTimeController(toggl_usecase)
-        wt_controlller.import_from_toggl()
+        wt_controlller.import_from_toggl(full_reconcile, get_remaining_time_in_millis)
+        _http_stats = get_http_client().stats()
+        if _http_stats['first_response_at']:
+            app.log.info(f'[time to first response]{_http_stats["first_response_at"] - _started:.3f}s')
+        app.log.info(f'[http connection stats]{_http_stats}')
+        app.log.info(f'[rate limiter stats]{rate_limiter_stats()}')
         app.log.info('Exec End')
         return True
     except Exception as e:
         app.log.error(e)
         return False
+
+
+@app.schedule(Rate(15, unit=Rate.MINUTES), name='retry_failed')
+def retry_failed(event: Dict):
+    """同期に失敗したissueの再同期
+    再同期の時刻を過ぎたissueのみ、DBの集計でBacklogに同期し直す（Togglからは取得しない）
+    """
+    get_http_client().reset_stats()
+    try:
+        wt_controlller: WorkTimeController = WorkTimeController(
+                                ImportFromTogglUsecase(
+                                    TogglReportSummaryRepository(),
+                                    DbTogglReportRepository(),
+                                    BacklogIssueRepository(DbBacklogIssueRepository())))
+        results = wt_controlller.retry_failed(get_remaining_time_in_millis=event.context.get_remaining_time_in_millis)
+        if results:
+            app.log.info(f'[sync retry]synced:{sum(1 for result in results if not result.error and not result.deferred)} '
+                         f'failed:{sum(1 for result in results if result.error)}')
+        return True
+    except Exception as e:
+        app.log.error(e)
+        return False
+
+
+@app.lambda_function(name='coordinate')
+def coordinate(event: Dict, context):
+    """分散同期（手動実行用）
+    togglデータを取り込み、同期するissueをshardに分けてworkerに送り、結果を集計する
+    event例：{"full_reconcile": true} ですべてのBacklog issueを同期する
+    """
+    app.log.info('Coordinate Start')
+    return _coordinate_backlog_sync(bool(event.get('full_reconcile')), context.get_remaining_time_in_millis)
+
+
+def _coordinate_backlog_sync(full_reconcile: bool, get_remaining_time_in_millis=None):
+    get_http_client().reset_stats()
+    try:
+        toggl_usecase: ImportFromTogglUsecase = ImportFromTogglUsecase(
+                                TogglReportSummaryRepository(),
+                                DbTogglReportRepository(),
+                                BacklogIssueRepository(DbBacklogIssueRepository()))
+        work_queue = get_work_queue('work')
+        result_queue = get_work_queue('result')
+        # SQSを使わない場合は、同じプロセスのスレッドでworkerを動かす
+        local_worker = None
+        if not get_config().sync_work_queue_url:
+            local_worker = SyncBacklogShardUsecase(toggl_usecase, result_queue, emit_metrics=False)
+        sync_controller: BacklogSyncController = BacklogSyncController(
+                                CoordinateBacklogSyncUsecase(
+                                    toggl_usecase, work_queue, result_queue, local_worker=local_worker))
+        result = sync_controller.coordinate(full_reconcile, get_remaining_time_in_millis)
+        app.log.info(f'[sync coordinator result]{result}')
+        app.log.info(f'[http connection stats]{get_http_client().stats()}')
+        app.log.info('Coordinate End')
+        return result
+    except Exception as e:
+        app.log.error(e)
+        return False
+
+
+@app.on_sqs_message(queue='backlog-sync-work', batch_size=1)
+def sync_worker(event):
+    """分散同期のworker
+    coordinatorが送ったshard（SYNC_WORK_QUEUE_URLのキュー）のissueをBacklogに同期し、
+    結果をSYNC_RESULT_QUEUE_URLのキューに返す。例外時はメッセージが再配信される
+    """
+    get_http_client().reset_stats()
+    sync_controller: BacklogSyncController = BacklogSyncController(
+                            sync_backlog_shard_usecase=SyncBacklogShardUsecase(
+                                ImportFromTogglUsecase(
+                                    TogglReportSummaryRepository(),
+                                    DbTogglReportRepository(),
+                                    BacklogIssueRepository(DbBacklogIssueRepository())),
+                                get_work_queue('result')))
+    for record in event:
+        result = sync_controller.sync_shard(json.loads(record.body), event.context.get_remaining_time_in_millis)
+        app.log.info(f'[sync worker result]{result.run_id} {result.shard} updated:{result.updated} '
+                     f'unchanged:{result.unchanged} failed:{result.failed} deferred:{result.deferred}')
+
+
+@app.route('/events/toggl', methods=['POST'])
+def toggl_event():
+    """Togglの変更イベント受信
+    Toggl Webhooks（time entryの作成・更新・削除）、またはローカルのpoller（{"issue_keys": ["HOGE-1"]}）から受け取る
+    署名（TOGGL_WEBHOOK_SECRETでHMAC-SHA256）を確認し、issue keyを同期待ちにする（同期はdrain_sync_queueで行う）
+    """
+    request = app.current_request
+    secret = get_config().toggl_webhook_secret
+    if not verify_signature(request.raw_body, request.headers.get(SIGNATURE_HEADER), secret):
+        return Response(body={'message': 'invalid signature'}, status_code=401)
+    try:
+        event = json.loads(request.raw_body or b'{}')
+    except ValueError:
+        return Response(body={'message': 'invalid json'}, status_code=400)
+    if event.get('validation_code'):
+        # Webhook登録時の検証（validation_codeをそのまま返す）
+        return {'validation_code': event['validation_code']}
+
+    event_controller: TogglEventController = TogglEventController(
+                            EnqueueIssueEventsUsecase(DbSyncQueueRepository(), DbTogglReportRepository()))
+    return {'queued': event_controller.receive(extract_issue_keys(event), extract_toggl_ids(event))}
+
+
+@app.schedule(Rate(1, unit=Rate.MINUTES), name='drain_sync_queue')
+def drain_sync_queue(event: Dict):
+    """同期待ちのissueの同期
+    debounceの待ち時間を過ぎたissueのみtogglデータを取り込み、Backlogに同期する
+    """
+    get_http_client().reset_stats()
+    try:
+        queue_controller: SyncQueueController = SyncQueueController(
+                                SyncQueuedIssuesUsecase(
+                                    ImportFromTogglUsecase(
+                                        TogglReportSummaryRepository(),
+                                        DbTogglReportRepository(),
+                                        BacklogIssueRepository(DbBacklogIssueRepository())),
+                                    DbSyncQueueRepository()))
+        synced = queue_controller.drain()
+        if synced:
+            app.log.info(f'[sync queue synced]{synced}')
+        return True
+    except Exception as e:
+        app.log.error(e)
+        return False
+
+
+@app.route('/aggregates/{group_by}', methods=['GET'], api_key_required=True)
+def aggregates(group_by: str):
+    """集計API
+    group_by：issues（issue毎）、users（ユーザー毎）、days（日毎）
+    クエリ：since、until（YYYY-MM-DD、省略時は直近AGGREGATE_DEFAULT_DAYS日）、issue_key、user
+    取り込み時に再計算する日次集計（toggl_daily_rollup）を参照する
+    """
+    if group_by not in AGGREGATE_GROUP_COLUMNS:
+        return Response(body={'message': f'unknown aggregate: {group_by}'}, status_code=404)
+    params = app.current_request.query_params or {}
+    try:
+        since = datetime.date.fromisoformat(params['since']) if params.get('since') else None
+        until = datetime.date.fromisoformat(params['until']) if params.get('until') else None
+    except ValueError:
+        return Response(body={'message': 'since/until must be YYYY-MM-DD'}, status_code=400)
+
+    aggregate_controller: TogglAggregateController = TogglAggregateController(
+                                GetTogglAggregatesUsecase(DbTogglAggregateRepository()))
+    data = aggregate_controller.get_aggregates(
+        group_by, since, until, params.get('issue_key'), params.get('user'))
+    return Response(
+        body={'group_by': group_by, 'data': [dataclasses.asdict(aggregate) for aggregate in data]},
+        headers={'Cache-Control': f'private, max-age={get_config().aggregate_cache_seconds}'},
+        status_code=200)
+
+
+@app.schedule(Cron(0, 22, '*', '*', '?', '*'), name='maintain_partitions')
+def maintain_partitions(event: Dict):
+    """toggl_reportのパーティション管理
+    先の月のパーティションを作成し、TOGGL_RETENTION_MONTHSを過ぎたパーティションを切り離す
+    """
+    try:
+        partition_controller: TogglPartitionController = TogglPartitionController(
+                                MaintainTogglPartitionsUsecase(DbTogglPartitionRepository()))
+        result = partition_controller.maintain()
+        app.log.info(f'[maintain partitions]{result}')
+        return result
+    except Exception as e:
+        app.log.error(e)
+        return False
+
+
+@app.lambda_function(name='check_summary')
+def check_summary(event: Dict, context):
+    """集計テーブルの整合性チェック（手動実行用）
+    event例：{"repair": true} で不一致があれば集計テーブルを作り直す
+    """
+    app.log.info('Check Summary Start')
+    try:
+        summary_controller: TogglSummaryController = TogglSummaryController(
+                                CheckTogglSummaryUsecase(DbTogglReportRepository()))
+        diff_count = summary_controller.check_summary(bool(event.get('repair')))
+        app.log.info('Check Summary End')
+        return {'diff_count': diff_count}
+    except Exception as e:
+        app.log.error(e)
+        return False
+
+
+@app.lambda_function(name='backfill')
+def backfill(event: Dict, context):
+    """過去データ取り込み（手動実行用）
+    event例：{"since": "2020-01-01", "until": "2020-12-31", "shard_days": 7}
+    タイムアウト前に中断した場合は、同じeventで再実行すると未完了のshardから再開する
+    """
+    app.log.info('Backfill Start')
+    try:
+        backfill_controller: TogglBackfillController = TogglBackfillController(
+                                BackfillFromTogglUsecase(
+                                    TogglReportSummaryRepository(),
+                                    DbTogglReportRepository()))
+        completed = backfill_controller.backfill_from_toggl(
+            datetime.date.fromisoformat(event['since']),
+            datetime.date.fromisoformat(event.get('until') or datetime.date.today().isoformat()),
+            int(event.get('shard_days', 7)),
+            context.get_remaining_time_in_millis)
+        app.log.info(f'Backfill End completed:{completed}')
+        return {'completed': completed}
+    except Exception as e:
+        app.log.error(e)
+        return False
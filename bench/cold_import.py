@@ -0,0 +1,87 @@
+"""
+Cold import benchmark.
+
+Lambdaのcold start相当として、新しいpythonプロセスでapp.pyをimportする時間を計測する。
+
+    python bench/cold_import.py --runs 10
+
+-X importtimeの結果から、importに時間がかかっているモジュール上位も出力する。
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app.pyのimportに必要な環境変数（値は使わない）
+DUMMY_ENV = {
+    'TOGGL_API_TOKEN': 'dummy',
+    'TOGGL_BASE_URL': 'http://127.0.0.1',
+    'TOGGL_PAST_DAYS': '6',
+    'BACKLOG_PRJ_KEY': 'BENCH',
+    'BACKLOG_BASE_URL': 'http://127.0.0.1',
+    'BACKLOG_APIKEY': 'dummy',
+    'BACKLOG_COMMENT': '[togglより連携]',
+    'BACKLOG_COMMENT_COUNT': '100',
+    'DB_HOST': '127.0.0.1',
+    'DB_NAME': 'bench',
+    'DB_PORT': '5432',
+    'DB_USER': 'bench',
+    'DB_PASSWORD': 'bench',
+}
+
+IMPORTTIME_PATTERN = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def run_once() -> dict:
+    """import app in a fresh interpreter
+
+    Return:
+        result:dict
+            total_us:app importの累積時間（マイクロ秒）、modules:{module: self時間}
+    """
+    _env = dict(os.environ, **DUMMY_ENV)
+    _proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                           cwd=ROOT, env=_env, stderr=subprocess.PIPE,
+                           stdout=subprocess.DEVNULL, universal_newlines=True, check=True)
+    _total = 0
+    _modules = {}
+    for line in _proc.stderr.splitlines():
+        _match = IMPORTTIME_PATTERN.match(line)
+        if not _match:
+            continue
+        _self, _cumulative, _indent, _name = _match.groups()
+        _modules[_name] = int(_self)
+        if _name == 'app':
+            _total = int(_cumulative)
+    return {'total_us': _total, 'modules': _modules}
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__)
+    _parser.add_argument('--runs', type=int, default=10, help='計測回数')
+    _parser.add_argument('--top', type=int, default=15, help='出力するモジュール数')
+    _args = _parser.parse_args()
+
+    _results = [run_once() for _ in range(_args.runs)]
+    _totals = [result['total_us'] / 1000 for result in _results]
+    print(f'import app (ms): median={statistics.median(_totals):.1f} '
+          f'min={min(_totals):.1f} max={max(_totals):.1f} runs={_args.runs}')
+
+    _modules = {}
+    for result in _results:
+        for name, self_us in result['modules'].items():
+            _modules.setdefault(name, []).append(self_us)
+    _slowest = sorted(_modules.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    print('slowest modules (self time, median ms):')
+    for name, times in _slowest[:_args.top]:
+        print(f'  {statistics.median(times) / 1000:8.2f}  {name}')
+    _heavy = [name for name in ('requests', 'urllib3', 'psycopg2') if name in _modules]
+    print(f'heavy modules loaded at import: {_heavy or "none"}')
+
+
+if __name__ == '__main__':
+    main()
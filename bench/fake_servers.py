@@ -0,0 +1,251 @@
+"""
+Fake Toggl/Backlog servers for benchmarks.
+
+ローカルで動くToggl（workspaces、me、Detailed Report API v2/v3）とBacklog（issue、comment、更新）のスタンドイン。
+件数・コメント数・レイテンシを指定して合成データを返し、エンドポイント毎のリクエスト数を数える。
+"""
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+import collections
+import dataclasses
+import datetime
+import json
+import random
+import re
+import threading
+import time
+
+TOGGL_PER_PAGE = 50
+TOGGL_V3_DEFAULT_PAGE_SIZE = 50
+WORKSPACE_ID = 1
+
+
+@dataclasses.dataclass
+class Workload:
+
+    """Benchmark workload."""
+
+    project_key: str = 'BENCH'
+    entries: int = 1000
+    issues: int = 100
+    comments_per_issue: int = 20
+    latency_ms: float = 0.0
+    past_days: int = 6
+    seed: int = 1
+
+
+class FakeState():
+    """Synthetic data shared by the fake servers"""
+
+    def __init__(self, workload: Workload):
+        self.workload = workload
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()
+        self.bytes_sent = 0
+        _random = random.Random(workload.seed)
+        _now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9)))
+        self.entries = []
+        for i in range(workload.entries):
+            _issue_no = i % workload.issues + 1
+            _start = _now - datetime.timedelta(days=_random.randint(0, max(0, workload.past_days - 1)),
+                                               minutes=_random.randint(0, 600))
+            _dur = _random.randint(5, 180) * 60 * 1000
+            self.entries.append({
+                'id': 1000000 + i,
+                'pid': 10,
+                'tid': None,
+                'uid': 100 + i % 7,
+                'user': f'user{i % 7}',
+                'description': f'{workload.project_key}-{_issue_no} bench work',
+                'start': _start.isoformat(timespec='seconds'),
+                'end': (_start + datetime.timedelta(milliseconds=_dur)).isoformat(timespec='seconds'),
+                'updated': _start.isoformat(timespec='seconds'),
+                'dur': _dur
+            })
+        self.issues = {}
+        for no in range(1, workload.issues + 1):
+            _key = f'{workload.project_key}-{no}'
+            _comments = []
+            for c in range(workload.comments_per_issue):
+                _comment = {'id': no * 100000 + c + 1, 'content': f'comment {c}', 'changeLog': []}
+                if c % 5 == 0:
+                    # 手動の実績時間登録
+                    _comment['changeLog'].append({
+                        'field': 'actualHours', 'originalValue': str(c / 10), 'newValue': str(c / 10 + 0.5)})
+                _comments.append(_comment)
+            self.issues[_key] = {
+                'id': no,
+                'issueKey': _key,
+                'actualHours': 1.0,
+                'comments': _comments
+            }
+
+    def count(self, endpoint: str, size: int) -> None:
+        with self.lock:
+            self.requests[endpoint] += 1
+            self.bytes_sent += size
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """JSON handler with keep-alive and injected latency"""
+
+    protocol_version = 'HTTP/1.1'
+    state: FakeState = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, endpoint: str, status: int, body, headers: dict = None) -> None:
+        if self.state.workload.latency_ms:
+            time.sleep(self.state.workload.latency_ms / 1000)
+        _data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.state.count(endpoint, len(_data))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(_data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(_data)
+
+    def _read_json(self) -> dict:
+        _length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(_length) or b'{}')
+
+
+class FakeTogglHandler(_Handler):
+    """Toggl API v8 + Reports API v2/v3"""
+
+    V3_SEARCH_PATH = re.compile(r'^/reports/api/v3/workspace/(\d+)/search/time_entries$')
+
+    def do_GET(self):
+        _url = urlparse(self.path)
+        _query = parse_qs(_url.query)
+        if _url.path == '/api/v8/workspaces':
+            return self._send('toggl workspaces', 200, [{'id': WORKSPACE_ID, 'name': 'bench'}])
+        if _url.path == '/api/v8/me':
+            return self._send('toggl me', 200, {'data': {'email': 'bench@example.com', 'timezone': 'Asia/Tokyo'}})
+        if _url.path == '/reports/api/v2/details':
+            _page = int(_query.get('page', ['1'])[0])
+            _entries = self.state.entries[(_page - 1) * TOGGL_PER_PAGE:_page * TOGGL_PER_PAGE]
+            return self._send('toggl details', 200, {
+                'total_count': len(self.state.entries),
+                'per_page': TOGGL_PER_PAGE,
+                'data': _entries
+            })
+        return self._send('toggl not found', 404, {})
+
+    def do_POST(self):
+        _url = urlparse(self.path)
+        if not self.V3_SEARCH_PATH.match(_url.path):
+            return self._send('toggl not found', 404, {})
+        _body = self._read_json()
+        _page_size = int(_body.get('page_size') or TOGGL_V3_DEFAULT_PAGE_SIZE)
+        _first = int(_body.get('first_row_number') or 1)
+        _entries = self.state.entries[_first - 1:_first - 1 + _page_size]
+        _headers = {}
+        if _first - 1 + _page_size < len(self.state.entries):
+            _headers['X-Next-ID'] = str(_entries[-1]['id'] + 1)
+            _headers['X-Next-Row-Number'] = str(_first + _page_size)
+        return self._send('toggl v3 search', 200, [self._v3_row(entry) for entry in _entries], _headers)
+
+    def _v3_row(self, entry: dict) -> dict:
+        """time entry as an ungrouped v3 row"""
+        return {
+            'user_id': entry['uid'],
+            'username': entry['user'],
+            'project_id': entry['pid'],
+            'task_id': entry['tid'],
+            'description': entry['description'],
+            'time_entries': [{
+                'id': entry['id'],
+                'seconds': entry['dur'] // 1000,
+                'start': entry['start'],
+                'stop': entry['end'],
+                'at': entry['updated']
+            }]
+        }
+
+
+class FakeBacklogHandler(_Handler):
+    """Backlog API v2 (issue, issue list, comments, update)"""
+
+    ISSUE_PATH = re.compile(r'^/api/v2/issues/([^/]+)$')
+    COMMENTS_PATH = re.compile(r'^/api/v2/issues/([^/]+)/comments$')
+
+    def do_GET(self):
+        _url = urlparse(self.path)
+        _query = parse_qs(_url.query)
+        _match = self.COMMENTS_PATH.match(_url.path)
+        if _match:
+            _issue = self.state.issues.get(_match.group(1))
+            if not _issue:
+                return self._send('backlog not found', 404, {})
+            _min_id = int(_query.get('minId', ['0'])[0])
+            _count = int(_query.get('count', ['20'])[0])
+            _comments = [comment for comment in _issue['comments'] if comment['id'] > _min_id][:_count]
+            return self._send('backlog comments', 200, _comments)
+        _match = self.ISSUE_PATH.match(_url.path)
+        if _match:
+            _issue = self.state.issues.get(_match.group(1))
+            if not _issue:
+                return self._send('backlog not found', 404, {})
+            return self._send('backlog issue', 200, self._issue_json(_issue))
+        if _url.path == '/api/v2/issues':
+            _ids = {int(issue_id) for issue_id in _query.get('issueId[]', [])}
+            _count = int(_query.get('count', ['20'])[0])
+            _issues = [self._issue_json(issue) for issue in self.state.issues.values() if issue['id'] in _ids]
+            return self._send('backlog issue list', 200, _issues[:_count])
+        return self._send('backlog not found', 404, {})
+
+    def do_PATCH(self):
+        _url = urlparse(self.path)
+        _match = self.ISSUE_PATH.match(_url.path)
+        _issue = self.state.issues.get(_match.group(1)) if _match else None
+        if not _issue:
+            return self._send('backlog not found', 404, {})
+        _data = self._read_json()
+        with self.state.lock:
+            _comment = {
+                'id': _issue['comments'][-1]['id'] + 1 if _issue['comments'] else _issue['id'] * 100000 + 1,
+                'content': _data.get('comment'),
+                'changeLog': [{'field': 'actualHours', 'originalValue': str(_issue['actualHours']),
+                               'newValue': str(_data.get('actualHours'))}]
+            }
+            _issue['comments'].append(_comment)
+            _issue['actualHours'] = _data.get('actualHours')
+        return self._send('backlog update', 200, self._issue_json(_issue))
+
+    def _issue_json(self, issue: dict) -> dict:
+        return {'id': issue['id'], 'issueKey': issue['issueKey'], 'actualHours': issue['actualHours']}
+
+
+class FakeServers():
+    """Start fake Toggl and Backlog servers on localhost"""
+
+    def __init__(self, workload: Workload):
+        self.state = FakeState(workload)
+        self._servers = []
+        self.toggl_url = self._start(FakeTogglHandler)
+        self.backlog_url = self._start(FakeBacklogHandler)
+
+    def _start(self, handler: type) -> str:
+        _handler = type(handler.__name__, (handler,), {'state': self.state})
+        _server = ThreadingHTTPServer(('127.0.0.1', 0), _handler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        self._servers.append(_server)
+        return f'http://127.0.0.1:{_server.server_port}'
+
+    def stop(self) -> None:
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,202 @@
+"""
+End-to-end benchmark.
+
+ローカルのToggl/Backlogスタンドイン（bench/fake_servers.py）とローカルのPostgresに対して、
+WorkTimeController.import_from_toggl を実行し、実行時間・リクエスト数・ピークメモリを出力する。
+importはスタンドインのサーバー（workloadのJSON作成等）とメモリを分けるため子プロセスで実行し、
+子プロセスのピークメモリ（tracemalloc・最大RSS）を計測する。
+
+    export DB_HOST=127.0.0.1 DB_PORT=5432 DB_NAME=bench DB_USER=bench DB_PASSWORD=bench
+    python bench/run_benchmark.py --init-db --entries 5000 --issues 300 --comments 50 --latency-ms 20
+
+DBはベンチマーク専用のものを使用すること（--init-db/--reset-dbはテーブルを作成・全削除する）。
+--jsonを付けると結果を1行のJSONで出力するので、コミット間の比較に使える。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_servers import FakeServers  # noqa: E402
+from bench.fake_servers import Workload  # noqa: E402
+
+# resetで全削除するテーブル
+BENCH_TABLES = (
+    'toggl_report',
+    'toggl_issue_summary',
+    'toggl_backfill_shard',
+    'backlog_comment_cursor',
+    'backlog_sync_ledger',
+    'backlog_sync_pending',
+    'backlog_sync_retry',
+    'backlog_issue_id_map',
+    'backlog_sync_queue',
+    'toggl_daily_rollup',
+    'toggl_report_retired',
+)
+
+
+def _parse_args():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--entries', type=int, default=1000, help='Togglのtime entry数')
+    _parser.add_argument('--issues', type=int, default=100, help='Backlog issue数')
+    _parser.add_argument('--comments', type=int, default=20, help='issue毎のコメント数')
+    _parser.add_argument('--latency-ms', type=float, default=0.0, help='APIレスポンス毎に加えるレイテンシ')
+    _parser.add_argument('--backlog-workers', type=int, default=None, help='BACKLOG_MAX_WORKERS')
+    _parser.add_argument('--toggl-workers', type=int, default=None, help='TOGGL_MAX_WORKERS')
+    _parser.add_argument('--report-api', choices=('v2', 'v3'), default=None, help='TOGGL_REPORT_API')
+    _parser.add_argument('--report-page-size', type=int, default=None, help='TOGGL_REPORT_PAGE_SIZE（v3）')
+    _parser.add_argument('--full-reconcile', action='store_true', help='全issueを同期する')
+    _parser.add_argument('--init-db', action='store_true', help='ddl.sqlでテーブルを作成する')
+    _parser.add_argument('--reset-db', action='store_true', help='実行前にテーブルを全削除する')
+    _parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+    # 子プロセスでimportを実行し、結果をこのファイルに出力する（内部用）
+    _parser.add_argument('--import-result', help=argparse.SUPPRESS)
+    return _parser.parse_args()
+
+
+def _configure_env(args, servers: FakeServers) -> None:
+    """point config at the fake servers (get_configより前に呼ぶ)"""
+    _env = {
+        'TOGGL_API_TOKEN': 'bench',
+        'TOGGL_BASE_URL': servers.toggl_url,
+        'TOGGL_PAST_DAYS': str(servers.state.workload.past_days),
+        'TOGGL_IDENTITY_CACHE_PATH': os.path.join(tempfile.mkdtemp(), 'toggl_identity.json'),
+        'BACKLOG_PRJ_KEY': servers.state.workload.project_key,
+        'BACKLOG_BASE_URL': servers.backlog_url,
+        'BACKLOG_APIKEY': 'bench',
+        'BACKLOG_COMMENT': '[togglより連携]',
+        'BACKLOG_COMMENT_COUNT': '100',
+    }
+    os.environ.update(_env)
+    # ローカルのスタンドインなのでレート制限は実質無効にする（明示的に指定されていれば従う）
+    os.environ.setdefault('TOGGL_RATE_LIMIT', '100000')
+    os.environ.setdefault('TOGGL_RATE_BURST', '100000')
+    os.environ.setdefault('BACKLOG_RATE_LIMIT', '100000')
+    os.environ.setdefault('BACKLOG_RATE_BURST', '100000')
+    if args.backlog_workers:
+        os.environ['BACKLOG_MAX_WORKERS'] = str(args.backlog_workers)
+    if args.toggl_workers:
+        os.environ['TOGGL_MAX_WORKERS'] = str(args.toggl_workers)
+    if args.report_api:
+        os.environ['TOGGL_REPORT_API'] = args.report_api
+    if args.report_page_size:
+        os.environ['TOGGL_REPORT_PAGE_SIZE'] = str(args.report_page_size)
+    for key in ('DB_HOST', 'DB_PORT', 'DB_NAME', 'DB_USER', 'DB_PASSWORD'):
+        if key not in os.environ:
+            sys.exit(f'{key} is not set (local postgres for benchmark)')
+
+
+def _prepare_db(args) -> None:
+    from chalicelib.repositories import _connect_db
+    _conn = _connect_db()
+    try:
+        with _conn.cursor() as _cur:
+            if args.init_db:
+                with open(os.path.join(ROOT, 'ddl.sql'), encoding='utf-8') as _f:
+                    _cur.execute(_f.read())
+            if args.reset_db:
+                _cur.execute(f'TRUNCATE {", ".join(BENCH_TABLES)}')
+        _conn.commit()
+    finally:
+        _conn.close()
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def _run_import(full_reconcile: bool) -> dict:
+    """run import_from_toggl (子プロセスで実行する)"""
+    import resource
+
+    # app.pyと同じ組み立て（import時間も含めて計測する）
+    tracemalloc.start()
+    _started = time.perf_counter()
+    from chalicelib.controllers import WorkTimeController
+    from chalicelib.repositories import BacklogIssueRepository
+    from chalicelib.repositories import DbBacklogIssueRepository
+    from chalicelib.repositories import DbTogglReportRepository
+    from chalicelib.repositories import TogglReportSummaryRepository
+    from chalicelib.usecases import ImportFromTogglUsecase
+    WorkTimeController(ImportFromTogglUsecase(
+        TogglReportSummaryRepository(),
+        DbTogglReportRepository(),
+        BacklogIssueRepository(DbBacklogIssueRepository()))).import_from_toggl(full_reconcile)
+    _wall = time.perf_counter() - _started
+    _current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'wall_seconds': round(_wall, 3),
+        'peak_memory_kb': round(_peak / 1024, 1),
+        # Linuxではru_maxrssはKiB
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def _run_import_process(full_reconcile: bool) -> dict:
+    """run import_from_toggl in a child process (環境変数は設定済みのものを引き継ぐ)"""
+    with tempfile.TemporaryDirectory() as _dir:
+        _path = os.path.join(_dir, 'result.json')
+        _command = [sys.executable, os.path.abspath(__file__), '--import-result', _path]
+        if full_reconcile:
+            _command.append('--full-reconcile')
+        subprocess.run(_command, env=os.environ.copy(), check=True)
+        with open(_path, encoding='utf-8') as _f:
+            return json.load(_f)
+
+
+def main():
+    _args = _parse_args()
+    if _args.import_result:
+        _result = _run_import(_args.full_reconcile)
+        with open(_args.import_result, 'w', encoding='utf-8') as _f:
+            json.dump(_result, _f)
+        return
+
+    _workload = Workload(entries=_args.entries, issues=_args.issues,
+                         comments_per_issue=_args.comments, latency_ms=_args.latency_ms)
+    with FakeServers(_workload) as _servers:
+        _configure_env(_args, _servers)
+        if _args.init_db or _args.reset_db:
+            _prepare_db(_args)
+
+        _import = _run_import_process(_args.full_reconcile)
+
+        _result = {
+            'revision': _git_revision(),
+            'workload': vars(_workload),
+            'wall_seconds': _import['wall_seconds'],
+            'requests': sum(_servers.state.requests.values()),
+            'requests_by_endpoint': dict(_servers.state.requests),
+            'bytes_sent': _servers.state.bytes_sent,
+            'peak_memory_kb': _import['peak_memory_kb'],
+            'peak_rss_kb': _import['peak_rss_kb']
+        }
+
+    if _args.json:
+        print(json.dumps(_result, ensure_ascii=False))
+        return
+    print(f'revision: {_result["revision"]}')
+    print(f'workload: {_result["workload"]}')
+    print(f'wall time: {_result["wall_seconds"]}s')
+    print(f'requests: {_result["requests"]} ({_result["bytes_sent"]} bytes)')
+    for endpoint, count in sorted(_result['requests_by_endpoint'].items()):
+        print(f'  {count:8d}  {endpoint}')
+    print(f'peak memory (tracemalloc): {_result["peak_memory_kb"]} KiB')
+    print(f'peak rss (import process): {_result["peak_rss_kb"]} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""
+Application modules.
+
+define chalice app shared by app.py and chalicelib (logger).
+"""
+from chalice import Chalice
+
+app = Chalice(app_name='ExamApp')
+# productionでもcloudwatchにlog出力する
+app.debug = True
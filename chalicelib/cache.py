@@ -0,0 +1,57 @@
+"""
+Cache modules.
+
+define in-process lru cache with expiry.
+"""
+import collections
+import threading
+import time
+
+
+class LruCache():
+    """LRU cache with ttl
+    Lambdaのwarm起動間で共有する、件数上限と有効期限つきのキャッシュ
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """Initialize.
+
+        Args:
+            maxsize:int
+                保持する件数。超えたら最も古く参照されたものから削除
+            ttl:float
+                有効期限（秒）
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """get cached value. なければ（期限切れなら）None"""
+        with self._lock:
+            _item = self._data.get(key)
+            if _item is None or _item[0] < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return _item[1]
+
+    def put(self, key, value) -> None:
+        """cache value"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """clear cache"""
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,157 @@
+"""
+Config modules.
+
+define settings loaded from environment variables (config.json).
+"""
+import dataclasses
+import functools
+import os
+
+
+@dataclasses.dataclass(frozen=True)
+class Config:
+
+    """Config model.
+        config.jsonのenvironment_variablesに対応
+    """
+
+    toggl_api_token: str = ''
+    toggl_base_url: str = ''
+    toggl_past_days: int = 6
+    toggl_max_workers: int = 2
+    toggl_rate_limit: float = 1
+    toggl_rate_burst: int = 1
+    toggl_report_api: str = 'v2'
+    toggl_report_page_size: int = 500
+    toggl_identity_ttl: int = 86400
+    toggl_identity_cache_path: str = '/tmp/toggl_identity.json'
+    toggl_workspace_ids: str = ''
+    toggl_webhook_secret: str = ''
+    toggl_partition_months_ahead: int = 2
+    toggl_retention_months: int = 0
+    toggl_retention_policy: str = 'archive'
+    backlog_prj_keys: tuple = ()
+    backlog_base_url: str = ''
+    backlog_apikey: str = ''
+    backlog_comment: str = ''
+    backlog_comment_count: int = 100
+    backlog_max_workers: int = 1
+    backlog_rate_limit: float = 1
+    backlog_rate_burst: int = 1
+    backfill_max_workers: int = 2
+    backfill_safety_margin_ms: int = 60000
+    sync_debounce_seconds: int = 300
+    sync_debounce_max_seconds: int = 1800
+    sync_queue_batch_size: int = 50
+    sync_safety_margin_ms: int = 60000
+    sync_retry_base_seconds: int = 300
+    sync_retry_max_seconds: int = 21600
+    sync_retry_batch_size: int = 50
+    sync_mode: str = 'local'
+    sync_shard_size: int = 50
+    sync_local_workers: int = 2
+    sync_work_queue_url: str = ''
+    sync_result_queue_url: str = ''
+    sqs_endpoint_url: str = ''
+    sync_result_timeout_seconds: int = 840
+    rollup_timezone: str = 'Asia/Tokyo'
+    aggregate_default_days: int = 30
+    aggregate_cache_seconds: int = 300
+    aggregate_cache_size: int = 128
+    db_host: str = ''
+    db_name: str = ''
+    db_port: str = ''
+    db_user: str = ''
+    db_password: str = ''
+    db_insert_batch_size: int = 500
+    db_fetch_size: int = 2000
+    db_health_check_seconds: int = 60
+    http_pool_connections: int = 4
+    http_pool_maxsize: int = 10
+    http_timeout: float = 30
+    http_retry_total: int = 3
+    http_retry_backoff: float = 0.5
+    metrics_namespace: str = 'ExamApp'
+    log_payloads: bool = False
+    log_payload_sample_rate: float = 1.0
+
+
+@functools.lru_cache(maxsize=None)
+def get_config() -> Config:
+    """get config
+    最初に呼ばれたときに環境変数から読み込み、以降は同じConfigを返す
+    必須項目（省略時の値がないもの）は未設定ならKeyError
+
+    Args:
+        None
+
+    Return:
+        config:Config
+    """
+    _env = os.environ
+    return Config(
+        toggl_api_token=_env['TOGGL_API_TOKEN'],
+        toggl_base_url=_env['TOGGL_BASE_URL'],
+        toggl_past_days=int(_env['TOGGL_PAST_DAYS']),
+        toggl_max_workers=int(_env.get('TOGGL_MAX_WORKERS', 2)),
+        toggl_rate_limit=float(_env.get('TOGGL_RATE_LIMIT', 1)),
+        toggl_rate_burst=int(_env.get('TOGGL_RATE_BURST', 1)),
+        toggl_report_api=_env.get('TOGGL_REPORT_API', 'v2').strip().lower(),
+        toggl_report_page_size=int(_env.get('TOGGL_REPORT_PAGE_SIZE', 500)),
+        toggl_identity_ttl=int(_env.get('TOGGL_IDENTITY_TTL', 86400)),
+        toggl_identity_cache_path=_env.get('TOGGL_IDENTITY_CACHE_PATH', '/tmp/toggl_identity.json'),
+        toggl_workspace_ids=_env.get('TOGGL_WORKSPACE_IDS', ''),
+        toggl_webhook_secret=_env.get('TOGGL_WEBHOOK_SECRET', ''),
+        toggl_partition_months_ahead=int(_env.get('TOGGL_PARTITION_MONTHS_AHEAD', 2)),
+        toggl_retention_months=int(_env.get('TOGGL_RETENTION_MONTHS', 0)),
+        toggl_retention_policy=_env.get('TOGGL_RETENTION_POLICY', 'archive'),
+        backlog_prj_keys=_split(_env.get('BACKLOG_PRJ_KEYS') or _env['BACKLOG_PRJ_KEY']),
+        backlog_base_url=_env['BACKLOG_BASE_URL'],
+        backlog_apikey=_env['BACKLOG_APIKEY'],
+        backlog_comment=_env['BACKLOG_COMMENT'],
+        backlog_comment_count=int(_env['BACKLOG_COMMENT_COUNT']),
+        backlog_max_workers=int(_env.get('BACKLOG_MAX_WORKERS', 1)),
+        backlog_rate_limit=float(_env.get('BACKLOG_RATE_LIMIT', 1)),
+        backlog_rate_burst=int(_env.get('BACKLOG_RATE_BURST', 1)),
+        backfill_max_workers=int(_env.get('BACKFILL_MAX_WORKERS', 2)),
+        backfill_safety_margin_ms=int(_env.get('BACKFILL_SAFETY_MARGIN_MS', 60000)),
+        sync_debounce_seconds=int(_env.get('SYNC_DEBOUNCE_SECONDS', 300)),
+        sync_debounce_max_seconds=int(_env.get('SYNC_DEBOUNCE_MAX_SECONDS', 1800)),
+        sync_queue_batch_size=int(_env.get('SYNC_QUEUE_BATCH_SIZE', 50)),
+        sync_safety_margin_ms=int(_env.get('SYNC_SAFETY_MARGIN_MS', 60000)),
+        sync_retry_base_seconds=int(_env.get('SYNC_RETRY_BASE_SECONDS', 300)),
+        sync_retry_max_seconds=int(_env.get('SYNC_RETRY_MAX_SECONDS', 21600)),
+        sync_retry_batch_size=int(_env.get('SYNC_RETRY_BATCH_SIZE', 50)),
+        sync_mode=_env.get('SYNC_MODE', 'local'),
+        sync_shard_size=int(_env.get('SYNC_SHARD_SIZE', 50)),
+        sync_local_workers=int(_env.get('SYNC_LOCAL_WORKERS', 2)),
+        sync_work_queue_url=_env.get('SYNC_WORK_QUEUE_URL', ''),
+        sync_result_queue_url=_env.get('SYNC_RESULT_QUEUE_URL', ''),
+        sqs_endpoint_url=_env.get('SQS_ENDPOINT_URL', ''),
+        sync_result_timeout_seconds=int(_env.get('SYNC_RESULT_TIMEOUT_SECONDS', 840)),
+        rollup_timezone=_env.get('ROLLUP_TIMEZONE', 'Asia/Tokyo'),
+        aggregate_default_days=int(_env.get('AGGREGATE_DEFAULT_DAYS', 30)),
+        aggregate_cache_seconds=int(_env.get('AGGREGATE_CACHE_SECONDS', 300)),
+        aggregate_cache_size=int(_env.get('AGGREGATE_CACHE_SIZE', 128)),
+        db_host=_env['DB_HOST'],
+        db_name=_env['DB_NAME'],
+        db_port=_env['DB_PORT'],
+        db_user=_env['DB_USER'],
+        db_password=_env['DB_PASSWORD'],
+        db_insert_batch_size=int(_env.get('DB_INSERT_BATCH_SIZE', 500)),
+        db_fetch_size=int(_env.get('DB_FETCH_SIZE', 2000)),
+        db_health_check_seconds=int(_env.get('DB_HEALTH_CHECK_SECONDS', 60)),
+        http_pool_connections=int(_env.get('HTTP_POOL_CONNECTIONS', 4)),
+        http_pool_maxsize=int(_env.get('HTTP_POOL_MAXSIZE', 10)),
+        http_timeout=float(_env.get('HTTP_TIMEOUT', 30)),
+        http_retry_total=int(_env.get('HTTP_RETRY_TOTAL', 3)),
+        http_retry_backoff=float(_env.get('HTTP_RETRY_BACKOFF', 0.5)),
+        metrics_namespace=_env.get('METRICS_NAMESPACE', 'ExamApp'),
+        log_payloads=_env.get('LOG_PAYLOADS', 'false').lower() in ('1', 'true', 'yes'),
+        log_payload_sample_rate=float(_env.get('LOG_PAYLOAD_SAMPLE_RATE', 1.0))
+    )
+
+
+def _split(value: str) -> tuple:
+    """split comma separated value"""
+    return tuple(item.strip() for item in value.split(',') if item.strip())
@@ -3,13 +3,16 @@ Controller modules.
 
 define contollers.
 """
-from chalice import Chalice
+import datetime
+from chalicelib.usecases import BackfillFromTogglUsecase
+from chalicelib.usecases import CheckTogglSummaryUsecase
+from chalicelib.usecases import CoordinateBacklogSyncUsecase
+from chalicelib.usecases import EnqueueIssueEventsUsecase
+from chalicelib.usecases import GetTogglAggregatesUsecase
 from chalicelib.usecases import ImportFromTogglUsecase
-
-
-app = Chalice(app_name='ExamApp')
-# productionでもcloudwatchにlog出力する
-app.debug = True
+from chalicelib.usecases import MaintainTogglPartitionsUsecase
+from chalicelib.usecases import SyncBacklogShardUsecase
+from chalicelib.usecases import SyncQueuedIssuesUsecase
 
 
 class WorkTimeController:
@@ -23,14 +26,248 @@ class WorkTimeController:
         self.import_from_toggl_usecase = import_from_toggl_usecase
         pass
 
-    def import_from_toggl(self):
+    def import_from_toggl(self, full_reconcile: bool = False, get_remaining_time_in_millis=None):
         """ import from toggl data
 
         Args:
-            None
+            full_reconcile:bool
+                Trueの場合、すべてのBacklog issueを同期する
+            get_remaining_time_in_millis:
+                Lambdaの残り実行時間を返す関数（足りなくなったら残りのissueは次回に回す）
+
+        Return:
+            Boolean
+
+        """
+        return self.import_from_toggl_usecase.handle(full_reconcile, get_remaining_time_in_millis)
+
+    def retry_failed(self, limit: int = None, get_remaining_time_in_millis=None):
+        """ retry failed issues
+
+        Args:
+            limit:int
+                1回に再同期するissue数
+            get_remaining_time_in_millis:
+                Lambdaの残り実行時間を返す関数
+
+        Return:
+            List[BacklogIssueSyncResult]
+                再同期したissue毎の処理結果
+
+        """
+        return self.import_from_toggl_usecase.retry_failed(limit, get_remaining_time_in_millis)
+
+
+class BacklogSyncController:
+    """Distributed backlog sync contoroller
+    """
+
+    def __init__(
+            self,
+            coordinate_backlog_sync_usecase: CoordinateBacklogSyncUsecase = None,
+            sync_backlog_shard_usecase: SyncBacklogShardUsecase = None):
+
+        self.coordinate_backlog_sync_usecase = coordinate_backlog_sync_usecase
+        self.sync_backlog_shard_usecase = sync_backlog_shard_usecase
+        pass
+
+    def coordinate(self, full_reconcile: bool = False, get_remaining_time_in_millis=None):
+        """ import toggl data and distribute backlog sync to workers
+
+        Args:
+            full_reconcile:bool
+                Trueの場合、すべてのBacklog issueを同期する
+            get_remaining_time_in_millis:
+                Lambdaの残り実行時間を返す関数
+
+        Return:
+            dict
+                shard数、結果を受け取ったshard数、issueの同期件数
+
+        """
+        return self.coordinate_backlog_sync_usecase.handle(full_reconcile, get_remaining_time_in_millis)
+
+    def sync_shard(self, message: dict, get_remaining_time_in_millis=None):
+        """ sync backlog issues of a shard
+
+        Args:
+            message:dict
+                coordinatorから受け取ったshard
+            get_remaining_time_in_millis:
+                Lambdaの残り実行時間を返す関数
+
+        Return:
+            BacklogSyncShardResult
+
+        """
+        return self.sync_backlog_shard_usecase.handle(message, get_remaining_time_in_millis)
+
+
+class TogglEventController:
+    """Toggl change event contoroller
+    """
+
+    def __init__(
+            self,
+            enqueue_issue_events_usecase: EnqueueIssueEventsUsecase):
+
+        self.enqueue_issue_events_usecase = enqueue_issue_events_usecase
+        pass
+
+    def receive(self, issue_keys: list, toggl_ids: list = None):
+        """ receive toggl change event
+
+        Args:
+            issue_keys:list
+                変更があったBacklog issueのkey
+            toggl_ids:list
+                変更があったtime entryのid（登録済みのissue keyを調べる）
+
+        Return:
+            int
+                同期待ちにしたissue数
+
+        """
+        return self.enqueue_issue_events_usecase.handle(issue_keys, toggl_ids)
+
+
+class SyncQueueController:
+    """Sync queue contoroller
+    """
+
+    def __init__(
+            self,
+            sync_queued_issues_usecase: SyncQueuedIssuesUsecase):
+
+        self.sync_queued_issues_usecase = sync_queued_issues_usecase
+        pass
+
+    def drain(self, limit: int = None):
+        """ sync queued issues
+
+        Args:
+            limit:int
+                1回に同期するissue数
+
+        Return:
+            int
+                同期できたissue数
+
+        """
+        return self.sync_queued_issues_usecase.handle(limit)
+
+
+class TogglAggregateController:
+    """Toggl aggregate contoroller
+    """
+
+    def __init__(
+            self,
+            get_toggl_aggregates_usecase: GetTogglAggregatesUsecase):
+
+        self.get_toggl_aggregates_usecase = get_toggl_aggregates_usecase
+        pass
+
+    def get_aggregates(self, group_by: str, since: datetime.date = None, until: datetime.date = None,
+                       issue_key: str = None, user_name: str = None):
+        """ get toggl aggregates
+
+        Args:
+            group_by:str
+                集計単位（issues、users、days）
+            since:datetime.date
+                集計開始日
+            until:datetime.date
+                集計終了日（含む）
+            issue_key:str
+                Backlog issueのkeyで絞り込む
+            user_name:str
+                ユーザー名で絞り込む
+
+        Return:
+            List[TogglAggregate]
+
+        """
+        return self.get_toggl_aggregates_usecase.handle(group_by, since, until, issue_key, user_name)
+
+
+class TogglBackfillController:
+    """Toggl backfill contoroller
+    """
+
+    def __init__(
+            self,
+            backfill_from_toggl_usecase: BackfillFromTogglUsecase):
+
+        self.backfill_from_toggl_usecase = backfill_from_toggl_usecase
+        pass
+
+    def backfill_from_toggl(self, since: datetime.date, until: datetime.date,
+                            shard_days: int = 7, get_remaining_time_in_millis=None):
+        """ backfill historical toggl data
+
+        Args:
+            since:datetime.date
+                開始日
+            until:datetime.date
+                終了日（含む）
+            shard_days:int
+                1shardの日数
+            get_remaining_time_in_millis:
+                Lambdaの残り実行時間を返す関数
 
         Return:
             Boolean
+                すべてのshardが完了していればTrue
+
+        """
+        return self.backfill_from_toggl_usecase.handle(
+            since, until, shard_days, get_remaining_time_in_millis)
+
+
+class TogglPartitionController:
+    """Toggl report partition contoroller
+    """
+
+    def __init__(
+            self,
+            maintain_toggl_partitions_usecase: MaintainTogglPartitionsUsecase):
+
+        self.maintain_toggl_partitions_usecase = maintain_toggl_partitions_usecase
+        pass
+
+    def maintain(self):
+        """ maintain toggl report partitions
+
+        Return:
+            dict
+                作成・切り離したパーティション
+
+        """
+        return self.maintain_toggl_partitions_usecase.handle()
+
+
+class TogglSummaryController:
+    """Toggl summary contoroller
+    """
+
+    def __init__(
+            self,
+            check_toggl_summary_usecase: CheckTogglSummaryUsecase):
+
+        self.check_toggl_summary_usecase = check_toggl_summary_usecase
+        pass
+
+    def check_summary(self, repair: bool = False):
+        """ check toggl summary table
+
+        Args:
+            repair:bool
+                Trueの場合、不一致があれば集計テーブルを作り直す
+
+        Return:
+            int
+                不一致だったBacklogIssueの件数
 
         """
-        return self.import_from_toggl_usecase.handle()
+        return self.check_toggl_summary_usecase.handle(repair)
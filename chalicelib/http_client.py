@@ -0,0 +1,201 @@
+"""
+Http client modules.
+
+define shared http client for outbound apis.
+"""
+from chalicelib.config import get_config
+from chalicelib.metrics import current_metrics
+from chalicelib.rate_limiter import RateLimiter
+from typing import TYPE_CHECKING
+import threading
+import time
+
+if TYPE_CHECKING:
+    import requests
+
+# リトライ対象のステータスコード（429はrequest内でRateLimiterと合わせて処理）
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+THROTTLED_STATUS_CODE = 429
+
+
+class HttpClient():
+    """Shared http client
+    requests.Sessionでkeep-aliveのコネクションを使い回す
+    """
+
+    def __init__(
+            self,
+            pool_connections: int = None,
+            pool_maxsize: int = None,
+            timeout: float = None,
+            retry_total: int = None,
+            retry_backoff: float = None):
+        """Initialize.
+        コネクションプールとリトライ設定。省略した項目はconfig（HTTP_*）の値
+
+        Args:
+            pool_connections:int
+                ホスト毎のコネクションプール数
+            pool_maxsize:int
+                1プールあたりの最大コネクション数（並列worker数以上にする）
+            timeout:float
+                接続・読込のタイムアウト秒数
+            retry_total:int
+                5xx時のリトライ回数、429時の再送回数
+            retry_backoff:float
+                リトライ間隔の係数（backoff_factor）
+        """
+        # requests/urllib3はimportが重いため、クライアント作成時に読み込む
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        _config = get_config()
+        pool_connections = pool_connections or _config.http_pool_connections
+        pool_maxsize = pool_maxsize or _config.http_pool_maxsize
+        timeout = timeout or _config.http_timeout
+        retry_total = _config.http_retry_total if retry_total is None else retry_total
+        retry_backoff = _config.http_retry_backoff if retry_backoff is None else retry_backoff
+
+        # PATCHは冪等でないため（コメントが二重登録される）、urllib3の既定どおりリトライしない
+        # POSTはToggl Reports API v3の検索（読み取りのみ）で使うため、GETと同様にリトライする
+        # Retry-Afterを見るとurllib3が429もリトライしてしまうため無効にする（429はrequestで処理）
+        _retry = Retry(
+            total=retry_total,
+            backoff_factor=retry_backoff,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {'POST'},
+            raise_on_status=False,
+            respect_retry_after_header=False)
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=_retry)
+        _session = requests.Session()
+        _session.mount('https://', self._adapter)
+        _session.mount('http://', self._adapter)
+        _session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        self.session = _session
+        self.timeout = timeout
+        self.retry_total = retry_total
+        self.retry_backoff = retry_backoff
+        self._lock = threading.Lock()
+        self._request_count = 0
+        self._opened_base = 0
+        self._first_response_at = None
+
+    def get(self, url: str, **kwargs) -> 'requests.Response':
+        """GET request"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> 'requests.Response':
+        """POST request"""
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> 'requests.Response':
+        """PATCH request"""
+        return self.request('PATCH', url, **kwargs)
+
+    def request(self, method: str, url: str, rate_limiter: RateLimiter = None,
+                **kwargs) -> 'requests.Response':
+        """send request
+        timeout未指定の場合は共通のタイムアウトを使用
+        rate_limiter指定時は送信前に待機し、レスポンスのrate limitヘッダーを反映する
+        429の場合はRetry-After（なければbackoff）だけ待って再送する（処理されていないのでPATCHも再送）
+
+        Args:
+            method:str
+                HTTPメソッド
+            url:str
+                リクエスト先URL
+            rate_limiter:RateLimiter
+                API毎のRateLimiter
+            kwargs:
+                requests.Session.requestに渡す引数
+
+        Return:
+            response:requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        _attempt = 0
+        while True:
+            if rate_limiter:
+                rate_limiter.acquire()
+            _res = self.session.request(method, url, **kwargs)
+            with self._lock:
+                self._request_count += 1
+                if self._first_response_at is None:
+                    self._first_response_at = time.monotonic()
+            current_metrics().record_request(rate_limiter.name if rate_limiter else 'http',
+                                             len(_res.content))
+            if rate_limiter:
+                rate_limiter.update_from_headers(_res.headers)
+            if _res.status_code != THROTTLED_STATUS_CODE or _attempt >= self.retry_total:
+                if rate_limiter and _res.status_code != THROTTLED_STATUS_CODE:
+                    rate_limiter.on_success()
+                return _res
+            _attempt += 1
+            if rate_limiter:
+                rate_limiter.on_throttled(_res.headers.get('Retry-After'))
+            else:
+                time.sleep(self.retry_backoff * (2 ** _attempt))
+
+    def stats(self) -> dict:
+        """connection stats
+        urllib3のコネクションプールから新規接続数を集計し、再利用数を算出（reset_stats以降）
+
+        Args:
+            None
+
+        Return:
+            stats:dict
+                requests:リクエスト数、opened:新規接続数、reused:再利用した接続数
+                first_response_at:最初のレスポンスを受けた時刻（time.monotonic）
+        """
+        _opened = self._opened_connections()
+        with self._lock:
+            _requests = self._request_count
+            _opened -= self._opened_base
+            _first_response_at = self._first_response_at
+        return {
+            'requests': _requests,
+            'opened': _opened,
+            'reused': max(0, _requests - _opened),
+            'first_response_at': _first_response_at
+        }
+
+    def reset_stats(self) -> None:
+        """reset stats
+        Lambdaのwarm起動でクライアントを使い回すため、handler開始時に呼び出す
+        """
+        _opened = self._opened_connections()
+        with self._lock:
+            self._request_count = 0
+            self._opened_base = _opened
+            self._first_response_at = None
+
+    def _opened_connections(self) -> int:
+        """count opened connections of all pools"""
+        _pools = self._adapter.poolmanager.pools
+        return sum(_pools[key].num_connections for key in _pools.keys())
+
+
+_http_client: HttpClient = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """get shared http client
+    Toggl/Backlogの各repositoryで共有するHttpClientを返す（Lambdaのwarm起動間でも再利用）
+
+    Args:
+        None
+
+    Return:
+        http_client:HttpClient
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient()
+        return _http_client
@@ -0,0 +1,174 @@
+"""
+Metrics modules.
+
+define per-run metrics emitted as CloudWatch embedded metric format (EMF).
+"""
+from chalicelib.application import app
+from chalicelib.config import get_config
+import contextlib
+import json
+import random
+import threading
+import time
+
+# EMFの1メトリクスあたりの値の上限
+EMF_MAX_VALUES = 100
+
+
+class RunMetrics():
+    """Run metrics
+    1回の実行（ImportFromTogglUsecase.handle等）のフェーズ毎の時間、issue毎の時間、
+    リクエスト数・受信バイト数、DB登録件数を集計する。workerスレッドから呼ばれるためlockで保護
+    """
+
+    def __init__(self, operation: str):
+        """Initialize.
+
+        Args:
+            operation:str
+                実行内容（EMFのディメンション）
+        """
+        self.operation = operation
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._phases = {}
+        self._counters = {}
+        self._issues = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """measure phase
+        withブロックの処理時間を{name}_msに加算する（複数回・並列に呼ばれた場合は合計）
+
+        Args:
+            name:str
+                フェーズ名
+        """
+        _started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - _started)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """add phase time"""
+        with self._lock:
+            self._phases[name] = self._phases.get(name, 0.0) + seconds
+
+    def incr(self, name: str, value: int = 1) -> None:
+        """increment counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def record_request(self, api: str, size: int) -> None:
+        """record api request
+
+        Args:
+            api:str
+                API名（toggl、backlog）
+            size:int
+                受信したbody（展開後）のバイト数
+        """
+        with self._lock:
+            self._counters[f'{api}_requests'] = self._counters.get(f'{api}_requests', 0) + 1
+            self._counters[f'{api}_bytes'] = self._counters.get(f'{api}_bytes', 0) + size
+
+    def record_issue(self, issue_key: str, seconds: float) -> None:
+        """record issue latency"""
+        with self._lock:
+            self._issues[issue_key] = seconds
+
+    def to_emf(self) -> list:
+        """build EMF documents
+        issue毎の時間はEMF_MAX_VALUES件ずつに分けて出力する
+
+        Args:
+            None
+
+        Return:
+            documents:list
+                CloudWatch embedded metric formatのdict
+        """
+        with self._lock:
+            _values = {f'{name}_ms': round(seconds * 1000, 1) for name, seconds in self._phases.items()}
+            _values.update(self._counters)
+            _issues = {key: round(seconds * 1000, 1) for key, seconds in self._issues.items()}
+        _values['total_ms'] = round((time.perf_counter() - self._started) * 1000, 1)
+        _values['issues'] = len(_issues)
+
+        _documents = [self._emf_document(_values)]
+        _issue_items = list(_issues.items())
+        for i in range(0, len(_issue_items), EMF_MAX_VALUES):
+            _chunk = dict(_issue_items[i:i + EMF_MAX_VALUES])
+            _document = self._emf_document({'issue_latency_ms': list(_chunk.values())})
+            # issue毎の値はメトリクスではなくログのプロパティとして残す
+            _document['issue_latency'] = _chunk
+            _documents.append(_document)
+        return _documents
+
+    def emit(self) -> None:
+        """emit metrics
+        EMFのJSONを1行ずつ標準出力に出す（Lambdaではそのままメトリクスになる）
+        """
+        for document in self.to_emf():
+            print(json.dumps(document, ensure_ascii=False))
+
+    def _emf_document(self, values: dict) -> dict:
+        """wrap values with EMF metadata"""
+        _metrics = []
+        for name in values:
+            _unit = 'Milliseconds' if name.endswith('_ms') else 'Bytes' if name.endswith('_bytes') else 'Count'
+            _metrics.append({'Name': name, 'Unit': _unit})
+        _document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': get_config().metrics_namespace,
+                    'Dimensions': [['Operation']],
+                    'Metrics': _metrics
+                }]
+            },
+            'Operation': self.operation
+        }
+        _document.update(values)
+        return _document
+
+
+# 実行中のRunMetrics（スレッドをまたいで共有するためmodule変数）
+_current_metrics: RunMetrics = RunMetrics('none')
+
+
+def start_run_metrics(operation: str) -> RunMetrics:
+    """start run metrics
+    新しいRunMetricsを作成し、current_metrics()で参照できるようにする
+
+    Args:
+        operation:str
+            実行内容
+
+    Return:
+        metrics:RunMetrics
+    """
+    global _current_metrics
+    _current_metrics = RunMetrics(operation)
+    return _current_metrics
+
+
+def current_metrics() -> RunMetrics:
+    """get current run metrics"""
+    return _current_metrics
+
+
+def log_payload(label: str, payload) -> None:
+    """log api payload
+    APIのレスポンス等のログ出力。LOG_PAYLOADSが有効な場合のみ、LOG_PAYLOAD_SAMPLE_RATEの割合で出力する
+
+    Args:
+        label:str
+            ログのラベル
+        payload:
+            出力する内容
+    """
+    _config = get_config()
+    if _config.log_payloads and random.random() < _config.log_payload_sample_rate:
+        app.log.info(f'[{label}]{payload}')
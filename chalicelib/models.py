@@ -4,6 +4,7 @@ Mode modules.
 define data structure.
 """
 import dataclasses
+import datetime
 import os
 
 
@@ -28,25 +29,180 @@ class TogglReportDetail:
 @dataclasses.dataclass
 class TogglReportSummary:
 
-    """Toggl report summary model."""
+    """Toggl report summary model.
+        drift  # 前回Backlogと同期した合計時間（backlog_sync_ledger）との差（ミリ秒）。同期の優先順位
+    """
 
     backlog_issue_key: str = ''
     sum_dur: int = None
     sum_dur_hours: float = None
+    drift: int = 0
+
+
+@dataclasses.dataclass
+class TogglIssueSummaryDiff:
+
+    """Toggl issue summary diff model.
+        summary_*  # 集計テーブル（toggl_issue_summary）の値
+        live_*  # toggl_reportをgroup byした値
+    """
+
+    backlog_issue_key: str = ''
+    summary_sum_dur: int = None
+    summary_entry_count: int = None
+    live_sum_dur: int = None
+    live_entry_count: int = None
+
+
+@dataclasses.dataclass
+class TogglSyncResult:
+
+    """Toggl sync result model.
+        直近のtogglデータとDBの差分同期の結果（件数）
+    """
+
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+
+
+@dataclasses.dataclass
+class TogglReportWindow:
+
+    """Toggl report window model.
+        Detailed Report APIで取得する期間。since〜until（timezoneの日付、両端含む）
+        timezone  # Togglユーザーのタイムゾーン（APIはsince/untilをこのタイムゾーンの日付として扱う）
+    """
+
+    since: datetime.date = None
+    until: datetime.date = None
+    timezone: str = 'UTC'
+
+
+@dataclasses.dataclass
+class TogglAggregate:
+
+    """Toggl aggregate model.
+        日次集計（toggl_daily_rollup）をissue・ユーザー・日毎に合計したもの
+        key  # backlog_issue_key、user_name、日付（ISO形式）のいずれか
+    """
+
+    key: str = ''
+    sum_dur: int = 0
+    sum_dur_hours: float = 0.0
+    entry_count: int = 0
+
+
+@dataclasses.dataclass
+class TogglBackfillShard:
+
+    """Toggl backfill shard model.
+        since〜until（両端含む）のtogglデータを取り込む単位
+    """
+
+    since: datetime.date = None
+    until: datetime.date = None
+    status: str = 'pending'
+    entry_count: int = 0
 
 
 @dataclasses.dataclass
 class BacklogIssue:
 
     """Backlog issue model.
-        comments[n]['content']  # コメント文
-        comments[n]['changeLog']  # 変更内容
-        comments[n]['changeLog']['field']  # 変更項目
-        comments[n]['changeLog']['originalValue']  # 変更前の値
-        comments[n]['changeLog']['newValue']  # 変更後の値
+        manual_actual_hours  # コメントの変更履歴から集計した手動登録の実績時間
     """
 
     issue_key: str = ''
     actual_hours: float = None
     manual_actual_hours: float = 0.0
-    comments: list = None
+
+
+@dataclasses.dataclass
+class BacklogCommentCursor:
+
+    """Backlog comment cursor model.
+        last_comment_id  # 集計済みの最後のコメントid
+        manual_actual_hours  # last_comment_idまでの手動登録の実績時間（丸め前）
+    """
+
+    issue_key: str = ''
+    last_comment_id: int = 0
+    manual_actual_hours: float = 0.0
+
+
+@dataclasses.dataclass
+class BacklogSyncQueueItem:
+
+    """Backlog sync queue item model.
+        Togglの変更イベントで登録された同期待ちのissue
+        due_at  # 同期する時刻（debounce）
+        event_count  # まとめたイベント数
+    """
+
+    issue_key: str = ''
+    due_at: datetime.datetime = None
+    event_count: int = 0
+
+
+@dataclasses.dataclass
+class BacklogSyncRetryItem:
+
+    """Backlog sync retry item model.
+        同期に失敗し、再同期を待っているissue
+        attempts  # 失敗した回数
+        next_retry_at  # 再同期する時刻（失敗する毎に待ち時間を倍にする）
+    """
+
+    issue_key: str = ''
+    attempts: int = 0
+    next_retry_at: datetime.datetime = None
+    last_error: str = ''
+
+
+@dataclasses.dataclass
+class BacklogSyncShard:
+
+    """Backlog sync shard model.
+        coordinatorがworkerに渡す、同期するissueの一部
+        run_id  # coordinatorの実行毎のid
+        shard  # shard番号（0〜shards-1）
+    """
+
+    run_id: str = ''
+    shard: int = 0
+    shards: int = 0
+    summaries: list = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class BacklogSyncShardResult:
+
+    """Backlog sync shard result model.
+        workerがcoordinatorに返す、shardの同期結果の件数
+        errors  # 失敗したissue keyとエラー内容
+    """
+
+    run_id: str = ''
+    shard: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    deferred: int = 0
+    errors: dict = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class BacklogIssueSyncResult:
+
+    """Backlog issue sync result model.
+        issue毎の同期結果。updated:Backlogを更新したか、error:発生した例外
+        deferred:Lambdaの残り時間が足りず次回に回したか、not_found:Backlogにissueがなかったか
+    """
+
+    backlog_issue_key: str = ''
+    updated: bool = False
+    error: Exception = None
+    deferred: bool = False
+    not_found: bool = False
@@ -0,0 +1,191 @@
+"""
+Rate limiter modules.
+
+define token bucket rate limiter for outbound apis.
+"""
+from chalicelib.config import get_config
+import email.utils
+import threading
+import time
+
+# 1秒あたりの最小リクエスト数（429が続いてもこれ以下には下げない）
+MIN_RATE = 0.05
+# 429が返ってこない間、1リクエストごとに上限の何割ずつ戻すか
+RATE_RECOVERY = 0.05
+
+
+class RateLimiter():
+    """Token bucket rate limiter
+    APIごとに1つ作成し、リクエスト前にacquireで待機する
+    429を受けたらrateを半分にし、成功が続けば上限まで徐々に戻す（AIMD）
+    """
+
+    def __init__(self, name: str, rate: float, burst: int = 1):
+        """Initialize.
+
+        Args:
+            name:str
+                API名（ログ・統計用）
+            rate:float
+                1秒あたりのリクエスト数の上限
+            burst:int
+                連続して送れるリクエスト数（bucketの容量）
+        """
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._throttled = 0
+
+    def acquire(self) -> float:
+        """acquire token
+        tokenが足りなければ補充されるまで待機する（先に予約するので待機順は到着順）
+
+        Args:
+            None
+
+        Return:
+            wait:float
+                待機した秒数
+        """
+        with self._lock:
+            _now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (_now - self._updated) * self.rate)
+            self._updated = _now
+            self._tokens -= 1
+            _wait = max(0.0, -self._tokens / self.rate, self._blocked_until - _now)
+            self._requests += 1
+            if _wait > 0:
+                self._waits += 1
+                self._wait_seconds += _wait
+        if _wait > 0:
+            time.sleep(_wait)
+        return _wait
+
+    def update_from_headers(self, headers) -> None:
+        """update from rate limit headers
+        X-RateLimit-Remaining/X-RateLimit-Reset（Backlog等）があれば、残数に合わせてtokenを減らす
+        残数が0ならリセット時刻まで待機させる
+
+        Args:
+            headers:
+                レスポンスヘッダー
+        """
+        _remaining = headers.get('X-RateLimit-Remaining')
+        if _remaining is None:
+            return
+        try:
+            _remaining = int(_remaining)
+            _reset = float(headers.get('X-RateLimit-Reset') or 0)
+        except ValueError:
+            return
+        with self._lock:
+            self._tokens = min(self._tokens, _remaining)
+            if _remaining <= 0 and _reset:
+                # Resetはepoch秒
+                self._blocked_until = max(self._blocked_until,
+                                          time.monotonic() + max(0.0, _reset - time.time()))
+
+    def on_throttled(self, retry_after: str = None) -> None:
+        """on 429
+        rateを半分にし、Retry-Afterがあればその時間まで待機させる
+
+        Args:
+            retry_after:str
+                Retry-Afterヘッダー（秒数 or HTTP日付）
+        """
+        _delay = _parse_retry_after(retry_after)
+        with self._lock:
+            self._throttled += 1
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self._blocked_until = max(self._blocked_until,
+                                      time.monotonic() + (_delay if _delay is not None else 1 / self.rate))
+
+    def on_success(self) -> None:
+        """on success
+        rateを上限まで少しずつ戻す
+        """
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY)
+
+    def stats(self) -> dict:
+        """rate limiter stats
+
+        Args:
+            None
+
+        Return:
+            stats:dict
+                requests:リクエスト数、waits:待機した回数、wait_seconds:待機した合計秒数
+                throttled:429を受けた回数、rate:現在のrate
+        """
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'waits': self._waits,
+                'wait_seconds': round(self._wait_seconds, 3),
+                'throttled': self._throttled,
+                'rate': round(self.rate, 3)
+            }
+
+
+def _parse_retry_after(retry_after: str) -> float:
+    """parse Retry-After header (seconds or HTTP-date)"""
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """get shared rate limiter
+    API名ごとに共有のRateLimiterを返す
+    上限はconfigの{name}_rate_limit（{NAME}_RATE_LIMIT、1秒あたりのリクエスト数）、{name}_rate_burstで設定
+
+    Args:
+        name:str
+            API名（toggl、backlog）
+
+    Return:
+        rate_limiter:RateLimiter
+    """
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            _config = get_config()
+            _rate_limiters[name] = RateLimiter(
+                name,
+                getattr(_config, f'{name}_rate_limit'),
+                getattr(_config, f'{name}_rate_burst'))
+        return _rate_limiters[name]
+
+
+def rate_limiter_stats() -> dict:
+    """stats of all rate limiters
+
+    Args:
+        None
+
+    Return:
+        stats:dict
+            API名ごとのRateLimiter.stats()
+    """
+    with _rate_limiters_lock:
+        return {name: limiter.stats() for name, limiter in _rate_limiters.items()}
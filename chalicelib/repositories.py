@@ -3,96 +3,560 @@ Repository modules.
 
 define persistence logic.
 """
-from chalice import Chalice
+from chalicelib.application import app
+from chalicelib.models import BacklogCommentCursor
 from chalicelib.models import BacklogIssue
+from chalicelib.models import BacklogSyncQueueItem
+from chalicelib.models import BacklogSyncRetryItem
+from chalicelib.models import TogglAggregate
+from chalicelib.models import TogglBackfillShard
+from chalicelib.models import TogglIssueSummaryDiff
 from chalicelib.models import TogglReportDetail
 from chalicelib.models import TogglReportSummary
+from chalicelib.models import TogglReportWindow
+from chalicelib.models import TogglSyncResult
 from chalicelib.error import TogglAPIError
 from chalicelib.error import TogglDBError
 from chalicelib.error import BacklogAPIError
+from chalicelib.config import get_config
+from chalicelib.http_client import HttpClient
+from chalicelib.http_client import get_http_client
+from chalicelib.metrics import current_metrics
+from chalicelib.metrics import log_payload
+from chalicelib.rate_limiter import get_rate_limiter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+from typing import Iterator
 from typing import List
-import os
+import collections
 import datetime
-import requests
+import functools
+import hashlib
+import itertools
+import threading
+import time
 import json
+import math
 import re
-import psycopg2
-import psycopg2.extras
 
-app = Chalice(app_name='ExamApp')
-# productionでもcloudwatchにlog出力する
-app.debug = True
 
-# 定数（config.json）
-TOGGL_API_TOKEN = os.environ['TOGGL_API_TOKEN']
-TOGGL_BASE_URL = os.environ['TOGGL_BASE_URL']
-TOGGL_PAST_DAYS = int(os.environ['TOGGL_PAST_DAYS'])
-BACKLOG_PRJ_KEY = os.environ['BACKLOG_PRJ_KEY']
-BACKLOG_BASE_URL = os.environ['BACKLOG_BASE_URL']
-BACKLOG_APIKEY = os.environ['BACKLOG_APIKEY']
-BACKLOG_COMMENT = os.environ['BACKLOG_COMMENT']
-BACKLOG_COMMENT_COUNT = os.environ['BACKLOG_COMMENT_COUNT']
+# backfill shardの状態
+BACKFILL_SHARD_PENDING = 'pending'
+BACKFILL_SHARD_DONE = 'done'
+
+# TogglのDetailed Report API（v2：ページ番号、v3：first_row_numberによるカーソル）
+TOGGL_REPORT_APIS = ('v2', 'v3')
+TOGGL_V3_NEXT_ROW_HEADER = 'X-Next-Row-Number'
+
+# Backlogのissue一覧APIで1回に取得できる件数の上限
+BACKLOG_ISSUE_LIST_MAX = 100
+
+# toggl_reportの月次パーティション（toggl_report_pYYYYMM。範囲はUTCの月初〜翌月初）
+TOGGL_REPORT_PARTITION_PREFIX = 'toggl_report_p'
+TOGGL_REPORT_DEFAULT_PARTITION = 'toggl_report_default'
+TOGGL_ARCHIVE_SCHEMA = 'toggl_archive'
+RETENTION_POLICIES = ('archive', 'drop')
+
+# issue毎の集計（toggl_report + 保存期間を過ぎて切り離したパーティションの集計）
+_LIVE_SUMMARY_SQL = ('SELECT backlog_issue_key, sum(sum_dur) AS sum_dur, sum(entry_count) AS entry_count '
+                     'FROM (SELECT backlog_issue_key, sum(dur) AS sum_dur, count(*) AS entry_count '
+                     'FROM toggl_report WHERE backlog_issue_key IS NOT NULL '
+                     'GROUP BY backlog_issue_key '
+                     'UNION ALL SELECT backlog_issue_key, sum_dur, entry_count FROM toggl_report_retired) u '
+                     'GROUP BY backlog_issue_key')
+
+# 集計APIの集計単位と、toggl_daily_rollupの列
+AGGREGATE_GROUP_COLUMNS = {
+    'issues': 'backlog_issue_key',
+    'users': 'user_name',
+    'days': 'day'
+}
+
+
+def _connect_db():
+    """connect db
+    config.jsonのDB設定でPostgresに接続する
+
+    Args:
+        None
+
+    Return:
+        conn:psycopg2.extensions.connection
+            autocommit無効、DictCursorのコネクション
+    """
+    # psycopg2はimportが重いため、DBを使うときに読み込む
+    import psycopg2
+    import psycopg2.extras
+    _config = get_config()
+    try:
+        _conn = psycopg2.connect(
+            host=_config.db_host,
+            database=_config.db_name,
+            port=_config.db_port,
+            user=_config.db_user,
+            password=_config.db_password
+        )
+        _conn.autocommit = False
+        _conn.set_client_encoding('utf-8')
+        _conn.cursor_factory = psycopg2.extras.DictCursor
+        return _conn
+    except Exception as e:
+        raise TogglDBError('db connection error:{}'.format(e))
+
+
+class DbConnection():
+    """Shared db connection
+    Lambdaのwarm起動間でコネクションを使い回す。取得時に状態を確認し、切れていれば接続し直す
+    """
+
+    def __init__(self, name: str):
+        """Initialize.
+        接続は最初に取得するときに行う
+
+        Args:
+            name:str
+                コネクション名（repository毎）
+        """
+        self.name = name
+        # repositoryの処理をコネクション単位で直列化する
+        self.lock = threading.RLock()
+        self._conn = None
+        self._checked_at = 0.0
+
+    def get(self):
+        """get healthy connection
+        トランザクション外で、前回の確認からDB_HEALTH_CHECK_SECONDS以上経っていればSELECT 1で確認する
+        エラーで中断したトランザクションはロールバックし、切断されていれば接続し直す
+
+        Args:
+            None
+
+        Return:
+            conn:psycopg2.extensions.connection
+        """
+        with self.lock:
+            if self._conn is not None and not self._is_healthy():
+                app.log.warning(f'[db reconnect]{self.name}')
+                current_metrics().incr('db_reconnects')
+                self.close()
+            if self._conn is None:
+                self._conn = _connect_db()
+                current_metrics().incr('db_connects')
+                self._checked_at = time.monotonic()
+            return self._conn
+
+    def close(self) -> None:
+        """close connection (エラーは無視する)"""
+        with self.lock:
+            try:
+                if self._conn is not None:
+                    self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _is_healthy(self) -> bool:
+        """check connection status"""
+        from psycopg2 import extensions
+        if self._conn.closed:
+            return False
+        try:
+            _status = self._conn.get_transaction_status()
+            if _status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if _status == extensions.TRANSACTION_STATUS_INERROR:
+                self._conn.rollback()
+            if (self._conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+                    or time.monotonic() - self._checked_at < get_config().db_health_check_seconds):
+                return True
+            with self._conn.cursor() as _cur:
+                _cur.execute('SELECT 1')
+            self._conn.rollback()
+            self._checked_at = time.monotonic()
+            return True
+        except Exception as e:
+            app.log.warning(f'[db health check error]{self.name}:{e}')
+            return False
+
+
+# コネクション名毎の共有コネクション（warm起動間で共有）
+_db_connections = {}
+_db_connections_lock = threading.Lock()
+
+
+def get_db_connection(name: str) -> DbConnection:
+    """get shared db connection
+    repository毎のDbConnectionを返す（同じ名前のrepositoryは同じコネクションとlockを使う）
+
+    Args:
+        name:str
+            コネクション名
+
+    Return:
+        db_connection:DbConnection
+    """
+    with _db_connections_lock:
+        if name not in _db_connections:
+            _db_connections[name] = DbConnection(name)
+        return _db_connections[name]
+
+
+# 名前付きカーソルの名前の連番
+_stream_cursor_ids = itertools.count(1)
+
+
+def _iter_rows(conn, statement: str, variables: list = None, fetch_size: int = None) -> Iterator[tuple]:
+    """stream rows with server-side cursor
+    名前付きカーソルでfetch_size件ずつ取得し、tupleの行を返す（大きな結果を一度にメモリに載せない）
+    トランザクション内で読み切ること（commitでカーソルは閉じる）
+
+    Args:
+        conn:psycopg2.extensions.connection
+        statement:str
+            SELECT文
+        variables:list
+            statementのパラメーター
+        fetch_size:int
+            1回に取得する件数。省略時はDB_FETCH_SIZE
+
+    Return:
+        rows:Iterator[tuple]
+    """
+    from psycopg2 import extensions
+    # コネクションのcursor_factory（DictCursor）ではなく、tupleの行を返すカーソル
+    with conn.cursor(name=f'stream_{next(_stream_cursor_ids)}', cursor_factory=extensions.cursor) as _cur:
+        _cur.itersize = fetch_size or get_config().db_fetch_size
+        _cur.execute(statement, variables)
+        yield from _cur
+
+
+def _execute_values(cur, statement: str, variables: list, page_size: int = 100, fetch: bool = False):
+    """multi-row statement (psycopg2.extras.execute_values)
+    psycopg2は使うときに読み込む。fetch=TrueならRETURNINGの結果を返す
+    """
+    from psycopg2.extras import execute_values
+    return execute_values(cur, statement, variables, page_size=page_size, fetch=fetch)
+
+
+def _parse_toggl_time(value: str) -> datetime.datetime:
+    """parse toggl timestamp (ISO 8601). 解析できなければNone"""
+    try:
+        return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _window_start(past_days: int = None) -> datetime.datetime:
+    """start of recent window
+    past_days日前の0時（実行環境のタイムゾーン）。SQLに定数として渡し、計画時にパーティションを絞り込ませる
+
+    Args:
+        past_days:int
+            何日前か。省略時はTOGGL_PAST_DAYS
+
+    Return:
+        start:datetime.datetime
+            タイムゾーン付きの日時
+    """
+    if past_days is None:
+        past_days = get_config().toggl_past_days
+    _day = datetime.date.today() - datetime.timedelta(days=int(past_days))
+    return datetime.datetime.combine(_day, datetime.time.min).astimezone()
+
+
+def _today_in(timezone: str) -> datetime.date:
+    """today in timezone
+    タイムゾーンがわからない（zoneinfoがない場合も含む）ときは実行環境の今日
+
+    Args:
+        timezone:str
+            IANAのタイムゾーン名（例：Asia/Tokyo）
+
+    Return:
+        today:datetime.date
+    """
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.datetime.now(ZoneInfo(timezone)).date()
+    except (ImportError, KeyError, ValueError):
+        return datetime.date.today()
+
+
+@functools.lru_cache(maxsize=None)
+def issue_key_pattern(project_keys: tuple):
+    """compile issue key matcher
+    複数のプロジェクトキーのissue key（例：HOGE-12）を1つの正規表現で判定する。プロジェクトキー毎にcompileは1回
+
+    Args:
+        project_keys:tuple
+            Backlogのプロジェクトキー
+
+    Return:
+        pattern:re.Pattern
+    """
+    # 前方一致で短いキーが先にマッチしないよう、長い順に並べる
+    _keys = sorted(project_keys, key=len, reverse=True)
+    return re.compile(rf'(?:{"|".join(re.escape(key) for key in _keys)})-\d+', flags=re.I)
+
+
+# Togglのworkspace id/emailのキャッシュ（warm起動間で共有）
+_toggl_identity: dict = None
+_toggl_identity_lock = threading.Lock()
 
 
 class TogglReportSummaryRepository():
     """Toggl Summary Data Repository
-    TogglのDetailed Report APIを利用
+    TogglのDetailed Report API（v2、v3）を利用
     """
 
-    def __init__(self):
+    def __init__(
+            self,
+            http_client: HttpClient = None,
+            max_workers: int = None,
+            report_api: str = None):
         """Initialize.
-        Togglのworkspace idとemailを取得（API利用時に必要なため）
+        Togglのworkspace idとemail（API利用時に必要）は最初に使うときに取得する
+
+        Args:
+            http_client:HttpClient
+                API呼び出しに使うHttpClient。省略時は共有クライアント
+            max_workers:int
+                ページを並列取得する数（v2のみ）。Togglのレート制限を超えない程度にする
+            report_api:str
+                Detailed Report APIのバージョン（v2、v3）。省略時はTOGGL_REPORT_API
         """
 
-        self.workspace_id = self._get_workspace_id()
-        self.email = self._get_email()
+        self.http_client = http_client or get_http_client()
+        self.rate_limiter = get_rate_limiter('toggl')
+        self.max_workers = max(1, max_workers or get_config().toggl_max_workers)
+        self.report_api = report_api or get_config().toggl_report_api
         pass
 
-    def get_data(self, past_days: int = TOGGL_PAST_DAYS) \
+    @property
+    def workspace_ids(self) -> List[int]:
+        """toggl workspace ids
+        TOGGL_WORKSPACE_IDSが未指定なら先頭のworkspace、allならすべて、指定があればそのworkspace
+        """
+        _workspace_ids = self._get_identity()['workspace_ids']
+        _setting = get_config().toggl_workspace_ids.strip()
+        if not _setting:
+            return _workspace_ids[:1]
+        if _setting.lower() == 'all':
+            return _workspace_ids
+        return [int(workspace_id) for workspace_id in _setting.split(',') if workspace_id.strip()]
+
+    @property
+    def email(self) -> str:
+        """toggl email"""
+        return self._get_identity()['email']
+
+    @property
+    def timezone(self) -> str:
+        """toggl user's timezone (APIのsince/untilの日付のタイムゾーン)"""
+        return self._get_identity()['timezone'] or 'UTC'
+
+    def _get_identity(self) -> dict:
+        """get toggl identity (workspace id, email, timezone)
+        TTL付きでメモリ（warm起動間で共有）とローカルファイルにキャッシュする
+        API tokenが変わった場合はキャッシュを使わない
+
+        Args:
+            None
+
+        Return:
+            identity:dict
+                workspace_ids、email、timezone
+        """
+        global _toggl_identity
+        _token_hash = hashlib.sha256(get_config().toggl_api_token.encode()).hexdigest()
+        with _toggl_identity_lock:
+            if not self._is_identity_valid(_toggl_identity, _token_hash):
+                _toggl_identity = self._load_identity_file()
+            if not self._is_identity_valid(_toggl_identity, _token_hash):
+                _user = self._get_user()
+                _toggl_identity = {
+                    'token_hash': _token_hash,
+                    'workspace_ids': self._get_workspace_ids(),
+                    'email': _user['email'],
+                    'timezone': _user.get('timezone'),
+                    'fetched_at': time.time()
+                }
+                self._save_identity_file(_toggl_identity)
+            return _toggl_identity
+
+    def _is_identity_valid(self, identity: dict, token_hash: str) -> bool:
+        """check identity cache (token, ttl)"""
+        return bool(identity
+                    and identity.get('token_hash') == token_hash
+                    and 'workspace_ids' in identity
+                    and 'timezone' in identity
+                    and time.time() - identity.get('fetched_at', 0) < get_config().toggl_identity_ttl)
+
+    def _load_identity_file(self) -> dict:
+        """load identity cache file. 読めなければNone"""
+        try:
+            with open(get_config().toggl_identity_cache_path, encoding='utf-8') as _f:
+                return json.load(_f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_identity_file(self, identity: dict) -> None:
+        """save identity cache file. 書けなくても処理は継続"""
+        try:
+            with open(get_config().toggl_identity_cache_path, 'w', encoding='utf-8') as _f:
+                json.dump(identity, _f)
+        except OSError as e:
+            app.log.warning(f'[toggl identity cache save error]{e}')
+
+    def get_data(self, past_days: int = None) \
             -> List[TogglReportDetail]:
         """get toggl report data
 
         Args:
             past_days:int
-                何日前のデータまで取得するか。初期値6日
+                何日前のデータまで取得するか。省略時はTOGGL_PAST_DAYS
 
         Return:
             data:List[TogglReportDetail]
                 取得結果。TogglReportDetail型配列
         """
+        return list(self.iter_data(past_days))
+
+    def get_window(self, past_days: int = None) -> TogglReportWindow:
+        """get report window
+        Togglユーザーのタイムゾーンの今日からpast_days日前〜今日
+        DBと比較する範囲も同じ期間にする（DbTogglReportRepository.sync）
+
+        Args:
+            past_days:int
+                何日前のデータまで取得するか。省略時はTOGGL_PAST_DAYS
+
+        Return:
+            window:TogglReportWindow
+        """
+        if past_days is None:
+            past_days = get_config().toggl_past_days
+        _timezone = self.timezone
+        _today = _today_in(_timezone)
+        return TogglReportWindow(
+            since=_today - datetime.timedelta(days=past_days),
+            until=_today,
+            timezone=_timezone)
+
+    def iter_data(self, past_days: int = None,
+                  since: datetime.date = None, until: datetime.date = None,
+                  issue_key: str = None) -> Iterator[TogglReportDetail]:
+        """iterate toggl report data
+        workspace毎に、ページ単位で取得・変換しながら返す。先読みはmax_workersページまで
+        BACKLOG_PRJ_KEYSのいずれかのissue keyを含むデータのみ返す
+
+        Args:
+            past_days:int
+                何日前のデータまで取得するか。省略時はTOGGL_PAST_DAYS
+            since:datetime.date
+                取得開始日。指定した場合はpast_daysより優先
+            until:datetime.date
+                取得終了日。省略時は今日（Togglユーザーのタイムゾーン）
+            issue_key:str
+                指定した場合はそのBacklog issueのデータのみ返す
+
+        Return:
+            data:Iterator[TogglReportDetail]
+                取得結果。workspace順・ページ順に返す
+        """
 
         # Togglデータ取得
-        _since: str = (datetime.datetime.now() - datetime.timedelta(days=TOGGL_PAST_DAYS)).strftime('%Y-%m-%d')
-        _until: str = datetime.datetime.now().strftime('%Y-%m-%d')
+        if since is None or until is None:
+            _window = self.get_window(past_days)
+            since = since or _window.since
+            until = until or _window.until
+        _since: str = since.strftime('%Y-%m-%d')
+        _until: str = until.strftime('%Y-%m-%d')
+        _project_keys = get_config().backlog_prj_keys
         _params = {
             'user_agent': self.email,
-            'description': f'{BACKLOG_PRJ_KEY}-',
             'since': _since,
-            'until': _until,
-            'workspace_id': self.workspace_id
+            'until': _until
         }
+        if issue_key:
+            # descriptionは部分一致（HOGE-1でHOGE-12も返る）のため、issue keyが一致するもののみ返す
+            _params['description'] = issue_key
+            for workspace_id in self.workspace_ids:
+                for detail in self._iter_workspace_data(dict(_params, workspace_id=workspace_id)):
+                    if detail.backlog_issue_key == issue_key.upper():
+                        yield detail
+            return
+        if len(_project_keys) == 1:
+            # プロジェクトが1つならToggl側で絞り込む（複数の場合はissue keyの正規表現で絞り込む）
+            _params['description'] = f'{_project_keys[0]}-'
+        for workspace_id in self.workspace_ids:
+            yield from self._iter_workspace_data(dict(_params, workspace_id=workspace_id))
+
+    def _iter_workspace_data(self, params: dict) -> Iterator[TogglReportDetail]:
+        """iterate toggl report data of one workspace
+        report_apiのDetailed Report APIで取得する
+
+        Args:
+            params:dict
+                Detailed Report API（v2）のパラメータ（pageを除く）
+
+        Return:
+            data:Iterator[TogglReportDetail]
+                取得結果。ページ順に返す
+        """
+        if self.report_api not in TOGGL_REPORT_APIS:
+            raise TogglAPIError(f'unknown report api:{self.report_api}')
+        if self.report_api == 'v3':
+            return self._iter_workspace_data_v3(params)
+        return self._iter_workspace_data_v2(params)
+
+    def _iter_workspace_data_v2(self, params: dict) -> Iterator[TogglReportDetail]:
+        """iterate toggl report data of one workspace (Reports API v2)
+
+        Args:
+            params:dict
+                Detailed Report APIのパラメータ（pageを除く）
+
+        Return:
+            data:Iterator[TogglReportDetail]
+                取得結果。ページ順に返す
+        """
+        _params = params
         app.log.info(f'[toggl get data:_params]{_params}')
-        # 50件ずつ取得
-        _page = 0
-        _total_data = {}
-        while True:
-            _page += 1
-            _params['page'] = _page
-            _req = requests.get(f'{TOGGL_BASE_URL}/reports/api/v2/details',
-                                auth=(TOGGL_API_TOKEN, 'api_token'),
-                                params=_params)
-            _res = _req.json()
-            app.log.info(f'[toggl get data:_res]{_res}')
-            if 'data' not in _total_data.keys():
-                _total_data = _res
-            else:
-                _total_data['data'] += _res['data']
-            if len(_res['data']) == 0:
-                # dataがなければ取得完了
-                break
+        # 1ページ目のtotal_count/per_pageからページ数を算出し、残りのページを並列取得
+        _res = self._get_page(_params, 1)
+        _pages = math.ceil(_res['total_count'] / _res['per_page']) if _res['per_page'] else 1
+        app.log.info(f'[toggl get data:pages]{_pages} total_count:{_res["total_count"]}')
+        yield from self._to_details(_res['data'])
+        _res = None
+        if _pages <= 1:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as _executor:
+            # 取得中のページをmax_workers件までに制限し、ページ順に返す
+            _futures = collections.deque()
+            _next_page = 2
+            while _next_page <= _pages or _futures:
+                while _next_page <= _pages and len(_futures) < self.max_workers:
+                    _futures.append(_executor.submit(self._get_page, _params, _next_page))
+                    _next_page += 1
+                yield from self._to_details(_futures.popleft().result()['data'])
+
+    def _to_details(self, data: List[dict]) -> List[TogglReportDetail]:
+        """convert toggl report page data
 
-        # BacklogissueKeyは先頭の１つ目のみ取得
-        _data = [TogglReportDetail(
+        Args:
+            data:List[dict]
+                Detailed Report APIのdata
+
+        Return:
+            data:List[TogglReportDetail]
+                TogglReportDetail型配列
+        """
+        # BacklogissueKeyは先頭の１つ目のみ取得。どのプロジェクトのissue keyも含まないデータは除外
+        _pattern = issue_key_pattern(get_config().backlog_prj_keys)
+        _matches = [(dict, _pattern.search(dict['description'] or '')) for dict in data]
+        return [TogglReportDetail(
             id=dict['id'],
             pid=dict['pid'],
             tid=dict['tid'],
@@ -103,47 +567,171 @@ class TogglReportSummaryRepository():
             end=dict['end'],
             updated=dict['updated'],
             dur=dict['dur'],
-            backlog_issue_key=re.findall(rf'{BACKLOG_PRJ_KEY}-\d+', dict['description'], flags=re.I)[0].upper()
-            ) for dict in _total_data['data']]
+            backlog_issue_key=_match.group(0).upper()
+            ) for dict, _match in _matches if _match]
 
-        return _data
+    def _get_page(self, params: dict, page: int) -> dict:
+        """get toggl report page
 
-    def _get_workspace_id(self) -> int:
-        """get toggl workspace id
+        Args:
+            params:dict
+                Detailed Report APIのパラメータ（pageを除く）
+            page:int
+                取得するページ番号（1始まり）
+
+        Return:
+            data:dict
+                Detailed Report APIのレスポンス
+        """
+        with current_metrics().phase('toggl_fetch'):
+            _req = self.http_client.get(f'{get_config().toggl_base_url}/reports/api/v2/details',
+                                        auth=(get_config().toggl_api_token, 'api_token'),
+                                        rate_limiter=self.rate_limiter,
+                                        params=dict(params, page=page))
+        if _req.status_code != 200:
+            raise TogglAPIError(f'failed to get report data page:{page} status:{_req.status_code}')
+        _res = _req.json()
+        app.log.info(f'[toggl get data:page]{page} entries:{len(_res["data"])}')
+        return _res
+
+    def _iter_workspace_data_v3(self, params: dict) -> Iterator[TogglReportDetail]:
+        """iterate toggl report data of one workspace (Reports API v3)
+        TOGGL_REPORT_PAGE_SIZE件ずつ、レスポンスのX-Next-Row-Numberをfirst_row_numberに渡して次のページを取得する
+        次のページの位置は前のページのレスポンスでわかるため、ページは並列取得しない
 
         Args:
-            None
+            params:dict
+                Detailed Report API（v2）のパラメータ。v3のパラメータに変換する
 
         Return:
+            data:Iterator[TogglReportDetail]
+                取得結果。ページ順に返す
+        """
+        _body = {
+            'start_date': params['since'],
+            'end_date': params['until'],
+            'page_size': get_config().toggl_report_page_size
+        }
+        if params.get('description'):
+            _body['description'] = params['description']
+        app.log.info(f'[toggl get data:_params]{params["workspace_id"]} {_body}')
+        _page = 1
+        while True:
+            _rows, _next_row = self._get_page_v3(params['workspace_id'], _body, _page)
+            yield from self._to_details_v3(_rows)
+            _rows = None
+            # 件数ではなくヘッダーで判定する（page_sizeより少ない件数で返っても続けて取得できる）
+            if not _next_row:
+                return
+            _body = dict(_body, first_row_number=_next_row)
+            _page += 1
+
+    def _to_details_v3(self, rows: List[dict]) -> List[TogglReportDetail]:
+        """convert toggl report v3 rows
+        v3はユーザー・description等毎の行にtime_entriesが含まれるため、time entry毎に展開する
+        durはv2と同じくミリ秒にする。実行中（stopがない）のtime entryはv2と同じく含めない
+
+        Args:
+            rows:List[dict]
+                Reports API v3（search/time_entries）のレスポンス
+
+        Return:
+            data:List[TogglReportDetail]
+                TogglReportDetail型配列
+        """
+        _pattern = issue_key_pattern(get_config().backlog_prj_keys)
+        data = []
+        for row in rows:
+            _match = _pattern.search(row.get('description') or '')
+            if not _match:
+                continue
+            for entry in row.get('time_entries') or []:
+                if not entry.get('stop'):
+                    # 実行中はend_time・durが確定していない（toggl_report.end_timeはNOT NULL）
+                    continue
+                data.append(TogglReportDetail(
+                    id=entry['id'],
+                    pid=row.get('project_id'),
+                    tid=row.get('task_id'),
+                    uid=row.get('user_id'),
+                    user=row.get('username'),
+                    description=row.get('description'),
+                    start=entry['start'],
+                    end=entry.get('stop'),
+                    updated=entry.get('at'),
+                    dur=int(entry['seconds']) * 1000,
+                    backlog_issue_key=_match.group(0).upper()))
+        return data
+
+    def _get_page_v3(self, workspace_id: int, body: dict, page: int) -> tuple:
+        """get toggl report v3 page
+
+        Args:
             workspace_id:int
                 togglのworkspace id
+            body:dict
+                search/time_entriesのリクエストbody（first_row_numberを含む）
+            page:int
+                ページ番号（ログ用）
+
+        Return:
+            rows:List[dict]
+                レスポンスの行
+            next_row:int
+                次のページのfirst_row_number。最後のページならNone
+        """
+        with current_metrics().phase('toggl_fetch'):
+            _req = self.http_client.post(
+                f'{get_config().toggl_base_url}/reports/api/v3/workspace/{workspace_id}/search/time_entries',
+                auth=(get_config().toggl_api_token, 'api_token'),
+                rate_limiter=self.rate_limiter,
+                json=body)
+        if _req.status_code != 200:
+            raise TogglAPIError(f'failed to get report data page:{page} status:{_req.status_code}')
+        _rows = _req.json() or []
+        _next_row = _req.headers.get(TOGGL_V3_NEXT_ROW_HEADER)
+        app.log.info(f'[toggl get data:page]{page} rows:{len(_rows)} next_row:{_next_row}')
+        return _rows, int(_next_row) if _next_row else None
+
+    def _get_workspace_ids(self) -> List[int]:
+        """get toggl workspace ids
+
+        Args:
+            None
+
+        Return:
+            workspace_ids:List[int]
+                togglのworkspace id（APIの返却順）
 
         """
-        _req = requests.get(f'{TOGGL_BASE_URL}/api/v8/workspaces',
-                            auth=(TOGGL_API_TOKEN, 'api_token'))
+        _req = self.http_client.get(f'{get_config().toggl_base_url}/api/v8/workspaces',
+                                    auth=(get_config().toggl_api_token, 'api_token'),
+                                    rate_limiter=self.rate_limiter)
         _data = _req.json()
-        app.log.info(f'[toggl workspaces data]{_data}')
-        if _data[0]['id']:
-            return _data[0]['id']
+        log_payload('toggl workspaces data', _data)
+        _workspace_ids = [workspace['id'] for workspace in _data if workspace.get('id')]
+        if _workspace_ids:
+            return _workspace_ids
         else:
             raise TogglAPIError('workspace id not found')
 
-    def _get_email(self) -> str:
-        """get toggl email
+    def _get_user(self) -> dict:
+        """get toggl user (email, timezone)
 
         Args:
             None
 
         Return:
-            email:str
-                toggl apiに紐づくemail
+            user:dict
+                toggl apiに紐づくユーザー（/api/v8/meのdata。email、timezone）
         """
-        _req = requests.get(f'{TOGGL_BASE_URL}/api/v8/me',
-                            auth=(TOGGL_API_TOKEN, 'api_token'))
+        _req = self.http_client.get(f'{get_config().toggl_base_url}/api/v8/me',
+                                    auth=(get_config().toggl_api_token, 'api_token'),
+                                    rate_limiter=self.rate_limiter)
         _data = _req.json()
-        app.log.info(f'[toggl email data]{_data}')
+        log_payload('toggl user data', _data)
         if _data['data']['email']:
-            return _data['data']['email']
+            return _data['data']
         else:
             raise TogglAPIError('email not found')
 
@@ -152,142 +740,1336 @@ class DbTogglReportRepository():
     """Toggl report repository interface with db."""
 
     def __init__(self):
-        """Initialize db connection."""
-        try:
-            _conn = psycopg2.connect(
-                host=os.environ['DB_HOST'],
-                database=os.environ['DB_NAME'],
-                port=os.environ['DB_PORT'],
-                user=os.environ['DB_USER'],
-                password=os.environ['DB_PASSWORD']
-            )
-            _conn.autocommit = False
-            _conn.set_client_encoding('utf-8')
-            _conn.cursor_factory = psycopg2.extras.DictCursor
-            self.conn = _conn
-        except Exception as e:
-            raise TogglDBError('db connection error:{}'.format(e))
+        """Initialize.
+        db connectionはwarm起動間で共有するもの（get_db_connection）を最初に使うときに取得する
+        backfillでshardを並列処理するため、登録処理はlockで直列化する
+        """
+        self._db_connection = get_db_connection('toggl_report')
+        self._lock = self._db_connection.lock
 
-    def __del__(self):
-        """Close db connection."""
-        try:
-            self.conn.close()
-        except Exception as e:
-            raise TogglDBError('db connection close error:{}'.format(e))
+    @property
+    def conn(self):
+        """db connection (shared, lazy)"""
+        return self._db_connection.get()
 
-    def find_summary_data(self) -> List[TogglReportSummary]:
+    def find_summary_data(self, dirty_only: bool = False,
+                          issue_keys: List[str] = None) -> List[TogglReportSummary]:
         """find summary data.
+        toggl_reportのtriggerで更新される集計テーブル（toggl_issue_summary）から取得
+        前回次回に回したissue（backlog_sync_pending）を先頭に、前回同期時からの差（drift）が大きい順に返す
+
         Args:
-            None
+            dirty_only:bool
+                Trueの場合、前回Backlogと同期した合計時間（backlog_sync_ledger）から
+                変化したBacklogIssueと、前回次回に回したBacklogIssueのみ取得
+            issue_keys:List[str]
+                指定した場合はそのBacklogIssueのみ取得
 
         Return:
             data:[TogglReportSummary]
                 DBから取得したBacklogIssue毎のTogglReportデータ。TogglReportSummary型配列
         """
-        with self.conn.cursor() as _cur:
-            # SQLでgroup byしたものを抽出
-            _statement = ('SELECT backlog_issue_key,sum(dur) as sum_dur FROM '
-                          'toggl_report tr WHERE backlog_issue_key IS NOT NULL '
-                          'GROUP BY backlog_issue_key')
-            app.log.info(f'[SQL]{_statement}')
-            _cur.execute(_statement)
-            recset = _cur.fetchall()
-
-        data = [TogglReportSummary(
-            backlog_issue_key=dict['backlog_issue_key'],
-            sum_dur=dict['sum_dur'],
-            sum_dur_hours=round(dict['sum_dur']/(60*60*1000), 2)
-            ) for dict in recset]
+        _variables = []
+        _statement = ('SELECT s.backlog_issue_key,s.sum_dur,'
+                      'abs(s.sum_dur - coalesce(l.synced_sum_dur, 0)) AS drift FROM '
+                      'toggl_issue_summary s LEFT JOIN backlog_sync_ledger l '
+                      'ON s.backlog_issue_key = l.backlog_issue_key '
+                      'LEFT JOIN backlog_sync_pending p '
+                      'ON s.backlog_issue_key = p.backlog_issue_key '
+                      'WHERE s.entry_count > 0')
+        if dirty_only:
+            _statement += (' AND (l.synced_sum_dur IS DISTINCT FROM s.sum_dur '
+                           'OR p.backlog_issue_key IS NOT NULL)')
+        if issue_keys is not None:
+            _statement += ' AND s.backlog_issue_key = ANY(%s)'
+            _variables.append(list(issue_keys))
+        _statement += ' ORDER BY p.backlog_issue_key IS NULL, drift DESC, s.backlog_issue_key'
+        app.log.info(f'[SQL]{_statement}')
+        try:
+            # 名前付きカーソルでDB_FETCH_SIZE件ずつ読みながらTogglReportSummaryにする
+            with current_metrics().phase('summary_query'):
+                data = [TogglReportSummary(
+                    backlog_issue_key=backlog_issue_key,
+                    sum_dur=sum_dur,
+                    sum_dur_hours=round(sum_dur/(60*60*1000), 2),
+                    drift=drift
+                    ) for backlog_issue_key, sum_dur, drift in _iter_rows(self.conn, _statement, _variables)]
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            raise TogglDBError('toggl summary select error:{}'.format(e))
         return data
 
-    def delete(self, past_days: int = TOGGL_PAST_DAYS) -> bool:
-        """delete past data
+    def save_synced_summary(self, toggl_summary_data: List[TogglReportSummary]) -> bool:
+        """save synced summary
+        Backlogと同期したBacklogIssue毎の合計時間をbacklog_sync_ledgerに記録
+
         Args:
-            past_days:int
-                DB上で何日前までのtoggl report dataを削除するか。初期値6日
+            toggl_summary_data:List[TogglReportSummary]
+                Backlogとの同期が完了したTogglReportデータ
 
         Return:
             bool
                 成功していればTrue
         """
+        if not toggl_summary_data:
+            return True
+        # shard単位で並列に呼ばれるため直列化する
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _execute_values(
+                        _cur,
+                        'INSERT INTO backlog_sync_ledger (backlog_issue_key,synced_sum_dur) '
+                        'VALUES %s ON CONFLICT (backlog_issue_key) DO UPDATE SET '
+                        'synced_sum_dur = EXCLUDED.synced_sum_dur, synced_at = now()',
+                        [(toggl_summary.backlog_issue_key, toggl_summary.sum_dur)
+                         for toggl_summary in toggl_summary_data])
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('sync ledger save error:{}'.format(e))
+
+    def save_pending_issues(self, deferred_data: List[TogglReportSummary],
+                            processed_keys: List[str]) -> bool:
+        """save pending issues
+        次回に回したBacklogIssueをbacklog_sync_pendingに登録し、処理したBacklogIssueを削除する
+
+        Args:
+            deferred_data:List[TogglReportSummary]
+                Lambdaの残り時間が足りず同期しなかったTogglReportデータ
+            processed_keys:List[str]
+                同期を試みたBacklogIssueのkey（成功・失敗とも）
+
+        Return:
+            bool
+                成功していればTrue
+        """
+        if not deferred_data and not processed_keys:
+            return True
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    if processed_keys:
+                        _cur.execute('DELETE FROM backlog_sync_pending WHERE backlog_issue_key = ANY(%s)',
+                                     [list(processed_keys)])
+                    if deferred_data:
+                        _execute_values(
+                            _cur,
+                            'INSERT INTO backlog_sync_pending (backlog_issue_key,drift) '
+                            'VALUES %s ON CONFLICT (backlog_issue_key) DO UPDATE SET '
+                            'drift = EXCLUDED.drift, deferred_at = now()',
+                            [(toggl_summary.backlog_issue_key, toggl_summary.drift)
+                             for toggl_summary in deferred_data])
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('sync pending save error:{}'.format(e))
+
+    def save_sync_failures(self, failures: dict, succeeded_keys: List[str],
+                           base_seconds: int = None, max_seconds: int = None) -> bool:
+        """save sync failures
+        同期に失敗したBacklogIssueをbacklog_sync_retryに登録し、同期できたBacklogIssueを削除する
+        再同期までの待ち時間は失敗する毎に倍にする（base_seconds、2倍、4倍…、max_secondsまで）
+
+        Args:
+            failures:dict
+                失敗したBacklogIssueのkeyとエラー内容
+            succeeded_keys:List[str]
+                同期できた（またはリトライ不要になった）BacklogIssueのkey
+            base_seconds:int
+                1回目の失敗後の待ち時間。省略時はSYNC_RETRY_BASE_SECONDS
+            max_seconds:int
+                待ち時間の上限。省略時はSYNC_RETRY_MAX_SECONDS
+
+        Return:
+            bool
+                成功していればTrue
+        """
+        if not failures and not succeeded_keys:
+            return True
+        _config = get_config()
+        base_seconds = _config.sync_retry_base_seconds if base_seconds is None else base_seconds
+        max_seconds = _config.sync_retry_max_seconds if max_seconds is None else max_seconds
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    if succeeded_keys:
+                        _cur.execute('DELETE FROM backlog_sync_retry WHERE backlog_issue_key = ANY(%s)',
+                                     [list(succeeded_keys)])
+                    for issue_key, error in failures.items():
+                        _cur.execute('INSERT INTO backlog_sync_retry '
+                                     '(backlog_issue_key,last_error,next_retry_at) '
+                                     'VALUES (%s, %s, now() + make_interval(secs => %s)) '
+                                     'ON CONFLICT (backlog_issue_key) DO UPDATE SET '
+                                     'attempts = backlog_sync_retry.attempts + 1, '
+                                     'last_error = EXCLUDED.last_error, failed_at = now(), '
+                                     'next_retry_at = now() + make_interval(secs => '
+                                     'LEAST(%s, %s * power(2, backlog_sync_retry.attempts)))',
+                                     [issue_key, str(error)[:1000], base_seconds, max_seconds, base_seconds])
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('sync retry save error:{}'.format(e))
+
+    def find_retry_issues(self, limit: int = None) -> List[BacklogSyncRetryItem]:
+        """find issues to retry
+        再同期の時刻を過ぎたissueを取得
+
+        Args:
+            limit:int
+                取得件数。省略時はSYNC_RETRY_BATCH_SIZE
+
+        Return:
+            items:List[BacklogSyncRetryItem]
+                再同期するissue。時刻順
+        """
+        limit = limit or get_config().sync_retry_batch_size
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute('SELECT backlog_issue_key, attempts, next_retry_at, last_error '
+                                 'FROM backlog_sync_retry WHERE next_retry_at <= now() '
+                                 'ORDER BY next_retry_at LIMIT %s', [limit])
+                    recset = _cur.fetchall()
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('sync retry select error:{}'.format(e))
+
+        return [BacklogSyncRetryItem(
+            issue_key=dict['backlog_issue_key'],
+            attempts=dict['attempts'],
+            next_retry_at=dict['next_retry_at'],
+            last_error=dict['last_error']
+            ) for dict in recset]
+
+    def find_issue_keys(self, toggl_ids: List[int]) -> List[str]:
+        """find stored issue keys
+        DBに登録済みのtime entryのissue key（説明を変更・削除する前のissue key）を取得
+
+        Args:
+            toggl_ids:List[int]
+                togglのtime entry id
+
+        Return:
+            issue_keys:List[str]
+                登録済みのissue key（重複なし）
+        """
+        if not toggl_ids:
+            return []
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute('SELECT DISTINCT backlog_issue_key FROM toggl_report '
+                                 'WHERE toggl_id = ANY(%s) AND backlog_issue_key IS NOT NULL '
+                                 'ORDER BY backlog_issue_key', [list(toggl_ids)])
+                    recset = _cur.fetchall()
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('toggl issue key select error:{}'.format(e))
+
+        return [dict['backlog_issue_key'] for dict in recset]
+
+    def check_summary_data(self, repair: bool = False) -> List[TogglIssueSummaryDiff]:
+        """check summary data.
+        集計テーブル（toggl_issue_summary）とtoggl_reportをgroup byした集計を比較する
+
+        Args:
+            repair:bool
+                Trueの場合、toggl_reportから集計テーブルを作り直す
+
+        Return:
+            data:[TogglIssueSummaryDiff]
+                集計が一致しなかったBacklogIssueの一覧
+        """
         try:
             with self.conn.cursor() as _cur:
-                _statement = (f'DELETE FROM toggl_report WHERE start_time > '
-                              f'date_trunc(\'day\',now() + \'-{past_days} days\')')
+                # 比較・再作成中にtoggl_reportが更新されないようlock
+                _cur.execute('LOCK TABLE toggl_report IN SHARE MODE')
+                # 切り離したパーティションの分はtoggl_report_retiredの集計を加える
+                _statement = ('SELECT coalesce(s.backlog_issue_key, l.backlog_issue_key) '
+                              'AS backlog_issue_key, s.sum_dur AS summary_sum_dur, '
+                              's.entry_count AS summary_entry_count, '
+                              'l.sum_dur AS live_sum_dur, l.entry_count AS live_entry_count '
+                              f'FROM toggl_issue_summary s FULL OUTER JOIN ({_LIVE_SUMMARY_SQL}) l '
+                              'ON s.backlog_issue_key = l.backlog_issue_key '
+                              'WHERE s.sum_dur IS DISTINCT FROM l.sum_dur '
+                              'OR s.entry_count IS DISTINCT FROM l.entry_count')
                 app.log.info(f'[SQL]{_statement}')
                 _cur.execute(_statement)
+                recset = _cur.fetchall()
+                if repair and recset:
+                    _cur.execute('DELETE FROM toggl_issue_summary')
+                    _cur.execute('INSERT INTO toggl_issue_summary '
+                                 '(backlog_issue_key, sum_dur, entry_count) '
+                                 f'SELECT backlog_issue_key, sum_dur, entry_count FROM ({_LIVE_SUMMARY_SQL}) l')
             self.conn.commit()
-            return True
         except Exception as e:
             self.conn.rollback()
-            raise TogglDBError('toggl data delete error:{}'.format(e))
+            raise TogglDBError('toggl summary check error:{}'.format(e))
+
+        data = [TogglIssueSummaryDiff(
+            backlog_issue_key=dict['backlog_issue_key'],
+            summary_sum_dur=dict['summary_sum_dur'],
+            summary_entry_count=dict['summary_entry_count'],
+            live_sum_dur=dict['live_sum_dur'],
+            live_entry_count=dict['live_entry_count']
+            ) for dict in recset]
+        return data
+
+    def plan_backfill_shards(self, shards: List[TogglBackfillShard]) -> bool:
+        """plan backfill shards
+        backfill対象の期間（shard）を登録する。登録済みのshardはそのまま（完了状態を保持）
 
-    def insert(self, toggl_data: List[TogglReportDetail]) -> bool:
-        """insert toggl report data
         Args:
-            toggl_data:List[TogglReportDetail]
-                DBに登録するtoggl data. toggl detailed report api で取得したもの
+            shards:List[TogglBackfillShard]
+                登録するshard
 
         Return:
             bool
                 成功していればTrue
         """
-        try:
-            with self.conn.cursor() as _cur:
-                for dict in toggl_data:
-                    # 6日以上前のデータが6日以内に変更されていた場合は過去レコードを削除
-                    _statement = (f'SELECT count(*) cnt FROM toggl_report '
-                                  f'WHERE toggl_id = {dict.id}')
-                    _cur.execute(_statement)
-                    if(int(_cur.fetchone()["cnt"]) > 0):
-                        _statement = (f'DELETE FROM toggl_report '
-                                      f'WHERE toggl_id = {dict.id}')
-                        _cur.execute(_statement)
-
-                    # 登録
-                    _statement = ('INSERT INTO toggl_report (toggl_id,'
-                                  'pid,tid,uid,user_name,description,'
-                                  'start_time,end_time,updated,dur,'
-                                  'backlog_issue_key) VALUES ('
-                                  '%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)')
-                    _variables = [
-                        dict.id,
-                        dict.pid,
-                        dict.tid,
-                        dict.uid,
-                        dict.user,
-                        dict.description,
-                        dict.start,
-                        dict.end,
-                        dict.updated,
-                        dict.dur,
-                        dict.backlog_issue_key
-                    ]
-                    app.log.info(f'{_statement}\n{_variables}')
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _execute_values(
+                        _cur,
+                        'INSERT INTO toggl_backfill_shard (since,until) VALUES %s '
+                        'ON CONFLICT (since, until) DO NOTHING',
+                        [(shard.since, shard.until) for shard in shards])
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('backfill shard plan error:{}'.format(e))
+
+    def find_pending_backfill_shards(self, since: datetime.date, until: datetime.date) \
+            -> List[TogglBackfillShard]:
+        """find pending backfill shards
+        Args:
+            since:datetime.date
+                backfill開始日
+            until:datetime.date
+                backfill終了日
+
+        Return:
+            data:List[TogglBackfillShard]
+                期間内の未完了shard。古い順
+        """
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute('SELECT since, until, status, entry_count FROM toggl_backfill_shard '
+                                 'WHERE since >= %s AND until <= %s AND status <> %s '
+                                 'ORDER BY since',
+                                 [since, until, BACKFILL_SHARD_DONE])
+                    recset = _cur.fetchall()
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('backfill shard select error:{}'.format(e))
+
+        return [TogglBackfillShard(
+            since=dict['since'],
+            until=dict['until'],
+            status=dict['status'],
+            entry_count=dict['entry_count']
+            ) for dict in recset]
+
+    def save_backfill_shard(self, toggl_data: Iterable[TogglReportDetail],
+                            shard: TogglBackfillShard,
+                            batch_size: int = None,
+                            done: bool = True) -> bool:
+        """save backfill shard
+        shardのtoggl dataを登録し、doneならshardを完了にする（1トランザクション）
+        shardのデータを分けて登録する場合は、最後以外をdone=Falseで呼ぶ（entry_countは加算する）
+
+        Args:
+            toggl_data:Iterable[TogglReportDetail]
+                shard期間のtoggl data
+            shard:TogglBackfillShard
+                登録するshard
+            batch_size:int
+                1回のINSERT文で登録する件数。省略時はDB_INSERT_BATCH_SIZE
+            done:bool
+                Trueの場合、日次集計を作り直してshardを完了にする
+
+        Return:
+            bool
+                成功していればTrue
+        """
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    shard.entry_count += self._upsert(_cur, toggl_data, batch_size)
+                    if done:
+                        self._refresh_daily_rollup(_cur, shard.since, shard.until)
+                        shard.status = BACKFILL_SHARD_DONE
+                    _cur.execute('UPDATE toggl_backfill_shard SET status = %s, '
+                                 'entry_count = %s, updated_at = now() '
+                                 'WHERE since = %s AND until = %s',
+                                 [shard.status, shard.entry_count, shard.since, shard.until])
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('backfill shard save error:{}'.format(e))
+
+    def sync(self, toggl_data: Iterable[TogglReportDetail],
+             past_days: int = None,
+             batch_size: int = None,
+             issue_keys: List[str] = None,
+             window: TogglReportWindow = None) -> TogglSyncResult:
+        """sync past data
+        past_days日前以降のDBのデータとtoggl_dataをupdatedで比較し、差分のみ反映する（1トランザクション）
+        新規・更新されたデータのみupsertし、Toggl側で削除されたデータのみ削除する
+        toggl_dataの取得途中で失敗した場合はすべてロールバックされる
+
+        Args:
+            toggl_data:Iterable[TogglReportDetail]
+                past_days日前以降のtoggl data. generatorを渡した場合は読み進めながら反映する
+            past_days:int
+                DB上で何日前以降のtoggl report dataと比較するか。省略時はTOGGL_PAST_DAYS
+            batch_size:int
+                1回のINSERT文で登録する件数。省略時はDB_INSERT_BATCH_SIZE
+            issue_keys:List[str]
+                指定した場合はそのBacklogIssueのデータのみ比較・削除する（toggl_dataもそのissueのもののみ渡す）
+            window:TogglReportWindow
+                toggl_dataを取得した期間。指定した場合はpast_daysより優先し、この期間（windowのタイムゾーン）のみ比較・削除する
+                （Toggl側の期間外のデータを削除されたものとして扱わない）
+
+        Return:
+            result:TogglSyncResult
+                新規・更新・削除・変更なしの件数
+        """
+        batch_size = batch_size or get_config().db_insert_batch_size
+        result = TogglSyncResult()
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _stored = self._find_window_updated(past_days, issue_keys, window)
+                    _seen = set()
+                    _chunk = {}
+                    for detail in toggl_data:
+                        _seen.add(detail.id)
+                        if detail.id in _stored and _stored[detail.id] == _parse_toggl_time(detail.updated):
+                            continue
+                        _chunk[detail.id] = detail
+                        if len(_chunk) >= batch_size:
+                            self._upsert_changed_chunk(_cur, _chunk.values(), batch_size, result)
+                            _chunk = {}
+                    if _chunk:
+                        self._upsert_changed_chunk(_cur, _chunk.values(), batch_size, result)
+                    # upsertで書き込まれなかったもの（updatedが同じ）も変更なしとして数える
+                    result.unchanged = max(0, len(_seen) - result.inserted - result.updated)
+                    self._delete_missing(_cur, [toggl_id for toggl_id in _stored if toggl_id not in _seen], result)
+                    # 日次集計を再計算（日の境界のずれを考慮して前後1日）
+                    if window:
+                        _since, _until = window.since, window.until + datetime.timedelta(days=1)
+                    else:
+                        if past_days is None:
+                            past_days = get_config().toggl_past_days
+                        _until = datetime.date.today()
+                        _since = _until - datetime.timedelta(days=past_days)
+                    self._refresh_daily_rollup(_cur, _since - datetime.timedelta(days=1), _until, issue_keys)
+                self.conn.commit()
+            except TogglAPIError:
+                # toggl_dataの取得エラーはそのまま送出
+                self.conn.rollback()
+                raise
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('toggl data sync error:{}'.format(e))
+
+        _metrics = current_metrics()
+        _metrics.incr('db_rows_inserted', result.inserted)
+        _metrics.incr('db_rows_updated', result.updated)
+        _metrics.incr('db_rows_deleted', result.deleted)
+        _metrics.incr('db_rows_unchanged', result.unchanged)
+        return result
+
+    def _find_window_updated(self, past_days: int, issue_keys: List[str] = None,
+                             window: TogglReportWindow = None) -> dict:
+        """find toggl_id/updated of past data
+        同期のトランザクション内で、名前付きカーソルで読む
+        windowを指定した場合は、Togglから取得した期間（windowのタイムゾーンのsince 0時〜untilの翌日0時）のみ読む
+
+        Return:
+            updated:dict
+                toggl_idをキーとしたupdated
+        """
+        if window:
+            # 定数式なので計画時にパーティションを絞り込める
+            _statement = ('SELECT toggl_id, updated FROM toggl_report '
+                          'WHERE start_time >= %s::timestamp AT TIME ZONE %s '
+                          'AND start_time < (%s::date + 1)::timestamp AT TIME ZONE %s')
+            _variables = [window.since, window.timezone, window.until, window.timezone]
+        else:
+            _statement = 'SELECT toggl_id, updated FROM toggl_report WHERE start_time > %s'
+            _variables = [_window_start(past_days)]
+        if issue_keys is not None:
+            _statement += ' AND backlog_issue_key = ANY(%s)'
+            _variables.append(list(issue_keys))
+        with current_metrics().phase('db_window_query'):
+            return dict(_iter_rows(self.conn, _statement, _variables))
+
+    def _upsert_changed_chunk(self, cur, toggl_data: Iterable[TogglReportDetail], batch_size: int,
+                              result: TogglSyncResult) -> None:
+        """upsert new or changed rows (no commit)
+        updatedが同じ行は更新しない（期間外に移動したデータ等、window外の行との重複を考慮）
+        """
+        _statement = ('INSERT INTO toggl_report (toggl_id,'
+                      'pid,tid,uid,user_name,description,'
+                      'start_time,end_time,updated,dur,'
+                      'backlog_issue_key) VALUES %s '
+                      'ON CONFLICT ON CONSTRAINT toggl_report_toggl_id_key '
+                      'DO UPDATE SET '
+                      'pid = EXCLUDED.pid, tid = EXCLUDED.tid, '
+                      'uid = EXCLUDED.uid, user_name = EXCLUDED.user_name, '
+                      'description = EXCLUDED.description, '
+                      'start_time = EXCLUDED.start_time, '
+                      'end_time = EXCLUDED.end_time, '
+                      'updated = EXCLUDED.updated, dur = EXCLUDED.dur, '
+                      'backlog_issue_key = EXCLUDED.backlog_issue_key '
+                      'WHERE toggl_report.updated IS DISTINCT FROM EXCLUDED.updated '
+                      'RETURNING toggl_id')
+        _variables = [self._to_row(detail) for detail in toggl_data]
+        with current_metrics().phase('db_write'):
+            _moved = self._delete_moved(cur, _variables)
+            # パーティション化したテーブルではRETURNINGでxmaxを参照できないため、登録済みのidを先に調べる
+            cur.execute('SELECT toggl_id FROM toggl_report WHERE toggl_id = ANY(%s)',
+                        [[row[0] for row in _variables]])
+            _existing = {row[0] for row in cur.fetchall()}
+            _rows = _execute_values(cur, _statement, _variables, page_size=batch_size, fetch=True)
+        # 開始時刻が変わったデータは削除→登録になるが、更新として数える
+        _inserted = sum(1 for row in _rows if row[0] not in _existing) - _moved
+        result.inserted += _inserted
+        result.updated += len(_rows) - _inserted
+        current_metrics().incr('db_rows_written', len(_rows))
+
+    def _refresh_daily_rollup(self, cur, since: datetime.date, until: datetime.date,
+                              issue_keys: List[str] = None) -> None:
+        """refresh daily rollup (no commit)
+        since〜until（ROLLUP_TIMEZONEの日付、両端含む）の日次集計をtoggl_reportから作り直す
+        """
+        _variables = {
+            'since': since,
+            'until': until,
+            'tz': get_config().rollup_timezone,
+            'issue_keys': list(issue_keys or [])
+        }
+        _issue_filter = ' AND backlog_issue_key = ANY(%(issue_keys)s)' if issue_keys is not None else ''
+        with current_metrics().phase('rollup_refresh'):
+            cur.execute('DELETE FROM toggl_daily_rollup WHERE day >= %(since)s AND day <= %(until)s'
+                        + _issue_filter, _variables)
+            cur.execute('INSERT INTO toggl_daily_rollup (day,backlog_issue_key,uid,user_name,'
+                        'sum_dur,entry_count) '
+                        'SELECT (start_time AT TIME ZONE %(tz)s)::date, backlog_issue_key, '
+                        'COALESCE(uid, 0), max(user_name), sum(dur), count(*) '
+                        'FROM toggl_report WHERE backlog_issue_key IS NOT NULL '
+                        'AND start_time >= %(since)s::timestamp AT TIME ZONE %(tz)s '
+                        'AND start_time < (%(until)s::date + 1)::timestamp AT TIME ZONE %(tz)s'
+                        + _issue_filter
+                        + ' GROUP BY 1, 2, 3', _variables)
+            current_metrics().incr('rollup_rows', cur.rowcount)
+
+    def _delete_missing(self, cur, toggl_ids: List[int], result: TogglSyncResult) -> None:
+        """delete rows removed from toggl (no commit)"""
+        if not toggl_ids:
+            return
+        with current_metrics().phase('db_delete'):
+            cur.execute('DELETE FROM toggl_report WHERE toggl_id = ANY(%s)', [toggl_ids])
+        result.deleted += cur.rowcount
+
+    def _upsert(self, cur, toggl_data: Iterable[TogglReportDetail], batch_size: int) -> int:
+        """upsert toggl report data (no commit)
+        batch_size件たまる毎にINSERTするので、保持するのは1チャンク分のみ
+
+        Return:
+            rows:int
+                登録した件数
+        """
+        batch_size = batch_size or get_config().db_insert_batch_size
+        _started = time.perf_counter()
+        _rows = 0
+        # 同一チャンク内でtoggl_idが重複するとON CONFLICTがエラーになるため後勝ちで除外
+        _chunk = {}
+        for detail in toggl_data:
+            _chunk[detail.id] = detail
+            if len(_chunk) >= batch_size:
+                _rows += self._upsert_chunk(cur, _chunk.values(), batch_size)
+                _chunk = {}
+        if _chunk:
+            _rows += self._upsert_chunk(cur, _chunk.values(), batch_size)
+
+        _elapsed = time.perf_counter() - _started
+        app.log.info(f'[toggl data upsert]{_rows} rows in {_elapsed:.3f}s '
+                     f'({_rows / _elapsed if _elapsed else 0:.1f} rows/s, batch_size={batch_size})')
+        return _rows
+
+    def _upsert_chunk(self, cur, toggl_data: Iterable[TogglReportDetail], batch_size: int) -> int:
+        """upsert one chunk with multi-row INSERT ... ON CONFLICT"""
+        _statement = ('INSERT INTO toggl_report (toggl_id,'
+                      'pid,tid,uid,user_name,description,'
+                      'start_time,end_time,updated,dur,'
+                      'backlog_issue_key) VALUES %s '
+                      'ON CONFLICT ON CONSTRAINT toggl_report_toggl_id_key '
+                      'DO UPDATE SET '
+                      'pid = EXCLUDED.pid, tid = EXCLUDED.tid, '
+                      'uid = EXCLUDED.uid, user_name = EXCLUDED.user_name, '
+                      'description = EXCLUDED.description, '
+                      'start_time = EXCLUDED.start_time, '
+                      'end_time = EXCLUDED.end_time, '
+                      'updated = EXCLUDED.updated, dur = EXCLUDED.dur, '
+                      'backlog_issue_key = EXCLUDED.backlog_issue_key')
+        _variables = [self._to_row(detail) for detail in toggl_data]
+        with current_metrics().phase('db_write'):
+            self._delete_moved(cur, _variables)
+            _execute_values(cur, _statement, _variables, page_size=batch_size)
+        current_metrics().incr('db_rows_written', len(_variables))
+        return len(_variables)
+
+    def _delete_moved(self, cur, rows: List[tuple]) -> int:
+        """delete rows whose start time changed (no commit)
+        パーティション化したtoggl_reportの一意制約は(toggl_id, start_time)のため、
+        開始時刻が変わったデータは古い行を削除してから登録する
+
+        Return:
+            rows:int
+                削除した件数
+        """
+        if not rows:
+            return 0
+        _execute_values(
+            cur,
+            'DELETE FROM toggl_report t USING (VALUES %s) AS v (toggl_id, start_time) '
+            'WHERE t.toggl_id = v.toggl_id AND t.start_time <> v.start_time::timestamptz',
+            [(row[0], row[6]) for row in rows],
+            page_size=len(rows))
+        return cur.rowcount
+
+    def _to_row(self, detail: TogglReportDetail) -> tuple:
+        """toggl_reportの列順の値"""
+        return (
+            detail.id,
+            detail.pid,
+            detail.tid,
+            detail.uid,
+            detail.user,
+            detail.description,
+            detail.start,
+            detail.end,
+            detail.updated,
+            detail.dur,
+            detail.backlog_issue_key
+        )
+
+
+class DbTogglAggregateRepository():
+    """Toggl aggregate repository interface with db.
+    日次集計（toggl_daily_rollup）を参照する。toggl_reportは参照しない
+    """
+
+    def __init__(self):
+        """Initialize.
+        db connectionはwarm起動間で共有するもの（get_db_connection）を最初に使うときに取得する
+        """
+        self._db_connection = get_db_connection('toggl_aggregate')
+        self._lock = self._db_connection.lock
+
+    @property
+    def conn(self):
+        """db connection (shared, lazy)"""
+        return self._db_connection.get()
+
+    def find_aggregates(self, group_by: str, since: datetime.date, until: datetime.date,
+                        issue_key: str = None, user_name: str = None) -> List[TogglAggregate]:
+        """find aggregates
+        Args:
+            group_by:str
+                集計単位（issues、users、days）
+            since:datetime.date
+                集計開始日
+            until:datetime.date
+                集計終了日（含む）
+            issue_key:str
+                指定した場合はそのBacklog issueのみ集計
+            user_name:str
+                指定した場合はそのユーザーのみ集計
+
+        Return:
+            data:List[TogglAggregate]
+                集計単位毎の合計。key順
+        """
+        _column = AGGREGATE_GROUP_COLUMNS[group_by]
+        _statement = (f'SELECT {_column} AS key, sum(sum_dur) AS sum_dur, sum(entry_count) AS entry_count '
+                      'FROM toggl_daily_rollup WHERE day >= %s AND day <= %s')
+        _variables = [since, until]
+        if issue_key:
+            _statement += ' AND backlog_issue_key = %s'
+            _variables.append(issue_key)
+        if user_name:
+            _statement += ' AND user_name = %s'
+            _variables.append(user_name)
+        _statement += f' GROUP BY {_column} ORDER BY {_column}'
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
                     _cur.execute(_statement, _variables)
+                    recset = _cur.fetchall()
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('aggregate select error:{}'.format(e))
+
+        return [TogglAggregate(
+            key=dict['key'].isoformat() if isinstance(dict['key'], datetime.date) else dict['key'],
+            sum_dur=int(dict['sum_dur']),
+            sum_dur_hours=round(int(dict['sum_dur'])/(60*60*1000), 2),
+            entry_count=int(dict['entry_count'])
+            ) for dict in recset]
+
+
+class DbTogglPartitionRepository():
+    """Toggl report partition repository interface with db.
+    toggl_reportの月次パーティションの移行・作成・保存期間の管理
+    """
+
+    def __init__(self):
+        """Initialize.
+        db connectionはwarm起動間で共有するもの（get_db_connection）を最初に使うときに取得する
+        """
+        self._db_connection = get_db_connection('toggl_partition')
+        self._lock = self._db_connection.lock
+
+    @property
+    def conn(self):
+        """db connection (shared, lazy)"""
+        return self._db_connection.get()
+
+    def is_partitioned(self) -> bool:
+        """toggl_reportがパーティション化されていればTrue"""
+        with self._lock:
+            with self.conn.cursor() as _cur:
+                _cur.execute("SELECT relkind FROM pg_class WHERE oid = 'public.toggl_report'::regclass")
+                _row = _cur.fetchone()
             self.conn.commit()
+        return bool(_row) and _row[0] == 'p'
+
+    def migrate(self, months_ahead: int = None, drop_old: bool = False) -> bool:
+        """migrate toggl_report to monthly partitions
+        既存のtoggl_reportをtoggl_report_heapに改名し、同じ列のパーティション化したtoggl_reportへ移す（1トランザクション）
+        移行中はtoggl_reportをlockするため、取り込みが動いていない時間に実行すること
+
+        Args:
+            months_ahead:int
+                何か月先までパーティションを作成するか。省略時はTOGGL_PARTITION_MONTHS_AHEAD
+            drop_old:bool
+                Trueの場合、移行元（toggl_report_heap）を削除する
+
+        Return:
+            bool
+                移行した場合True。移行済みならFalse
+        """
+        if months_ahead is None:
+            months_ahead = get_config().toggl_partition_months_ahead
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute('LOCK TABLE toggl_report IN ACCESS EXCLUSIVE MODE')
+                    _cur.execute("SELECT relkind FROM pg_class WHERE oid = 'public.toggl_report'::regclass")
+                    if _cur.fetchone()[0] == 'p':
+                        self.conn.rollback()
+                        return False
+                    # 移行元の名前を変え、制約・index・triggerの名前を空ける
+                    _cur.execute('ALTER TABLE toggl_report RENAME TO toggl_report_heap')
+                    _cur.execute('ALTER TABLE toggl_report_heap RENAME CONSTRAINT '
+                                 'toggl_report_toggl_id_key TO toggl_report_heap_toggl_id_key')
+                    for index in ('backlog_issue_key_idx', 'start_time_idx', 'toggl_id_idx', 'issue_dur_idx'):
+                        _cur.execute(f'ALTER INDEX IF EXISTS toggl_report_{index} '
+                                     f'RENAME TO toggl_report_heap_{index}')
+                    for trigger in ('insert', 'update', 'delete'):
+                        _cur.execute(f'DROP TRIGGER IF EXISTS toggl_report_summary_{trigger} ON toggl_report_heap')
+                    _cur.execute('ALTER SEQUENCE toggl_report_id_seq OWNED BY NONE')
+                    self._create_partitioned_table(_cur)
+
+                    # 既存データの月とmonths_ahead先までのパーティションを作成してから移す
+                    _cur.execute("SELECT DISTINCT date_trunc('month', start_time AT TIME ZONE 'UTC')::date "
+                                 'FROM toggl_report_heap')
+                    _months = {row[0] for row in _cur.fetchall()}
+                    _months.update(self._months_ahead(months_ahead))
+                    for month in sorted(_months):
+                        self._create_partition(_cur, month)
+                    with current_metrics().phase('partition_migrate'):
+                        _cur.execute('INSERT INTO toggl_report (id,toggl_id,pid,tid,uid,user_name,description,'
+                                     'start_time,end_time,updated,dur,backlog_issue_key,created_at) '
+                                     'SELECT id,toggl_id,pid,tid,uid,user_name,description,'
+                                     'start_time,end_time,updated,dur,backlog_issue_key,created_at '
+                                     'FROM toggl_report_heap')
+                    app.log.info(f'[partition migrate]{_cur.rowcount} rows, {len(_months)} partitions')
+                    # 集計テーブルは移行前と同じ内容のため、移した後にtriggerを作成する
+                    self._create_summary_triggers(_cur)
+                    if drop_old:
+                        _cur.execute('DROP TABLE toggl_report_heap')
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('toggl report partition migrate error:{}'.format(e))
+
+    def ensure_partitions(self, months_ahead: int = None) -> List[str]:
+        """ensure monthly partitions
+        今月からmonths_ahead先までと、defaultパーティションにデータがある月のパーティションを作成する
+        defaultパーティションのデータは作成したパーティションへ移す
+
+        Args:
+            months_ahead:int
+                何か月先までパーティションを作成するか。省略時はTOGGL_PARTITION_MONTHS_AHEAD
+
+        Return:
+            partitions:List[str]
+                作成したパーティション
+        """
+        if months_ahead is None:
+            months_ahead = get_config().toggl_partition_months_ahead
+        _created = []
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute("SELECT DISTINCT date_trunc('month', start_time AT TIME ZONE 'UTC')::date "
+                                 f'FROM {TOGGL_REPORT_DEFAULT_PARTITION}')
+                    _months = {row[0] for row in _cur.fetchall()}
+                    _months.update(self._months_ahead(months_ahead))
+                    _retired = self._retired_months(_cur)
+                    for month in sorted(_months):
+                        if month in _retired:
+                            # 切り離した月のデータは集計が二重になるため作り直さない
+                            app.log.warning(f'[partition retired]{month} rows remain in default partition')
+                            continue
+                        if self._create_partition(_cur, month):
+                            _created.append(self._partition_name(month))
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('toggl report partition create error:{}'.format(e))
+        app.log.info(f'[partition created]{_created}')
+        return _created
+
+    def apply_retention(self, keep_months: int = None, policy: str = None) -> List[str]:
+        """apply retention policy
+        keep_monthsより古い月のパーティションを切り離す。Backlogの実績時間が変わらないよう、
+        切り離す前にissue毎の集計をtoggl_report_retiredに残す（toggl_issue_summaryはそのまま）
+
+        Args:
+            keep_months:int
+                残す月数（今月を含む）。省略時はTOGGL_RETENTION_MONTHS。0なら何もしない
+            policy:str
+                archive：toggl_archiveスキーマに移して残す、drop：削除する。省略時はTOGGL_RETENTION_POLICY
+
+        Return:
+            partitions:List[str]
+                切り離したパーティション
+        """
+        _config = get_config()
+        keep_months = _config.toggl_retention_months if keep_months is None else keep_months
+        policy = policy or _config.toggl_retention_policy
+        if not keep_months:
+            return []
+        if policy not in RETENTION_POLICIES:
+            raise TogglDBError(f'unknown retention policy:{policy}')
+        _cutoff = self._add_months(datetime.date.today().replace(day=1), 1 - keep_months)
+        if _cutoff > _window_start().date() - datetime.timedelta(days=1):
+            # 直近の同期対象期間のデータは切り離さない
+            raise TogglDBError(f'retention {keep_months} months overlaps TOGGL_PAST_DAYS')
+
+        _retired = []
+        with self._lock:
+            for month, partition in self._find_partitions():
+                if month >= _cutoff:
+                    continue
+                try:
+                    with self.conn.cursor() as _cur:
+                        self._retire_partition(_cur, month, partition, policy)
+                    self.conn.commit()
+                    _retired.append(partition)
+                except Exception as e:
+                    self.conn.rollback()
+                    raise TogglDBError('toggl report partition retention error:{}'.format(e))
+        app.log.info(f'[partition retired]{_retired} policy:{policy}')
+        return _retired
+
+    def _find_partitions(self) -> List[tuple]:
+        """月次パーティションの(月, テーブル名)。月順"""
+        with self.conn.cursor() as _cur:
+            _cur.execute('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                         "WHERE i.inhparent = 'public.toggl_report'::regclass")
+            _names = [row[0] for row in _cur.fetchall()]
+        self.conn.commit()
+        _partitions = []
+        for name in _names:
+            if name.startswith(TOGGL_REPORT_PARTITION_PREFIX):
+                _month = datetime.datetime.strptime(name[len(TOGGL_REPORT_PARTITION_PREFIX):], '%Y%m').date()
+                _partitions.append((_month, name))
+        return sorted(_partitions)
+
+    def _retire_partition(self, cur, month: datetime.date, partition: str, policy: str) -> None:
+        """retire one partition (no commit)"""
+        cur.execute('INSERT INTO toggl_report_retired (month,backlog_issue_key,sum_dur,entry_count) '
+                    f'SELECT %s, backlog_issue_key, sum(dur), count(*) FROM {partition} '
+                    'WHERE backlog_issue_key IS NOT NULL GROUP BY backlog_issue_key '
+                    'ON CONFLICT (month, backlog_issue_key) DO UPDATE SET '
+                    'sum_dur = EXCLUDED.sum_dur, entry_count = EXCLUDED.entry_count',
+                    [month])
+        # DETACH/DROPではtriggerが動かないため、toggl_issue_summaryは変わらない
+        cur.execute(f'ALTER TABLE toggl_report DETACH PARTITION {partition}')
+        if policy == 'drop':
+            cur.execute(f'DROP TABLE {partition}')
+        else:
+            cur.execute(f'CREATE SCHEMA IF NOT EXISTS {TOGGL_ARCHIVE_SCHEMA}')
+            cur.execute(f'ALTER TABLE {partition} SET SCHEMA {TOGGL_ARCHIVE_SCHEMA}')
+
+    def _retired_months(self, cur) -> set:
+        """切り離した月"""
+        cur.execute('SELECT DISTINCT month FROM toggl_report_retired')
+        return {row[0] for row in cur.fetchall()}
+
+    def _create_partition(self, cur, month: datetime.date) -> bool:
+        """create one monthly partition (no commit)
+        defaultパーティションにある同じ月のデータを移してからATTACHする（triggerは動かない）
+
+        Return:
+            bool
+                作成した場合True。作成済みならFalse
+        """
+        _name = self._partition_name(month)
+        cur.execute('SELECT to_regclass(%s)', [f'public.{_name}'])
+        if cur.fetchone()[0]:
+            return False
+        _bounds = [f'{month.isoformat()} 00:00:00+00', f'{self._add_months(month, 1).isoformat()} 00:00:00+00']
+        cur.execute(f'CREATE TABLE {_name} (LIKE toggl_report INCLUDING DEFAULTS)')
+        cur.execute(f'WITH moved AS (DELETE FROM {TOGGL_REPORT_DEFAULT_PARTITION} '
+                    'WHERE start_time >= %s AND start_time < %s RETURNING *) '
+                    f'INSERT INTO {_name} SELECT * FROM moved', _bounds)
+        cur.execute(f'ALTER TABLE toggl_report ATTACH PARTITION {_name} FOR VALUES FROM (%s) TO (%s)', _bounds)
+        return True
+
+    def _create_partitioned_table(self, cur) -> None:
+        """create partitioned toggl_report (ddl.sqlと同じ定義)"""
+        cur.execute('CREATE TABLE toggl_report ('
+                    "id int4 NOT NULL DEFAULT nextval('toggl_report_id_seq'::regclass), "
+                    'toggl_id int8 NOT NULL, pid int4 NULL, tid int4 NULL, uid int4 NULL, '
+                    'user_name varchar(1000) NULL, description text NULL, '
+                    'start_time timestamptz NOT NULL, end_time timestamptz NOT NULL, '
+                    'updated timestamptz NOT NULL, dur int4 NOT NULL, '
+                    'backlog_issue_key varchar(255) NULL, '
+                    'created_at timestamptz NOT NULL DEFAULT now(), '
+                    'CONSTRAINT toggl_report_toggl_id_key UNIQUE (toggl_id, start_time)'
+                    ') PARTITION BY RANGE (start_time)')
+        cur.execute('ALTER SEQUENCE toggl_report_id_seq OWNED BY toggl_report.id')
+        cur.execute(f'CREATE TABLE {TOGGL_REPORT_DEFAULT_PARTITION} PARTITION OF toggl_report DEFAULT')
+        cur.execute('CREATE INDEX toggl_report_issue_dur_idx ON toggl_report '
+                    'USING btree (backlog_issue_key) INCLUDE (dur)')
+        cur.execute('CREATE INDEX toggl_report_start_time_idx ON toggl_report USING btree (start_time)')
+        cur.execute('CREATE INDEX toggl_report_toggl_id_idx ON toggl_report USING btree (toggl_id)')
+
+    def _create_summary_triggers(self, cur) -> None:
+        """create toggl_issue_summary triggers (ddl.sqlと同じ定義)"""
+        cur.execute('CREATE TRIGGER toggl_report_summary_insert AFTER INSERT ON toggl_report '
+                    'REFERENCING NEW TABLE AS new_rows '
+                    'FOR EACH STATEMENT EXECUTE FUNCTION toggl_issue_summary_apply()')
+        cur.execute('CREATE TRIGGER toggl_report_summary_update AFTER UPDATE ON toggl_report '
+                    'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+                    'FOR EACH STATEMENT EXECUTE FUNCTION toggl_issue_summary_apply()')
+        cur.execute('CREATE TRIGGER toggl_report_summary_delete AFTER DELETE ON toggl_report '
+                    'REFERENCING OLD TABLE AS old_rows '
+                    'FOR EACH STATEMENT EXECUTE FUNCTION toggl_issue_summary_apply()')
+
+    def _months_ahead(self, months_ahead: int) -> List[datetime.date]:
+        """今月からmonths_ahead先までの月初"""
+        _month = datetime.date.today().replace(day=1)
+        return [self._add_months(_month, i) for i in range(max(0, months_ahead) + 1)]
+
+    def _partition_name(self, month: datetime.date) -> str:
+        return f'{TOGGL_REPORT_PARTITION_PREFIX}{month.strftime("%Y%m")}'
+
+    def _add_months(self, month: datetime.date, months: int) -> datetime.date:
+        _index = month.year * 12 + month.month - 1 + months
+        return datetime.date(_index // 12, _index % 12 + 1, 1)
+
+
+class DbBacklogIssueRepository():
+    """Backlog issue cache repository interface with db.
+    Backlog APIの取得結果をキャッシュする（コメント取得位置など）
+    """
+
+    def __init__(self):
+        """Initialize.
+        db connectionはwarm起動間で共有するもの（get_db_connection）を最初に使うときに取得する
+        issueを並列処理するため、コネクションの利用はlockで直列化する
+        """
+        self._db_connection = get_db_connection('backlog_issue')
+        self._lock = self._db_connection.lock
+
+    @property
+    def conn(self):
+        """db connection (shared, lazy)"""
+        return self._db_connection.get()
+
+    def find_comment_cursor(self, issue_key: str) -> BacklogCommentCursor:
+        """find comment cursor
+        Args:
+            issue_key:str
+                backlog issueのkey
+
+        Return:
+            cursor:BacklogCommentCursor
+                前回までに集計したコメント位置と手動実績時間。未登録なら初期値
+        """
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute('SELECT last_comment_id, manual_actual_hours '
+                                 'FROM backlog_comment_cursor WHERE issue_key = %s',
+                                 [issue_key])
+                    _row = _cur.fetchone()
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('comment cursor select error:{}'.format(e))
+
+        if not _row:
+            return BacklogCommentCursor(issue_key=issue_key)
+        return BacklogCommentCursor(
+            issue_key=issue_key,
+            last_comment_id=_row['last_comment_id'],
+            manual_actual_hours=float(_row['manual_actual_hours'])
+            )
+
+    def save_comment_cursor(self, cursor: BacklogCommentCursor) -> bool:
+        """save comment cursor
+        Args:
+            cursor:BacklogCommentCursor
+                集計済みのコメント位置と手動実績時間
+
+        Return:
+            bool
+                成功していればTrue
+        """
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute('INSERT INTO backlog_comment_cursor (issue_key,'
+                                 'last_comment_id,manual_actual_hours) VALUES (%s,%s,%s) '
+                                 'ON CONFLICT (issue_key) DO UPDATE SET '
+                                 'last_comment_id = EXCLUDED.last_comment_id, '
+                                 'manual_actual_hours = EXCLUDED.manual_actual_hours, '
+                                 'updated_at = now()',
+                                 [cursor.issue_key, cursor.last_comment_id,
+                                  cursor.manual_actual_hours])
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('comment cursor save error:{}'.format(e))
+
+    def find_issue_ids(self, issue_keys: List[str]) -> dict:
+        """find issue ids
+        Args:
+            issue_keys:List[str]
+                backlog issueのkey
+
+        Return:
+            issue_ids:dict
+                issue keyをキーとしたissue id。未登録のkeyは含まない
+        """
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute('SELECT issue_key, issue_id FROM backlog_issue_id_map '
+                                 'WHERE issue_key = ANY(%s)',
+                                 [list(issue_keys)])
+                    recset = _cur.fetchall()
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('issue id map select error:{}'.format(e))
+        return {dict['issue_key']: dict['issue_id'] for dict in recset}
+
+    def save_issue_ids(self, issue_ids: dict) -> bool:
+        """save issue ids
+        Args:
+            issue_ids:dict
+                issue keyをキーとしたissue id
+
+        Return:
+            bool
+                成功していればTrue
+        """
+        if not issue_ids:
             return True
-        except Exception as e:
-            self.conn.rollback()
-            raise TogglDBError('toggl data insert error:{}'.format(e))
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _execute_values(
+                        _cur,
+                        'INSERT INTO backlog_issue_id_map (issue_key,issue_id) VALUES %s '
+                        'ON CONFLICT (issue_key) DO UPDATE SET '
+                        'issue_id = EXCLUDED.issue_id, updated_at = now()',
+                        list(issue_ids.items()))
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('issue id map save error:{}'.format(e))
+
+
+class DbSyncQueueRepository():
+    """Backlog sync queue repository interface with db.
+    Togglの変更イベントで同期待ちになったissueをissue毎にまとめて保持する（debounce）
+    """
+
+    def __init__(self):
+        """Initialize.
+        db connectionはwarm起動間で共有するもの（get_db_connection）を最初に使うときに取得する
+        """
+        self._db_connection = get_db_connection('sync_queue')
+        self._lock = self._db_connection.lock
+
+    @property
+    def conn(self):
+        """db connection (shared, lazy)"""
+        return self._db_connection.get()
+
+    def enqueue(self, issue_keys: List[str], debounce_seconds: int = None,
+                max_wait_seconds: int = None) -> int:
+        """enqueue issues
+        debounce_seconds後に同期する。同期待ちのissueはイベント毎に同期時刻を後ろにずらすが、
+        最初のイベントからmax_wait_secondsを超えては遅らせない
+        最大待ち時刻を過ぎている（同期中・同期できずに残った）issueは、このイベントから最大待ち時間を数え直す
+
+        Args:
+            issue_keys:List[str]
+                変更があったBacklog issueのkey
+            debounce_seconds:int
+                最後のイベントから同期までの待ち時間。省略時はSYNC_DEBOUNCE_SECONDS
+            max_wait_seconds:int
+                最初のイベントから同期までの最大待ち時間。省略時はSYNC_DEBOUNCE_MAX_SECONDS
+
+        Return:
+            count:int
+                登録したissue数
+        """
+        _config = get_config()
+        debounce_seconds = _config.sync_debounce_seconds if debounce_seconds is None else debounce_seconds
+        max_wait_seconds = _config.sync_debounce_max_seconds if max_wait_seconds is None else max_wait_seconds
+        _issue_keys = sorted(set(issue_keys))
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    for issue_key in _issue_keys:
+                        _cur.execute('INSERT INTO backlog_sync_queue (issue_key,due_at,max_due_at) '
+                                     'VALUES (%s, now() + make_interval(secs => %s), '
+                                     'now() + make_interval(secs => %s)) '
+                                     'ON CONFLICT (issue_key) DO UPDATE SET '
+                                     'due_at = LEAST(GREATEST(backlog_sync_queue.due_at, EXCLUDED.due_at), '
+                                     'CASE WHEN backlog_sync_queue.max_due_at < now() THEN EXCLUDED.max_due_at '
+                                     'ELSE backlog_sync_queue.max_due_at END), '
+                                     'max_due_at = CASE WHEN backlog_sync_queue.max_due_at < now() '
+                                     'THEN EXCLUDED.max_due_at ELSE backlog_sync_queue.max_due_at END, '
+                                     'event_count = backlog_sync_queue.event_count + 1',
+                                     [issue_key, debounce_seconds, max(debounce_seconds, max_wait_seconds)])
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('sync queue enqueue error:{}'.format(e))
+        return len(_issue_keys)
+
+    def find_due(self, limit: int = None) -> List[BacklogSyncQueueItem]:
+        """find due issues
+        Args:
+            limit:int
+                取得件数。省略時はSYNC_QUEUE_BATCH_SIZE
+
+        Return:
+            data:List[BacklogSyncQueueItem]
+                同期時刻を過ぎたissue。同期時刻順
+        """
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute('SELECT issue_key, due_at, event_count FROM backlog_sync_queue '
+                                 'WHERE due_at <= now() ORDER BY due_at LIMIT %s',
+                                 [limit or get_config().sync_queue_batch_size])
+                    recset = _cur.fetchall()
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('sync queue select error:{}'.format(e))
+        return [BacklogSyncQueueItem(
+            issue_key=dict['issue_key'],
+            due_at=dict['due_at'],
+            event_count=dict['event_count']
+            ) for dict in recset]
+
+    def complete(self, items: List[BacklogSyncQueueItem]) -> bool:
+        """complete issues
+        同期したissueを削除する。同期中に新しいイベントが来た（due_atかevent_countが変わった）issueは残す
+        （最大待ち時刻に達したissueはイベントが来てもdue_atが変わらないため、event_countでも判定する）
+
+        Args:
+            items:List[BacklogSyncQueueItem]
+                find_dueで取得し、同期したissue
+
+        Return:
+            bool
+                成功していればTrue
+        """
+        if not items:
+            return True
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _execute_values(
+                        _cur,
+                        'DELETE FROM backlog_sync_queue q USING (VALUES %s) AS d (issue_key, due_at, event_count) '
+                        'WHERE q.issue_key = d.issue_key AND q.due_at = d.due_at '
+                        'AND q.event_count = d.event_count',
+                        [(item.issue_key, item.due_at, item.event_count) for item in items])
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('sync queue complete error:{}'.format(e))
+
+    def postpone(self, items: List[BacklogSyncQueueItem], delay_seconds: int = None) -> bool:
+        """postpone issues
+        同期に失敗したissueをdelay_seconds後に再度同期する
+
+        Args:
+            items:List[BacklogSyncQueueItem]
+                同期に失敗したissue
+            delay_seconds:int
+                再同期までの待ち時間。省略時はSYNC_DEBOUNCE_SECONDS
+
+        Return:
+            bool
+                成功していればTrue
+        """
+        if not items:
+            return True
+        if delay_seconds is None:
+            delay_seconds = get_config().sync_debounce_seconds
+        with self._lock:
+            try:
+                with self.conn.cursor() as _cur:
+                    _cur.execute('UPDATE backlog_sync_queue SET '
+                                 'due_at = GREATEST(due_at, now() + make_interval(secs => %s)), '
+                                 'max_due_at = GREATEST(max_due_at, now() + make_interval(secs => %s)) '
+                                 'WHERE issue_key = ANY(%s)',
+                                 [delay_seconds, delay_seconds, [item.issue_key for item in items]])
+                self.conn.commit()
+                return True
+            except Exception as e:
+                self.conn.rollback()
+                raise TogglDBError('sync queue postpone error:{}'.format(e))
 
 
 class BacklogIssueRepository():
     """Backlog issue repository interface"""
 
-    def __init__(self):
+    def __init__(
+            self,
+            db_backlog_issue_repository: DbBacklogIssueRepository = None,
+            http_client: HttpClient = None):
         """Initialize
         API用の共通ヘッダー設定
             Args:
-                None
+                db_backlog_issue_repository:DbBacklogIssueRepository
+                    コメント取得位置のキャッシュ。省略時は毎回すべてのコメントを取得
+                http_client:HttpClient
+                    API呼び出しに使うHttpClient。省略時は共有クライアント
         """
+        self.db_backlog_issue_repository = db_backlog_issue_repository
+        self.http_client = http_client or get_http_client()
+        self.rate_limiter = get_rate_limiter('backlog')
         self.api_headers = {
             'Content-Type': 'application/json'
         }
+        # prefetch_issuesで取得したissue（issue key毎。get_issue_dataで1回だけ使う）
+        self._prefetched = {}
+        self._prefetched_lock = threading.Lock()
         pass
 
+    def prefetch_issues(self, toggl_summary_data: List[TogglReportSummary]) -> int:
+        """prefetch backlog issues
+        issue key→idの対応（DBキャッシュ）がわかっているissueを、issue一覧APIでBACKLOG_ISSUE_LIST_MAX件ずつまとめて取得する
+        取得できなかったissueはget_issue_dataで1件ずつ取得する
+
+        Args:
+            toggl_summary_data:List[TogglReportSummary]
+                同期対象のBacklogIssue毎のTogglデータ
+
+        Return:
+            count:int
+                まとめて取得できたissue数
+        """
+        if not self.db_backlog_issue_repository or not toggl_summary_data:
+            return 0
+        _issue_keys = [toggl_summary.backlog_issue_key for toggl_summary in toggl_summary_data]
+        _issue_ids = self.db_backlog_issue_repository.find_issue_ids(_issue_keys)
+        _keys_by_id = {issue_id: issue_key for issue_key, issue_id in _issue_ids.items()}
+        _ids = list(_keys_by_id)
+        _prefetched = {}
+        with current_metrics().phase('backlog_prefetch'):
+            for i in range(0, len(_ids), BACKLOG_ISSUE_LIST_MAX):
+                try:
+                    _issues = self._get_issues_by_id(_ids[i:i + BACKLOG_ISSUE_LIST_MAX])
+                except BacklogAPIError as e:
+                    # まとめて取得できなくても1件ずつ取得できるので続行
+                    app.log.warning(f'[backlog issue prefetch error]{e}')
+                    continue
+                for issue in _issues:
+                    # 課題の移動等でkeyが変わっている場合は使わない（1件ずつ取得してidを更新）
+                    if _keys_by_id.get(issue['id']) == issue['issueKey']:
+                        _prefetched[issue['issueKey']] = issue
+        with self._prefetched_lock:
+            self._prefetched.update(_prefetched)
+        current_metrics().incr('backlog_issues_prefetched', len(_prefetched))
+        app.log.info(f'[backlog issue prefetch]{len(_prefetched)}/{len(_issue_keys)} issues')
+        return len(_prefetched)
+
+    def _get_issues_by_id(self, issue_ids: List[int]) -> List[dict]:
+        """get backlog issues by issue list api
+
+        Args:
+            issue_ids:List[int]
+                backlog issueのid（BACKLOG_ISSUE_LIST_MAX件以下）
+
+        Return:
+            data:List[dict]
+                issue data
+        """
+        _url = f'{get_config().backlog_base_url}/api/v2/issues'
+        _params = [('apiKey', get_config().backlog_apikey), ('count', BACKLOG_ISSUE_LIST_MAX)]
+        _params.extend(('issueId[]', issue_id) for issue_id in issue_ids)
+        _req = self.http_client.get(_url, params=_params, headers=self.api_headers,
+                                    rate_limiter=self.rate_limiter)
+        app.log.info(f'[backlog issue list url]{_url} issues:{len(issue_ids)}')
+        if _req.status_code != 200:
+            raise BacklogAPIError('failed to get issue list')
+        _res = json.loads(_req.text)
+        log_payload('backlog issue list result', _res)
+        return _res
+
     def get_issue_data(self, toggl_summary: TogglReportSummary) -> BacklogIssue:
         """get backlog issue data
+        prefetch_issuesで取得済みならそれを使い、なければissue key指定で取得する
+
         Args:
             toggl_data:TogglReportSummary
                 Backlogのissue情報取得のためのTogglデータ。togglで登録されているBacklog issueを取得する
@@ -296,21 +2078,17 @@ class BacklogIssueRepository():
             backlog_issue:BacklogIssue
                 Backlog issue modelを返す
         """
-        _url = (f'{BACKLOG_BASE_URL}/api/v2/issues/{toggl_summary.backlog_issue_key}'
-                f'?apiKey={BACKLOG_APIKEY}')
-        _req = requests.get(_url, headers=self.api_headers)
-        app.log.info(f'[backlog issue url]{_url}')
+        with self._prefetched_lock:
+            _res = self._prefetched.pop(toggl_summary.backlog_issue_key, None)
+        if _res is None:
+            _res = self._get_issue(toggl_summary.backlog_issue_key)
 
-        if _req.status_code == 200:
-            _res = json.loads(_req.text)
-            app.log.info(f'[backlog issue result]{_res}')
-            _comments = self._get_comments_data(_res["issueKey"], _res["actualHours"])
-            _manual_actual_hours = self._get_manual_actual_hours(_comments)
+        if _res:
+            _manual_actual_hours = self._get_manual_actual_hours(_res["issueKey"], _res["actualHours"])
             _backlog_issue = BacklogIssue(
                 issue_key=_res["issueKey"],
                 actual_hours=_res["actualHours"],
-                manual_actual_hours=_manual_actual_hours,
-                comments=_comments
+                manual_actual_hours=_manual_actual_hours
                 )
         else:
             app.log.info(f'[backlog issue not found')
@@ -318,78 +2096,136 @@ class BacklogIssueRepository():
 
         return _backlog_issue
 
-    def _get_comments_data(self, issue_key: str, actual_hours: float) -> List:
-        """get backlog comment data
-        issueに紐づくすべてのコメントデータを取得
+    def _get_issue(self, issue_key: str) -> dict:
+        """get backlog issue by issue key
+        取得できたissueのidはDBにキャッシュし、次回からはissue一覧APIでまとめて取得する
 
         Args:
             issue_key:str
                 backlog issueのkey
-            actual_hours:float
-                backlog issueに登録されている実績時間
 
         Return:
-            data:[]
-                Backlog issueに紐づくcomment dataの配列
-                実績時間が登録ない場合、取得の必要がないのでNone
+            data:dict
+                issue data。見つからなければ（404）None
         """
-        if not actual_hours:
-            # 実績時間登録なしの場合
-            # commentデータを取る必要はないのでNoneのまま
+        _url = (f'{get_config().backlog_base_url}/api/v2/issues/{issue_key}'
+                f'?apiKey={get_config().backlog_apikey}')
+        _req = self.http_client.get(_url, headers=self.api_headers,
+                                    rate_limiter=self.rate_limiter)
+        app.log.info(f'[backlog issue url]{_url}')
+        if _req.status_code == 404:
             return None
-        else:
-            # 実績時間登録ありの場合
-            # commentデータを取得
-            _total_data = []
-            _min_id = 1
-            while True:
-                _url = (f'{BACKLOG_BASE_URL}/api/v2/issues/{issue_key}/comments?'
-                        f'apiKey={BACKLOG_APIKEY}&count={BACKLOG_COMMENT_COUNT}'
-                        f'&order=asc&minId={_min_id}')
-                _req = requests.get(_url, headers=self.api_headers)
-                app.log.info(f'[backlog comment url]{_url}')
-                if _req.status_code == 200:
-                    _res = json.loads(_req.text)
-                    app.log.info(f'[backlog comment data]{_res}')
-                    _total_data += _res
-                    if len(_res) == int(BACKLOG_COMMENT_COUNT):
-                        _min_id = _res[len(_res)-1]['id']
-                    else:
-                        break
-                else:
-                    raise BacklogAPIError('failed to get comment data')
+        if _req.status_code != 200:
+            # 5xx・429（リトライ後も失敗）等は同期済みにしないよう例外にする
+            raise BacklogAPIError(f'failed to get issue:{issue_key} status:{_req.status_code}')
+        _res = json.loads(_req.text)
+        log_payload('backlog issue result', _res)
+        if self.db_backlog_issue_repository:
+            self.db_backlog_issue_repository.save_issue_ids({_res['issueKey']: _res['id']})
+        return _res
+
+    def _iter_comments_data(self, issue_key: str, min_id: int) -> Iterator[dict]:
+        """iterate backlog comment data
+        min_idより新しいコメントデータを昇順にページングしながら1件ずつ返す
+
+        Args:
+            issue_key:str
+                backlog issueのkey
+            min_id:int
+                取得済みの最後のコメントid。これより新しいコメントのみ返す
 
-            return _total_data
+        Return:
+            data:Iterator[dict]
+                Backlog issueに紐づくcomment data
+        """
+        # 返したコメントの最後のid。minIdが含む・含まないどちらでも、ページの境界のコメントを二重に返さない
+        _last_id = min_id or 0
+        while True:
+            _url = (f'{get_config().backlog_base_url}/api/v2/issues/{issue_key}/comments?'
+                    f'apiKey={get_config().backlog_apikey}&count={get_config().backlog_comment_count}'
+                    f'&order=asc' + (f'&minId={_last_id}' if _last_id else ''))
+            _req = self.http_client.get(_url, headers=self.api_headers,
+                                        rate_limiter=self.rate_limiter)
+            app.log.info(f'[backlog comment url]{_url}')
+            if _req.status_code != 200:
+                raise BacklogAPIError('failed to get comment data')
 
-    def _get_manual_actual_hours(self, comments: List) -> float:
+            _res = json.loads(_req.text)
+            log_payload('backlog comment data', _res)
+            _page_min_id = _last_id
+            for comment in _res:
+                if comment['id'] > _page_min_id:
+                    _last_id = max(_last_id, comment['id'])
+                    yield comment
+            if len(_res) < get_config().backlog_comment_count or _last_id == _page_min_id:
+                break
+
+    def _get_manual_actual_hours(self, issue_key: str, actual_hours: float) -> float:
         """get manual actual hours
         issueに登録されている実績時間の内、手動で実績登録している時間を計算
+        前回集計したコメント位置（DBキャッシュ）以降のコメントのみ取得して加算する
 
         Args:
-            comments:[]
-                backlog issueに紐づくcommentデータの配列
+            issue_key:str
+                backlog issueのkey
+            actual_hours:float
+                backlog issueに登録されている実績時間
 
         Return:
             manual_actual_hours:float
                 Backlog issueに登録されている実績時間から手動で登録した時間のみを計算したもの
+                実績時間が登録ない場合、コメント取得の必要がないので0.0
+        """
+        if not actual_hours:
+            # 実績時間登録なしの場合
+            # commentデータを取る必要はない
+            return 0.0
+
+        if self.db_backlog_issue_repository:
+            _cursor = self.db_backlog_issue_repository.find_comment_cursor(issue_key)
+        else:
+            _cursor = BacklogCommentCursor(issue_key=issue_key)
+        _last_comment_id = _cursor.last_comment_id
+        _manual_actual_hours: float = _cursor.manual_actual_hours
+        with current_metrics().phase('backlog_comments'):
+            for comment in self._iter_comments_data(issue_key, _cursor.last_comment_id):
+                _manual_actual_hours += self._get_comment_manual_hours(comment)
+                _last_comment_id = comment['id']
+                current_metrics().incr('backlog_comments_read')
+
+        if self.db_backlog_issue_repository and _last_comment_id != _cursor.last_comment_id:
+            self.db_backlog_issue_repository.save_comment_cursor(BacklogCommentCursor(
+                issue_key=issue_key,
+                last_comment_id=_last_comment_id,
+                manual_actual_hours=_manual_actual_hours
+                ))
+        app.log.info(f'[_manual_actual_hours]{_manual_actual_hours}')
+        return round(_manual_actual_hours, 2)
+
+    def _get_comment_manual_hours(self, comment: dict) -> float:
+        """get comment manual hours
+        コメント1件の変更履歴から、手動で登録した実績時間の増減を計算
+
+        Args:
+            comment:dict
+                backlog issueに紐づくcommentデータ
+
+        Return:
+            manual_hours:float
+                手動で変更された実績時間の差分。toggl連携のコメントなら0.0
         """
-        _manual_actual_hours: float = 0.0
-        for dict in comments:
-            _content = dict.get('content') or ''
-            app.log.info(f'[comment content]{_content}')
-            if not _content or (_content and not _content.startswith(BACKLOG_COMMENT)):
-                # コメントがない or toggl定型文でない場合のみ処理
-                for change_log in dict['changeLog']:
-                    if change_log['field'] == 'actualHours':
-                        # 実績時間更新がない履歴は無視
-                        _original_value = float(change_log['originalValue'] or 0)
-                        _new_value = float(change_log['newValue'] or 0)
-                        _manual_actual_hours = _manual_actual_hours + _new_value - _original_value
-                        app.log.info(f'[_manual_actual_hours]{_manual_actual_hours}')
-                        app.log.info(f'[_new_value]{_new_value}')
-                        app.log.info(f'[_original_value]{_original_value}')
-        _manual_actual_hours = round(_manual_actual_hours, 2)
-        return _manual_actual_hours
+        _manual_hours: float = 0.0
+        _content = comment.get('content') or ''
+        if not _content or (_content and not _content.startswith(get_config().backlog_comment)):
+            # コメントがない or toggl定型文でない場合のみ処理
+            for change_log in comment['changeLog']:
+                if change_log['field'] == 'actualHours':
+                    # 実績時間更新がない履歴は無視
+                    _original_value = float(change_log['originalValue'] or 0)
+                    _new_value = float(change_log['newValue'] or 0)
+                    _manual_hours = _manual_hours + _new_value - _original_value
+                    log_payload('manual actual hours change', f'{_original_value} -> {_new_value}')
+        return _manual_hours
 
     def update(self, toggl_summary: TogglReportSummary, backlog_issue: str, comment: List) -> bool:
         """update backlog issue
@@ -409,15 +2245,16 @@ class BacklogIssueRepository():
         """
 
         app.log.info('backlog update start')
-        _url = (f'{BACKLOG_BASE_URL}/api/v2/issues/{backlog_issue.issue_key}'
-                f'?apiKey={BACKLOG_APIKEY}')
+        _url = (f'{get_config().backlog_base_url}/api/v2/issues/{backlog_issue.issue_key}'
+                f'?apiKey={get_config().backlog_apikey}')
         data = {
             'actualHours': backlog_issue.manual_actual_hours + toggl_summary.sum_dur_hours,
             'comment': comment
         }
         app.log.info(f'[backlog update url]{_url}')
-        app.log.info(f'[backlog update data]{data}')
-        _req = requests.patch(_url, json=data, headers=self.api_headers)
+        log_payload('backlog update data', data)
+        _req = self.http_client.patch(_url, json=data, headers=self.api_headers,
+                                      rate_limiter=self.rate_limiter)
         if _req.status_code == 200:
             app.log.info(f'backlog update success')
             return True
@@ -3,16 +3,36 @@ Usecase modules.
 
 define buisiness logic.
 """
-from chalice import Chalice
+from chalicelib.application import app
+from chalicelib.cache import LruCache
+from chalicelib.config import get_config
+from chalicelib.metrics import current_metrics
+from chalicelib.metrics import log_payload
+from chalicelib.metrics import start_run_metrics
 from chalicelib.repositories import TogglReportSummaryRepository
 from chalicelib.repositories import DbTogglReportRepository
 from chalicelib.repositories import BacklogIssueRepository
-import os
+from chalicelib.repositories import DbSyncQueueRepository
+from chalicelib.repositories import DbTogglAggregateRepository
+from chalicelib.repositories import DbTogglPartitionRepository
+from chalicelib.models import BacklogIssueSyncResult
+from chalicelib.models import BacklogSyncShard
+from chalicelib.models import BacklogSyncShardResult
+from chalicelib.models import TogglAggregate
+from chalicelib.models import TogglBackfillShard
+from chalicelib.models import TogglReportSummary
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import List
+import dataclasses
+import datetime
 import math
+import threading
+import time
+import uuid
 
-app = Chalice(app_name='ExamApp')
-# productionでもcloudwatchにlog出力する
-app.debug = True
+# coordinatorがworkerの結果を待つのをやめる、Lambdaの残り時間
+COORDINATOR_SAFETY_MARGIN_MS = 30000
 
 
 class ImportFromTogglUsecase():
@@ -22,7 +42,9 @@ class ImportFromTogglUsecase():
             self,
             toggl_report_summary_repository: TogglReportSummaryRepository,
             db_toggl_report_repository: DbTogglReportRepository,
-            backlog_issue_repository: BacklogIssueRepository):
+            backlog_issue_repository: BacklogIssueRepository,
+            max_workers: int = None,
+            safety_margin_ms: int = None):
         """Initialize.
         インスタンス変数にrepository設定
 
@@ -33,6 +55,10 @@ class ImportFromTogglUsecase():
                 DBから取得したらToggl data（集計済み）格納
             backlog_issue_repository : BacklogIssueRepository
                 backlog issueのデータ格納
+            max_workers : int
+                Backlog issueを並列処理するworker数。1なら逐次処理。省略時はBACKLOG_MAX_WORKERS
+            safety_margin_ms : int
+                Lambdaの残り時間がこれを下回ったら新しいissueを開始しない。省略時はSYNC_SAFETY_MARGIN_MS
 
         Return:
             None
@@ -40,42 +66,854 @@ class ImportFromTogglUsecase():
         self.toggl_report_summary_repository = toggl_report_summary_repository
         self.db_toggl_report_repository = db_toggl_report_repository
         self.backlog_issue_repository = backlog_issue_repository
+        self.max_workers = max(1, max_workers or get_config().backlog_max_workers)
+        self.safety_margin_ms = (get_config().sync_safety_margin_ms
+                                 if safety_margin_ms is None else safety_margin_ms)
         pass
 
-    def handle(self):
+    def handle(self, full_reconcile: bool = False,
+               get_remaining_time_in_millis: Callable[[], int] = None):
         """usecase handle.
 
         Args:
-            None
+            full_reconcile:bool
+                Trueの場合、合計時間の変化に関わらずすべてのBacklogIssueを同期する
+                Falseの場合、前回同期時から合計時間が変わったBacklogIssueのみ同期する
+            get_remaining_time_in_millis:Callable[[], int]
+                Lambdaの残り実行時間（context.get_remaining_time_in_millis）。省略時は時間制限なし
+                残りがsafety_margin_msを下回ったら、残りのissueは次回に回す
 
         Return:
             boolean
+                issue毎の同期の失敗では例外を送出せずTrue（失敗したissueはretry_failedで再同期する）
+
+        """
+        # フェーズ毎の時間・リクエスト数等を集計し、終了時にEMFで出力
+        metrics = start_run_metrics('import_from_toggl')
+        try:
+            toggl_summary_data = self.import_toggl_data(full_reconcile)
+            results = self.sync_summaries(toggl_summary_data, get_remaining_time_in_millis)
+        finally:
+            metrics.emit()
+
+        _deferred = sum(1 for result in results if result.deferred)
+        if _deferred:
+            app.log.warning(f'[backlog sync deferred]{_deferred}/{len(results)} issues to next run')
+        _failed = [result.backlog_issue_key for result in results if result.error]
+        if _failed:
+            app.log.warning(f'[backlog sync failed]{len(_failed)}/{len(results)} issues to retry:{_failed}')
+
+        return True
+
+    def import_toggl_data(self, full_reconcile: bool = False) -> List[TogglReportSummary]:
+        """import toggl data and find issues to sync.
+        直近のtogglデータをDBに反映し、Backlogに同期するBacklogIssue毎の合計を返す
+
+        Args:
+            full_reconcile:bool
+                Trueの場合、合計時間の変化に関わらずすべてのBacklogIssueを返す
 
+        Return:
+            toggl_summary_data:List[TogglReportSummary]
+                同期対象のBacklogIssue毎のTogglReportデータ
         """
+        metrics = current_metrics()
         # get toggl data from 6 days ago to today
         app.log.info('get toggl data')
-        toggl_data: list = self.toggl_report_summary_repository.get_data()
-        # regist toggl data to database.
-        app.log.info('delete/insert toggl data to database')
-        self.db_toggl_report_repository.delete()
-        self.db_toggl_report_repository.insert(toggl_data)
+        # ページ単位で取得しながら、チャンク毎にDBへ登録する（全件をメモリに持たない）
+        # DBとは取得したのと同じ期間（Togglユーザーのタイムゾーン）で比較する
+        window = self.toggl_report_summary_repository.get_window()
+        toggl_data = self.toggl_report_summary_repository.iter_data(since=window.since, until=window.until)
+        # sync toggl data to database. 新規・変更・削除されたデータのみ反映
+        app.log.info('sync toggl data to database')
+        with metrics.phase('toggl_import'):
+            sync_result = self.db_toggl_report_repository.sync(toggl_data, window=window)
+        app.log.info(f'[toggl sync]inserted:{sync_result.inserted} updated:{sync_result.updated} '
+                     f'deleted:{sync_result.deleted} unchanged:{sync_result.unchanged}')
         # get toggl summary data from database.
         app.log.info('get toggl data from database')
-        toggl_summary_data: list = self.db_toggl_report_repository.find_summary_data()
-        app.log.info('calc toggl data.')
-        for toggl_summary in toggl_summary_data:
+        toggl_summary_data: list = self.db_toggl_report_repository.find_summary_data(
+            dirty_only=not full_reconcile)
+        app.log.info(f'calc toggl data. issues:{len(toggl_summary_data)} full_reconcile:{full_reconcile}')
+        return toggl_summary_data
+
+    def handle_issues(self, issue_keys: List[str]) -> List[BacklogIssueSyncResult]:
+        """usecase handle for specified issues.
+        指定したBacklog issueのtogglデータのみ取得・反映し、合計時間が変わっていればBacklogに同期する
+
+        Args:
+            issue_keys:List[str]
+                変更があったBacklog issueのkey
+
+        Return:
+            results:List[BacklogIssueSyncResult]
+                同期対象になったissue毎の処理結果（合計時間が変わっていないissueは含まない）
+        """
+        metrics = start_run_metrics('sync_issues')
+        try:
+            with metrics.phase('toggl_import'):
+                window = self.toggl_report_summary_repository.get_window()
+                for issue_key in issue_keys:
+                    self.db_toggl_report_repository.sync(
+                        self.toggl_report_summary_repository.iter_data(
+                            since=window.since, until=window.until, issue_key=issue_key),
+                        issue_keys=[issue_key], window=window)
+            toggl_summary_data: list = self.db_toggl_report_repository.find_summary_data(
+                dirty_only=True, issue_keys=issue_keys)
+            app.log.info(f'calc toggl data. issues:{len(toggl_summary_data)}/{len(issue_keys)}')
+            return self.sync_summaries(toggl_summary_data)
+        finally:
+            metrics.emit()
+
+    def retry_failed(self, limit: int = None,
+                     get_remaining_time_in_millis: Callable[[], int] = None) -> List[BacklogIssueSyncResult]:
+        """usecase handle for failed issues.
+        同期に失敗したissue（backlog_sync_retry）のうち再同期の時刻を過ぎたものだけを、DBの集計で同期し直す
+        Togglからの取得は行わない
+
+        Args:
+            limit:int
+                1回に再同期するissue数。省略時はSYNC_RETRY_BATCH_SIZE
+            get_remaining_time_in_millis:Callable[[], int]
+                Lambdaの残り実行時間。省略時は時間制限なし
+
+        Return:
+            results:List[BacklogIssueSyncResult]
+                再同期したissue毎の処理結果
+        """
+        metrics = start_run_metrics('retry_failed')
+        try:
+            items = self.db_toggl_report_repository.find_retry_issues(limit)
+            if not items:
+                return []
+            issue_keys = [item.issue_key for item in items]
+            app.log.info(f'[sync retry due]{[(item.issue_key, item.attempts) for item in items]}')
+            # 合計時間の変化に関わらず同期する（失敗したのがreconcileの場合も含む）
+            toggl_summary_data: list = self.db_toggl_report_repository.find_summary_data(
+                dirty_only=False, issue_keys=issue_keys)
+            # togglデータがなくなったissueは再同期しない
+            _targets = {toggl_summary.backlog_issue_key for toggl_summary in toggl_summary_data}
+            self.db_toggl_report_repository.save_sync_failures(
+                {}, [issue_key for issue_key in issue_keys if issue_key not in _targets])
+            return self.sync_summaries(toggl_summary_data, get_remaining_time_in_millis)
+        finally:
+            metrics.emit()
+
+    def sync_summaries(self, toggl_summary_data: List[TogglReportSummary],
+                       get_remaining_time_in_millis: Callable[[], int] = None) \
+            -> List[BacklogIssueSyncResult]:
+        """sync backlog issues and record synced summary.
+        toggl_summary_dataの順（優先順位順）に同期し、Lambdaの残り時間が足りなくなったら
+        残りのissueを次回に回す（backlog_sync_pendingに記録し、次回は先に同期する）
+        同期に失敗したissueは例外を送出せずbacklog_sync_retryに記録する（retry_failedで再同期）
+
+        Args:
+            toggl_summary_data:List[TogglReportSummary]
+                DBから取得したBacklogIssue毎のTogglReportデータ
+            get_remaining_time_in_millis:Callable[[], int]
+                Lambdaの残り実行時間。省略時は時間制限なし
+
+        Return:
+            results:List[BacklogIssueSyncResult]
+                issue毎の処理結果。toggl_summary_dataと同じ順序
+        """
+        metrics = current_metrics()
+        with metrics.phase('backlog_sync'):
+            # issue一覧APIでまとめて取得できるものは先に取得しておく
+            self.backlog_issue_repository.prefetch_issues(toggl_summary_data)
+            results = self._sync_backlog_issues(
+                toggl_summary_data, self._deadline_checker(get_remaining_time_in_millis))
+        # 同期できたissueのみ合計時間を記録（失敗・見つからなかったissueは次回も対象になる）
+        with metrics.phase('ledger_save'):
+            self.db_toggl_report_repository.save_synced_summary([
+                toggl_summary for toggl_summary, result in zip(toggl_summary_data, results)
+                if not result.error and not result.deferred and not result.not_found])
+            self.db_toggl_report_repository.save_pending_issues(
+                [toggl_summary for toggl_summary, result in zip(toggl_summary_data, results) if result.deferred],
+                [result.backlog_issue_key for result in results if not result.deferred])
+            self.db_toggl_report_repository.save_sync_failures(
+                {result.backlog_issue_key: result.error for result in results if result.error},
+                [result.backlog_issue_key for result in results if not result.error and not result.deferred])
+        return results
+
+    def _deadline_checker(self, get_remaining_time_in_millis: Callable[[], int] = None) \
+            -> Callable[[], bool]:
+        """build deadline checker
+        一度残り時間がsafety_margin_msを下回ったら、以降はずっとTrue（後のissueを先に始めない）
+
+        Args:
+            get_remaining_time_in_millis:Callable[[], int]
+                Lambdaの残り実行時間
+
+        Return:
+            expired:Callable[[], bool]
+                新しいissueを開始できなければTrue
+        """
+        _expired = threading.Event()
+        _lock = threading.Lock()
+
+        def expired() -> bool:
+            if _expired.is_set() or not get_remaining_time_in_millis:
+                return _expired.is_set()
+            with _lock:
+                if not _expired.is_set() and get_remaining_time_in_millis() < self.safety_margin_ms:
+                    app.log.info('[backlog sync] stop before lambda timeout')
+                    _expired.set()
+            return _expired.is_set()
+        return expired
+
+    def _sync_backlog_issues(self, toggl_summary_data: List[TogglReportSummary],
+                             expired: Callable[[], bool]) -> List[BacklogIssueSyncResult]:
+        """sync backlog issues.
+        プロジェクトキー毎に分け、複数プロジェクトの場合はプロジェクト単位で並列に同期する
+
+        Args:
+            toggl_summary_data:List[TogglReportSummary]
+                DBから取得したBacklogIssue毎のTogglReportデータ
+            expired:Callable[[], bool]
+                Trueを返したら新しいissueを開始しない
+
+        Return:
+            results:List[BacklogIssueSyncResult]
+                issue毎の処理結果。toggl_summary_dataと同じ順序
+        """
+        _projects = {}
+        for i, toggl_summary in enumerate(toggl_summary_data):
+            _project_key = toggl_summary.backlog_issue_key.rsplit('-', 1)[0]
+            _projects.setdefault(_project_key, []).append(i)
+        if len(_projects) <= 1:
+            return self._sync_project_issues(toggl_summary_data, expired)
+
+        app.log.info(f'[backlog sync projects]{list(_projects)}')
+        results = [None] * len(toggl_summary_data)
+        with ThreadPoolExecutor(max_workers=len(_projects)) as _executor:
+            _futures = {
+                project_key: _executor.submit(
+                    self._sync_project_issues, [toggl_summary_data[i] for i in indexes], expired)
+                for project_key, indexes in _projects.items()}
+            for project_key, future in _futures.items():
+                for i, result in zip(_projects[project_key], future.result()):
+                    results[i] = result
+        return results
+
+    def _sync_project_issues(self, toggl_summary_data: List[TogglReportSummary],
+                             expired: Callable[[], bool]) -> List[BacklogIssueSyncResult]:
+        """sync backlog issues of one project.
+        max_workers > 1 の場合はThreadPoolExecutorで並列処理する
+        issue単位では取得→計算→更新の順序を保つ
+
+        Args:
+            toggl_summary_data:List[TogglReportSummary]
+                DBから取得したBacklogIssue毎のTogglReportデータ
+            expired:Callable[[], bool]
+                Trueを返したら新しいissueを開始しない
+
+        Return:
+            results:List[BacklogIssueSyncResult]
+                issue毎の処理結果。toggl_summary_dataと同じ順序
+        """
+        if self.max_workers == 1:
+            return [self._sync_backlog_issue(toggl_summary, expired) for toggl_summary in toggl_summary_data]
+
+        app.log.info(f'[backlog sync workers]{self.max_workers}')
+        with ThreadPoolExecutor(max_workers=self.max_workers) as _executor:
+            return list(_executor.map(
+                lambda toggl_summary: self._sync_backlog_issue(toggl_summary, expired), toggl_summary_data))
+
+    def _sync_backlog_issue(self, toggl_summary: TogglReportSummary,
+                            expired: Callable[[], bool] = None) -> BacklogIssueSyncResult:
+        """sync one backlog issue.
+        Backlog issueを取得し、toggl登録時間とずれていれば更新する
+
+        Args:
+            toggl_summary:TogglReportSummary
+                DBから取得したBacklogIssueのTogglReportデータ
+            expired:Callable[[], bool]
+                Trueを返した場合は同期せず、deferredにする
+
+        Return:
+            result:BacklogIssueSyncResult
+                処理結果。例外は送出せずerrorに格納する
+        """
+        result = BacklogIssueSyncResult(backlog_issue_key=toggl_summary.backlog_issue_key)
+        if expired and expired():
+            result.deferred = True
+            current_metrics().incr('issues_deferred')
+            return result
+        _started = time.perf_counter()
+        try:
             backlog_issue = self.backlog_issue_repository.get_issue_data(toggl_summary)
             if not backlog_issue.issue_key:
-                continue
-            app.log.info(f'[issue_key]{backlog_issue.issue_key}')
-            app.log.info(f'[sum_dur_hours]{toggl_summary.sum_dur_hours}')
-            app.log.info(f'[actual_hours]{backlog_issue.actual_hours}')
-            app.log.info(f'[manual_actual_hours]{backlog_issue.manual_actual_hours}')
+                result.not_found = True
+                return result
+            log_payload('backlog issue', f'{backlog_issue.issue_key} sum_dur_hours:{toggl_summary.sum_dur_hours} '
+                        f'actual_hours:{backlog_issue.actual_hours} manual_actual_hours:{backlog_issue.manual_actual_hours}')
             if (backlog_issue.actual_hours
                     and not math.isclose(toggl_summary.sum_dur_hours, (backlog_issue.actual_hours - backlog_issue.manual_actual_hours))):
                 app.log.info(f'update backlog data')
-                comment = f'{os.environ["BACKLOG_COMMENT"]}　手動登録時間：{backlog_issue.manual_actual_hours}h　toggl登録時間：{toggl_summary.sum_dur_hours}h'
-                self.backlog_issue_repository.update(toggl_summary, backlog_issue,comment)
+                comment = f'{get_config().backlog_comment}　手動登録時間：{backlog_issue.manual_actual_hours}h　toggl登録時間：{toggl_summary.sum_dur_hours}h'
+                result.updated = self.backlog_issue_repository.update(toggl_summary, backlog_issue, comment)
+        except Exception as e:
+            app.log.error(f'[backlog sync error]{toggl_summary.backlog_issue_key}:{e}')
+            result.error = e
+        finally:
+            _metrics = current_metrics()
+            _metrics.record_issue(toggl_summary.backlog_issue_key, time.perf_counter() - _started)
+            _metrics.incr('issues_updated' if result.updated else 'issues_failed' if result.error
+                          else 'issues_not_found' if result.not_found else 'issues_unchanged')
+        return result
+
+
+class EnqueueIssueEventsUsecase():
+    """toggl change event usecase
+    変更があったBacklog issueを同期待ちにする（issue毎にdebounce）
+    """
+    def __init__(self, db_sync_queue_repository: DbSyncQueueRepository,
+                 db_toggl_report_repository: DbTogglReportRepository = None):
+        """Initialize.
+
+        Args:
+            db_sync_queue_repository : DbSyncQueueRepository
+                同期待ちのissueを保持するrepository
+            db_toggl_report_repository : DbTogglReportRepository
+                変更されたtime entryの登録済みのissue keyを調べるrepository。省略時は調べない
+
+        Return:
+            None
+        """
+        self.db_sync_queue_repository = db_sync_queue_repository
+        self.db_toggl_report_repository = db_toggl_report_repository
+        pass
+
+    def handle(self, issue_keys: List[str], toggl_ids: List[int] = None) -> int:
+        """usecase handle.
+        削除・説明を変更したtime entryは、DBに登録済みの（変更前の）issueも同期待ちにする
+
+        Args:
+            issue_keys:List[str]
+                変更があったBacklog issueのkey
+            toggl_ids:List[int]
+                変更があったtime entryのid
+
+        Return:
+            int
+                同期待ちにしたissue数
+        """
+        issue_keys = list(issue_keys or [])
+        if toggl_ids and self.db_toggl_report_repository:
+            issue_keys.extend(issue_key for issue_key in self.db_toggl_report_repository.find_issue_keys(toggl_ids)
+                              if issue_key not in issue_keys)
+        if not issue_keys:
+            return 0
+        count = self.db_sync_queue_repository.enqueue(issue_keys)
+        app.log.info(f'[sync queue enqueue]{issue_keys}')
+        return count
+
+
+class SyncQueuedIssuesUsecase():
+    """queued issue sync usecase
+    同期時刻を過ぎたissueのみtogglデータを取り込み、Backlogに同期する
+    """
+    def __init__(
+            self,
+            import_from_toggl_usecase: ImportFromTogglUsecase,
+            db_sync_queue_repository: DbSyncQueueRepository):
+        """Initialize.
+
+        Args:
+            import_from_toggl_usecase : ImportFromTogglUsecase
+                issueを指定して同期するusecase
+            db_sync_queue_repository : DbSyncQueueRepository
+                同期待ちのissueを保持するrepository
+
+        Return:
+            None
+        """
+        self.import_from_toggl_usecase = import_from_toggl_usecase
+        self.db_sync_queue_repository = db_sync_queue_repository
+        pass
+
+    def handle(self, limit: int = None) -> int:
+        """usecase handle.
+        同期に失敗したissueは、待ち時間をおいて再度同期する
+
+        Args:
+            limit:int
+                1回に同期するissue数。省略時はSYNC_QUEUE_BATCH_SIZE
+
+        Return:
+            int
+                同期できたissue数
+        """
+        items = self.db_sync_queue_repository.find_due(limit)
+        if not items:
+            return 0
+        app.log.info(f'[sync queue due]{[item.issue_key for item in items]}')
+        try:
+            results = self.import_from_toggl_usecase.handle_issues([item.issue_key for item in items])
+        except Exception:
+            self.db_sync_queue_repository.postpone(items)
+            raise
+
+        failed = {result.backlog_issue_key for result in results if result.error}
+        self.db_sync_queue_repository.complete([item for item in items if item.issue_key not in failed])
+        self.db_sync_queue_repository.postpone([item for item in items if item.issue_key in failed])
+        return len(items) - len(failed)
+
+
+# 集計APIの結果のキャッシュ（warm起動間で共有）
+_aggregate_cache: LruCache = None
+
+
+class GetTogglAggregatesUsecase():
+    """toggl aggregates usecase
+    日次集計をissue・ユーザー・日毎に合計する。同じ条件の結果はAGGREGATE_CACHE_SECONDSの間キャッシュする
+    """
+    def __init__(self, db_toggl_aggregate_repository: DbTogglAggregateRepository):
+        """Initialize.
+
+        Args:
+            db_toggl_aggregate_repository : DbTogglAggregateRepository
+                日次集計を参照するrepository
+
+        Return:
+            None
+        """
+        global _aggregate_cache
+        self.db_toggl_aggregate_repository = db_toggl_aggregate_repository
+        if _aggregate_cache is None:
+            _config = get_config()
+            _aggregate_cache = LruCache(_config.aggregate_cache_size, _config.aggregate_cache_seconds)
+        self.cache = _aggregate_cache
+        pass
+
+    def handle(self, group_by: str, since: datetime.date = None, until: datetime.date = None,
+               issue_key: str = None, user_name: str = None) -> List[TogglAggregate]:
+        """usecase handle.
+
+        Args:
+            group_by:str
+                集計単位（issues、users、days）
+            since:datetime.date
+                集計開始日。省略時はuntilのAGGREGATE_DEFAULT_DAYS日前
+            until:datetime.date
+                集計終了日（含む）。省略時は今日
+            issue_key:str
+                指定した場合はそのBacklog issueのみ集計
+            user_name:str
+                指定した場合はそのユーザーのみ集計
+
+        Return:
+            data:List[TogglAggregate]
+                集計単位毎の合計
+        """
+        until = until or datetime.date.today()
+        since = since or until - datetime.timedelta(days=get_config().aggregate_default_days)
+        issue_key = issue_key.upper() if issue_key else None
+        _key = (group_by, since, until, issue_key, user_name)
+        data = self.cache.get(_key)
+        if data is None:
+            data = self.db_toggl_aggregate_repository.find_aggregates(
+                group_by, since, until, issue_key, user_name)
+            self.cache.put(_key, data)
+        return data
+
+
+class MaintainTogglPartitionsUsecase():
+    """toggl report partition maintenance usecase
+    月次パーティションを先の月まで作成し、保存期間を過ぎたパーティションを切り離す
+    """
+    def __init__(self, db_toggl_partition_repository: DbTogglPartitionRepository):
+        """Initialize.
+
+        Args:
+            db_toggl_partition_repository : DbTogglPartitionRepository
+                toggl_reportのパーティションを管理するrepository
+
+        Return:
+            None
+        """
+        self.db_toggl_partition_repository = db_toggl_partition_repository
+        pass
+
+    def handle(self) -> dict:
+        """usecase handle.
+
+        Return:
+            dict
+                created:作成したパーティション、retired:切り離したパーティション
+        """
+        if not self.db_toggl_partition_repository.is_partitioned():
+            app.log.info('toggl_report is not partitioned. run tools/toggl_partitions.py migrate')
+            return {'created': [], 'retired': []}
+        created = self.db_toggl_partition_repository.ensure_partitions()
+        retired = self.db_toggl_partition_repository.apply_retention()
+        return {'created': created, 'retired': retired}
+
+
+class SyncBacklogShardUsecase():
+    """backlog sync worker usecase
+    coordinatorから受け取ったshardのissueをBacklogに同期し、結果をresult queueに返す
+    """
+    def __init__(
+            self,
+            import_from_toggl_usecase: ImportFromTogglUsecase,
+            result_queue,
+            emit_metrics: bool = True):
+        """Initialize.
+
+        Args:
+            import_from_toggl_usecase : ImportFromTogglUsecase
+                issueを同期するusecase
+            result_queue : LocalWorkQueue or SqsWorkQueue
+                結果を返すキュー
+            emit_metrics : bool
+                Falseの場合、実行メトリクスを分けない（coordinatorと同じプロセスで動かす場合）
+
+        Return:
+            None
+        """
+        self.import_from_toggl_usecase = import_from_toggl_usecase
+        self.result_queue = result_queue
+        self.emit_metrics = emit_metrics
+        pass
+
+    def handle(self, message: dict,
+               get_remaining_time_in_millis: Callable[[], int] = None) -> BacklogSyncShardResult:
+        """usecase handle.
+
+        Args:
+            message:dict
+                BacklogSyncShard（dataclasses.asdict）
+            get_remaining_time_in_millis:Callable[[], int]
+                Lambdaの残り実行時間。足りなくなったら残りのissueは次回に回す
+
+        Return:
+            result:BacklogSyncShardResult
+                shardの同期結果。result queueにも送る
+        """
+        shard = BacklogSyncShard(**dict(message, summaries=[
+            TogglReportSummary(**summary) for summary in message['summaries']]))
+        metrics = start_run_metrics('sync_shard') if self.emit_metrics else current_metrics()
+        try:
+            app.log.info(f'[sync shard]{shard.run_id} {shard.shard + 1}/{shard.shards} issues:{len(shard.summaries)}')
+            results = self.import_from_toggl_usecase.sync_summaries(shard.summaries, get_remaining_time_in_millis)
+        finally:
+            if self.emit_metrics:
+                metrics.emit()
+
+        result = BacklogSyncShardResult(run_id=shard.run_id, shard=shard.shard)
+        for issue_result in results:
+            if issue_result.error:
+                result.failed += 1
+                result.errors[issue_result.backlog_issue_key] = str(issue_result.error)
+            elif issue_result.deferred:
+                result.deferred += 1
+            elif issue_result.updated:
+                result.updated += 1
+            else:
+                result.unchanged += 1
+        self.result_queue.send(dataclasses.asdict(result))
+        return result
+
+
+class CoordinateBacklogSyncUsecase():
+    """backlog sync coordinator usecase
+    togglデータを取り込み、同期するissueをshardに分けてworkerに送り、workerの結果を集計する
+    1回の実行時間は、最も遅いshardの処理時間程度になる
+    """
+    def __init__(
+            self,
+            import_from_toggl_usecase: ImportFromTogglUsecase,
+            work_queue,
+            result_queue,
+            shard_size: int = None,
+            local_worker: SyncBacklogShardUsecase = None,
+            local_workers: int = None):
+        """Initialize.
+
+        Args:
+            import_from_toggl_usecase : ImportFromTogglUsecase
+                togglデータを取り込み、同期するissueを返すusecase
+            work_queue : LocalWorkQueue or SqsWorkQueue
+                shardを送るキュー
+            result_queue : LocalWorkQueue or SqsWorkQueue
+                workerの結果を受け取るキュー
+            shard_size : int
+                1shardのissue数。省略時はSYNC_SHARD_SIZE
+            local_worker : SyncBacklogShardUsecase
+                指定した場合は、同じプロセスのスレッドでworkerを動かす（LocalWorkQueue用）
+            local_workers : int
+                local_workerのスレッド数。省略時はSYNC_LOCAL_WORKERS
+
+        Return:
+            None
+        """
+        self.import_from_toggl_usecase = import_from_toggl_usecase
+        self.work_queue = work_queue
+        self.result_queue = result_queue
+        self.shard_size = max(1, shard_size or get_config().sync_shard_size)
+        self.local_worker = local_worker
+        self.local_workers = max(1, local_workers or get_config().sync_local_workers)
+        pass
+
+    def handle(self, full_reconcile: bool = False,
+               get_remaining_time_in_millis: Callable[[], int] = None) -> dict:
+        """usecase handle.
+
+        Args:
+            full_reconcile:bool
+                Trueの場合、合計時間の変化に関わらずすべてのBacklogIssueを同期する
+            get_remaining_time_in_millis:Callable[[], int]
+                Lambdaの残り実行時間。残りがCOORDINATOR_SAFETY_MARGIN_MSを下回ったら結果を待つのをやめる
+
+        Return:
+            dict
+                shards:shard数、reported:結果を受け取ったshard数、updated/unchanged/failed/deferred:issue数、
+                errors:失敗したissue keyとエラー内容
+        """
+        metrics = start_run_metrics('coordinate_sync')
+        _stop = threading.Event()
+        _threads = []
+        try:
+            toggl_summary_data = self.import_from_toggl_usecase.import_toggl_data(full_reconcile)
+            run_id = uuid.uuid4().hex
+            shards = [toggl_summary_data[i:i + self.shard_size]
+                      for i in range(0, len(toggl_summary_data), self.shard_size)]
+            with metrics.phase('shard_send'):
+                for i, summaries in enumerate(shards):
+                    self.work_queue.send(dataclasses.asdict(BacklogSyncShard(
+                        run_id=run_id, shard=i, shards=len(shards), summaries=summaries)))
+            metrics.incr('shards_sent', len(shards))
+            app.log.info(f'[sync coordinator]{run_id} issues:{len(toggl_summary_data)} shards:{len(shards)}')
+
+            if self.local_worker and shards:
+                for _ in range(min(self.local_workers, len(shards))):
+                    _thread = threading.Thread(target=self._run_local_worker,
+                                               args=(_stop, get_remaining_time_in_millis), daemon=True)
+                    _thread.start()
+                    _threads.append(_thread)
+            with metrics.phase('shard_wait'):
+                results = self._wait_results(run_id, len(shards), get_remaining_time_in_millis)
+        finally:
+            _stop.set()
+            for thread in _threads:
+                thread.join()
+            metrics.emit()
+
+        summary = {
+            'shards': len(shards),
+            'reported': len(results),
+            'updated': sum(result.updated for result in results),
+            'unchanged': sum(result.unchanged for result in results),
+            'failed': sum(result.failed for result in results),
+            'deferred': sum(result.deferred for result in results),
+            'errors': {}
+        }
+        for result in results:
+            summary['errors'].update(result.errors)
+        if summary['reported'] < summary['shards']:
+            # 結果が返らなかったshardも、workerが同期した分はledgerに記録され次回の対象から外れる
+            app.log.warning(f'[sync coordinator]{summary["shards"] - summary["reported"]} shards not reported')
+        return summary
+
+    def _wait_results(self, run_id: str, shards: int,
+                      get_remaining_time_in_millis: Callable[[], int] = None) -> List[BacklogSyncShardResult]:
+        """wait for worker results
+
+        Return:
+            results:List[BacklogSyncShardResult]
+                受け取ったshardの結果。shard順
+        """
+        _results = {}
+        _deadline = time.monotonic() + get_config().sync_result_timeout_seconds
+        while len(_results) < shards:
+            _remaining = _deadline - time.monotonic()
+            if get_remaining_time_in_millis:
+                _remaining = min(_remaining, (get_remaining_time_in_millis() - COORDINATOR_SAFETY_MARGIN_MS) / 1000)
+            if _remaining <= 0:
+                break
+            for receipt, message in self.result_queue.receive(10, min(20, _remaining)):
+                if message.get('run_id') == run_id:
+                    _results[message['shard']] = BacklogSyncShardResult(**message)
+                else:
+                    # 以前の実行（タイムアウトした等）の結果は捨てる
+                    app.log.info(f'[sync coordinator]discard result of {message.get("run_id")}')
+                self.result_queue.delete(receipt)
+        return [_results[shard] for shard in sorted(_results)]
+
+    def _run_local_worker(self, stop: threading.Event,
+                          get_remaining_time_in_millis: Callable[[], int] = None) -> None:
+        """process shards in this process until stopped
+        coordinatorと同じLambdaの残り時間で、足りなくなったshardのissueは次回に回す
+        """
+        while not stop.is_set():
+            for receipt, message in self.work_queue.receive(1, 0.2):
+                try:
+                    self.local_worker.handle(message, get_remaining_time_in_millis)
+                except Exception as e:
+                    app.log.error(f'[sync worker error]{e}')
+                finally:
+                    self.work_queue.delete(receipt)
 
-        return True
 
+class CheckTogglSummaryUsecase():
+    """toggl summary consistency check usecase
+    """
+    def __init__(self, db_toggl_report_repository: DbTogglReportRepository):
+        """Initialize.
+
+        Args:
+            db_toggl_report_repository : DbTogglReportRepository
+                集計テーブルとtoggl_reportを比較するrepository
+
+        Return:
+            None
+        """
+        self.db_toggl_report_repository = db_toggl_report_repository
+        pass
+
+    def handle(self, repair: bool = False) -> int:
+        """usecase handle.
+
+        Args:
+            repair:bool
+                Trueの場合、不一致があれば集計テーブルを作り直す
+
+        Return:
+            int
+                不一致だったBacklogIssueの件数
+        """
+        diffs = self.db_toggl_report_repository.check_summary_data(repair)
+        for diff in diffs:
+            app.log.warning(f'[summary diff]{diff}')
+        app.log.info(f'[summary diff count]{len(diffs)} repair:{repair}')
+        return len(diffs)
+
+
+class BackfillFromTogglUsecase():
+    """toggl historical data backfill usecase
+    長い期間をshard（日・週単位）に分割し、並列に取り込む
+    進捗はDBに記録し、タイムアウトしても次回は未完了のshardから再開する
+    """
+    def __init__(
+            self,
+            toggl_report_summary_repository: TogglReportSummaryRepository,
+            db_toggl_report_repository: DbTogglReportRepository,
+            max_workers: int = None,
+            safety_margin_ms: int = None):
+        """Initialize.
+
+        Args:
+            toggl_report_summary_repository : TogglReportSummaryRepository
+                APIで取得したToggl report data格納
+            db_toggl_report_repository : DbTogglReportRepository
+                Toggl dataとshardの進捗を登録
+            max_workers : int
+                並列に処理するshard数。省略時はBACKFILL_MAX_WORKERS
+            safety_margin_ms : int
+                Lambdaの残り時間がこれを下回ったら新しいshardを開始しない。省略時はBACKFILL_SAFETY_MARGIN_MS
+
+        Return:
+            None
+        """
+        self.toggl_report_summary_repository = toggl_report_summary_repository
+        self.db_toggl_report_repository = db_toggl_report_repository
+        self.max_workers = max(1, max_workers or get_config().backfill_max_workers)
+        self.safety_margin_ms = (get_config().backfill_safety_margin_ms
+                                 if safety_margin_ms is None else safety_margin_ms)
+        pass
+
+    def handle(self, since: datetime.date, until: datetime.date, shard_days: int = 7,
+               get_remaining_time_in_millis: Callable[[], int] = None) -> bool:
+        """usecase handle.
+
+        Args:
+            since:datetime.date
+                backfill開始日
+            until:datetime.date
+                backfill終了日（含む）
+            shard_days:int
+                1shardの日数（1:日単位、7:週単位）
+            get_remaining_time_in_millis:Callable[[], int]
+                Lambdaの残り実行時間（context.get_remaining_time_in_millis）。省略時は時間制限なし
+
+        Return:
+            boolean
+                すべてのshardが完了していればTrue
+        """
+        self.db_toggl_report_repository.plan_backfill_shards(
+            self._split_shards(since, until, shard_days))
+        shards = self.db_toggl_report_repository.find_pending_backfill_shards(since, until)
+        app.log.info(f'[backfill pending shards]{len(shards)}')
+
+        _pending = list(shards)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as _executor:
+            _futures = []
+            while _pending:
+                if (get_remaining_time_in_millis
+                        and get_remaining_time_in_millis() < self.safety_margin_ms):
+                    app.log.info('[backfill] stop before lambda timeout')
+                    break
+                # 実行中のshardがmax_workers件に達したら、1件終わるのを待ってから次を開始
+                _running = [future for future in _futures if not future.done()]
+                if len(_running) >= self.max_workers:
+                    _running[0].result()
+                    continue
+                _futures.append(_executor.submit(self._backfill_shard, _pending.pop(0)))
+            for future in _futures:
+                future.result()
+
+        app.log.info(f'[backfill remaining shards]{len(_pending)}')
+        return not _pending
+
+    def _backfill_shard(self, shard: TogglBackfillShard) -> TogglBackfillShard:
+        """backfill one shard.
+        Toggl APIの取得はshard毎に並列、DB登録はrepository側で直列化される
+        shardのデータはDB_INSERT_BATCH_SIZE件ずつ登録し、全件をメモリに持たない
+        （取得中はDBのlockを持たないよう、取得と登録を交互に行う）
+
+        Args:
+            shard:TogglBackfillShard
+                取り込むshard
+
+        Return:
+            shard:TogglBackfillShard
+                取り込み後のshard（status、entry_count更新済み）
+        """
+        _batch_size = get_config().db_insert_batch_size
+        # 途中で中断したshardは最初から登録し直す（upsertなので重複しない）
+        shard.entry_count = 0
+        _chunk = []
+        for detail in self.toggl_report_summary_repository.iter_data(since=shard.since, until=shard.until):
+            _chunk.append(detail)
+            if len(_chunk) >= _batch_size:
+                self.db_toggl_report_repository.save_backfill_shard(_chunk, shard, done=False)
+                _chunk = []
+        self.db_toggl_report_repository.save_backfill_shard(_chunk, shard)
+        app.log.info(f'[backfill shard done]{shard}')
+        return shard
+
+    def _split_shards(self, since: datetime.date, until: datetime.date, shard_days: int) \
+            -> List[TogglBackfillShard]:
+        """split date range into shards
+
+        Args:
+            since:datetime.date
+                開始日
+            until:datetime.date
+                終了日（含む）
+            shard_days:int
+                1shardの日数
+
+        Return:
+            shards:List[TogglBackfillShard]
+                since〜untilをshard_days日ずつ分割したshard
+        """
+        shards = []
+        _since = since
+        while _since <= until:
+            _until = min(_since + datetime.timedelta(days=max(1, shard_days) - 1), until)
+            shards.append(TogglBackfillShard(since=_since, until=_until))
+            _since = _until + datetime.timedelta(days=1)
+        return shards
@@ -0,0 +1,101 @@
+"""
+Webhook modules.
+
+define signature verification and parsing of toggl change events.
+"""
+from chalicelib.config import get_config
+from chalicelib.repositories import issue_key_pattern
+from typing import List
+import hashlib
+import hmac
+
+# Toggl Webhooksの署名ヘッダー（sha256=<HMAC-SHA256の16進>）
+SIGNATURE_HEADER = 'x-webhook-signature-256'
+
+
+def verify_signature(body: bytes, signature: str, secret: str) -> bool:
+    """verify webhook signature
+    リクエストbodyをsecretでHMAC-SHA256した値と署名ヘッダーを比較する
+
+    Args:
+        body:bytes
+            リクエストbody（そのままのバイト列）
+        signature:str
+            署名ヘッダーの値
+        secret:str
+            TOGGL_WEBHOOK_SECRET
+
+    Return:
+        bool
+            署名が一致すればTrue
+    """
+    if not signature or not secret:
+        return False
+    _expected = 'sha256=' + hmac.new(secret.encode('utf-8'), body or b'', hashlib.sha256).hexdigest()
+    return hmac.compare_digest(_expected, signature.strip())
+
+
+def extract_issue_keys(event: dict) -> List[str]:
+    """extract issue keys from event
+    Toggl Webhooksのイベント（payloadのtime entryのdescription、変更前のdescriptionがあればそれも）、
+    またはローカルのpollerからのイベント（{"issue_keys": [...]}）から、BACKLOG_PRJ_KEYSのissue keyを取り出す
+    DBに登録済みのissue key（削除・説明を変更する前のもの）はextract_toggl_idsのidで調べる
+
+    Args:
+        event:dict
+            受信したイベント
+
+    Return:
+        issue_keys:List[str]
+            issue key（大文字、重複なし）
+    """
+    _pattern = issue_key_pattern(get_config().backlog_prj_keys)
+    _texts = []
+    if isinstance(event.get('issue_keys'), list):
+        _texts.extend(str(issue_key) for issue_key in event['issue_keys'])
+    _payload = event.get('payload')
+    if isinstance(_payload, dict):
+        _texts.append(_payload.get('description') or '')
+        # 説明を変更した場合は、変更前のissueも合計時間が変わる
+        for previous in (event.get('previous'), _payload.get('previous')):
+            if isinstance(previous, dict):
+                _texts.append(previous.get('description') or '')
+    _issue_keys = []
+    for text in _texts:
+        _match = _pattern.search(text)
+        if _match and _match.group(0).upper() not in _issue_keys:
+            _issue_keys.append(_match.group(0).upper())
+    return _issue_keys
+
+
+def extract_toggl_ids(event: dict) -> List[int]:
+    """extract time entry ids from event
+    Toggl Webhooksのイベント（payloadのid、metadataのtime_entry_id）から、time entryのidを取り出す
+    削除イベント等、payloadにdescriptionがない場合もDBに登録済みのissue keyを調べられるようにする
+
+    Args:
+        event:dict
+            受信したイベント
+
+    Return:
+        toggl_ids:List[int]
+            time entry id（重複なし）
+    """
+    _payload = event.get('payload')
+    _metadata = event.get('metadata')
+    _values = []
+    if isinstance(_metadata, dict):
+        if _metadata.get('model') not in (None, 'time_entry'):
+            return []
+        _values.append(_metadata.get('time_entry_id'))
+    if isinstance(_payload, dict):
+        _values.append(_payload.get('id'))
+    _toggl_ids = []
+    for value in _values:
+        try:
+            _toggl_id = int(value)
+        except (TypeError, ValueError):
+            continue
+        if _toggl_id not in _toggl_ids:
+            _toggl_ids.append(_toggl_id)
+    return _toggl_ids
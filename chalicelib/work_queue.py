@@ -0,0 +1,133 @@
+"""
+Work queue modules.
+
+define queues to distribute backlog sync shards to worker invocations.
+"""
+from chalicelib.config import get_config
+from typing import List
+import itertools
+import json
+import queue
+import threading
+import time
+
+
+class LocalWorkQueue():
+    """In-process work queue
+    SQSと同じ操作（send/receive/delete）をプロセス内で行う。ローカル実行・検証用
+    """
+
+    def __init__(self, name: str):
+        """Initialize.
+
+        Args:
+            name:str
+                キュー名（ログ用）
+        """
+        self.name = name
+        self._queue = queue.Queue()
+        self._receipts = itertools.count(1)
+
+    def send(self, message: dict) -> None:
+        """send message"""
+        # SQSと同じくJSONで受け渡す（参照を共有しない）
+        self._queue.put(json.dumps(message, ensure_ascii=False))
+
+    def receive(self, max_messages: int = 1, wait_seconds: float = 0) -> List[tuple]:
+        """receive messages
+
+        Args:
+            max_messages:int
+                受信する最大件数
+            wait_seconds:float
+                メッセージがない場合に待つ秒数
+
+        Return:
+            messages:List[tuple]
+                (receipt, message)
+        """
+        _messages = []
+        _deadline = time.monotonic() + wait_seconds
+        while len(_messages) < max_messages:
+            try:
+                _timeout = max(0.0, _deadline - time.monotonic())
+                _body = self._queue.get(timeout=_timeout) if not _messages and _timeout else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            _messages.append((next(self._receipts), json.loads(_body)))
+        return _messages
+
+    def delete(self, receipt) -> None:
+        """delete received message (受信時に取り出し済みのため何もしない)"""
+        pass
+
+
+class SqsWorkQueue():
+    """SQS work queue
+    SQS（またはSQS互換のエンドポイント）のキューにメッセージを送受信する
+    """
+
+    def __init__(self, queue_url: str, endpoint_url: str = None):
+        """Initialize.
+
+        Args:
+            queue_url:str
+                キューのURL
+            endpoint_url:str
+                SQS互換のエンドポイント（ElasticMQ等）。省略時はAWSのSQS
+        """
+        # boto3はimportが重いため、キュー作成時に読み込む（Lambdaの実行環境には含まれる）
+        import boto3
+        self.name = queue_url.rstrip('/').rsplit('/', 1)[-1]
+        self.queue_url = queue_url
+        self._client = boto3.client('sqs', endpoint_url=endpoint_url or None)
+
+    def send(self, message: dict) -> None:
+        """send message"""
+        self._client.send_message(QueueUrl=self.queue_url,
+                                  MessageBody=json.dumps(message, ensure_ascii=False))
+
+    def receive(self, max_messages: int = 1, wait_seconds: float = 0) -> List[tuple]:
+        """receive messages (long polling。SQSの上限は10件・20秒)
+
+        Return:
+            messages:List[tuple]
+                (receipt handle, message)
+        """
+        _res = self._client.receive_message(QueueUrl=self.queue_url,
+                                            MaxNumberOfMessages=min(10, max(1, max_messages)),
+                                            WaitTimeSeconds=min(20, int(wait_seconds)))
+        return [(message['ReceiptHandle'], json.loads(message['Body']))
+                for message in _res.get('Messages', [])]
+
+    def delete(self, receipt) -> None:
+        """delete received message"""
+        self._client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+
+
+# キュー名毎の共有キュー（LocalWorkQueueはプロセス内で共有しないと受け渡しできない）
+_work_queues = {}
+_work_queues_lock = threading.Lock()
+
+
+def get_work_queue(name: str):
+    """get shared work queue
+    SYNC_{NAME}_QUEUE_URLが設定されていればSqsWorkQueue、なければLocalWorkQueueを返す
+
+    Args:
+        name:str
+            キュー名（work、result）
+
+    Return:
+        work_queue:LocalWorkQueue or SqsWorkQueue
+    """
+    with _work_queues_lock:
+        if name not in _work_queues:
+            _config = get_config()
+            _queue_url = {'work': _config.sync_work_queue_url,
+                          'result': _config.sync_result_queue_url}.get(name)
+            if _queue_url:
+                _work_queues[name] = SqsWorkQueue(_queue_url, _config.sqs_endpoint_url)
+            else:
+                _work_queues[name] = LocalWorkQueue(name)
+        return _work_queues[name]
@@ -16,8 +16,15 @@ CREATE TABLE public.toggl_report (
 	dur int4 NOT NULL,
 	backlog_issue_key varchar(255) NULL,
 	created_at timestamptz NOT NULL DEFAULT now(),
-	CONSTRAINT toggl_report_toggl_id_key UNIQUE (toggl_id)
-);
+	-- パーティションキーを含める必要があるため(toggl_id, start_time)。開始時刻が変わったデータは削除→登録する
+	CONSTRAINT toggl_report_toggl_id_key UNIQUE (toggl_id, start_time)
+) PARTITION BY RANGE (start_time);
+
+-- Partitions
+-- 月次パーティション（toggl_report_pYYYYMM）はmaintain_partitions関数、またはtools/toggl_partitions.pyで作成
+-- 既存の（パーティション化前の）toggl_reportは tools/toggl_partitions.py migrate で移行する
+
+CREATE TABLE public.toggl_report_default PARTITION OF public.toggl_report DEFAULT;
 
 -- Permissions
 
@@ -26,7 +33,195 @@ GRANT ALL ON TABLE public.toggl_report TO postgres;
 
 -- Index
 
-CREATE INDEX toggl_report_backlog_issue_key_idx ON public.toggl_report USING btree (backlog_issue_key);
+-- issue毎の集計をindex only scanで行うためのcovering index
+CREATE INDEX toggl_report_issue_dur_idx ON public.toggl_report USING btree (backlog_issue_key) INCLUDE (dur);
 CREATE INDEX toggl_report_start_time_idx ON public.toggl_report USING btree (start_time);
-CREATE UNIQUE INDEX toggl_report_toggl_id_idx ON public.toggl_report USING btree (toggl_id);
+CREATE INDEX toggl_report_toggl_id_idx ON public.toggl_report USING btree (toggl_id);
+
+
+-- Backlog comment cursor
+
+CREATE TABLE public.backlog_comment_cursor (
+	issue_key varchar(255) NOT NULL,
+	last_comment_id int8 NOT NULL DEFAULT 0,
+	manual_actual_hours numeric NOT NULL DEFAULT 0,
+	updated_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT backlog_comment_cursor_pkey PRIMARY KEY (issue_key)
+);
+
+ALTER TABLE public.backlog_comment_cursor OWNER TO postgres;
+GRANT ALL ON TABLE public.backlog_comment_cursor TO postgres;
+
+-- Toggl issue summary (toggl_reportのbacklog_issue_key毎の集計。triggerで更新)
+
+CREATE TABLE public.toggl_issue_summary (
+	backlog_issue_key varchar(255) NOT NULL,
+	sum_dur int8 NOT NULL DEFAULT 0,
+	entry_count int8 NOT NULL DEFAULT 0,
+	updated_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT toggl_issue_summary_pkey PRIMARY KEY (backlog_issue_key)
+);
+
+ALTER TABLE public.toggl_issue_summary OWNER TO postgres;
+GRANT ALL ON TABLE public.toggl_issue_summary TO postgres;
+
+CREATE OR REPLACE FUNCTION public.toggl_issue_summary_apply() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		UPDATE public.toggl_issue_summary s SET
+			sum_dur = s.sum_dur - o.sum_dur,
+			entry_count = s.entry_count - o.entry_count,
+			updated_at = now()
+		FROM (
+			SELECT backlog_issue_key, sum(dur) AS sum_dur, count(*) AS entry_count
+			FROM old_rows WHERE backlog_issue_key IS NOT NULL
+			GROUP BY backlog_issue_key
+		) o
+		WHERE s.backlog_issue_key = o.backlog_issue_key;
+	END IF;
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		INSERT INTO public.toggl_issue_summary (backlog_issue_key, sum_dur, entry_count)
+		SELECT backlog_issue_key, sum(dur), count(*)
+		FROM new_rows WHERE backlog_issue_key IS NOT NULL
+		GROUP BY backlog_issue_key
+		ON CONFLICT (backlog_issue_key) DO UPDATE SET
+			sum_dur = toggl_issue_summary.sum_dur + EXCLUDED.sum_dur,
+			entry_count = toggl_issue_summary.entry_count + EXCLUDED.entry_count,
+			updated_at = now();
+	END IF;
+	DELETE FROM public.toggl_issue_summary WHERE entry_count = 0;
+	RETURN NULL;
+END;
+$$;
+
+-- 遷移テーブルを使うため、statement単位でイベント毎にtriggerを作成
+CREATE TRIGGER toggl_report_summary_insert AFTER INSERT ON public.toggl_report
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION public.toggl_issue_summary_apply();
+CREATE TRIGGER toggl_report_summary_update AFTER UPDATE ON public.toggl_report
+	REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION public.toggl_issue_summary_apply();
+CREATE TRIGGER toggl_report_summary_delete AFTER DELETE ON public.toggl_report
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION public.toggl_issue_summary_apply();
+
+-- 既存データからの初期作成
+INSERT INTO public.toggl_issue_summary (backlog_issue_key, sum_dur, entry_count)
+SELECT backlog_issue_key, sum(dur), count(*) FROM public.toggl_report
+WHERE backlog_issue_key IS NOT NULL GROUP BY backlog_issue_key
+ON CONFLICT (backlog_issue_key) DO NOTHING;
+
+-- Backlog sync ledger (Backlogと同期したissue毎の合計時間)
+
+CREATE TABLE public.backlog_sync_ledger (
+	backlog_issue_key varchar(255) NOT NULL,
+	synced_sum_dur int8 NOT NULL,
+	synced_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT backlog_sync_ledger_pkey PRIMARY KEY (backlog_issue_key)
+);
+
+ALTER TABLE public.backlog_sync_ledger OWNER TO postgres;
+GRANT ALL ON TABLE public.backlog_sync_ledger TO postgres;
+
+-- Backlog sync pending (Lambdaの残り時間が足りず次回に回したissue。次回は先に同期する)
+
+CREATE TABLE public.backlog_sync_pending (
+	backlog_issue_key varchar(255) NOT NULL,
+	drift int8 NOT NULL DEFAULT 0,
+	deferred_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT backlog_sync_pending_pkey PRIMARY KEY (backlog_issue_key)
+);
+
+ALTER TABLE public.backlog_sync_pending OWNER TO postgres;
+GRANT ALL ON TABLE public.backlog_sync_pending TO postgres;
+
+-- Backlog sync retry (同期に失敗したissue。retry_failedで待ち時間をおいて再同期する)
+
+CREATE TABLE public.backlog_sync_retry (
+	backlog_issue_key varchar(255) NOT NULL,
+	attempts int4 NOT NULL DEFAULT 1,
+	next_retry_at timestamptz NOT NULL,
+	last_error text NULL,
+	failed_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT backlog_sync_retry_pkey PRIMARY KEY (backlog_issue_key)
+);
+
+CREATE INDEX backlog_sync_retry_next_retry_at_idx ON public.backlog_sync_retry USING btree (next_retry_at);
+
+ALTER TABLE public.backlog_sync_retry OWNER TO postgres;
+GRANT ALL ON TABLE public.backlog_sync_retry TO postgres;
+
+-- Toggl backfill shard (過去データ取り込みの進捗)
+
+CREATE TABLE public.toggl_backfill_shard (
+	since date NOT NULL,
+	until date NOT NULL,
+	status varchar(20) NOT NULL DEFAULT 'pending',
+	entry_count int4 NOT NULL DEFAULT 0,
+	updated_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT toggl_backfill_shard_pkey PRIMARY KEY (since, until)
+);
+
+ALTER TABLE public.toggl_backfill_shard OWNER TO postgres;
+GRANT ALL ON TABLE public.toggl_backfill_shard TO postgres;
+
+-- Backlog issue id map (issue keyとissue idの対応。issue一覧APIでまとめて取得するため)
+
+CREATE TABLE public.backlog_issue_id_map (
+	issue_key varchar(255) NOT NULL,
+	issue_id int8 NOT NULL,
+	updated_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT backlog_issue_id_map_pkey PRIMARY KEY (issue_key)
+);
+
+ALTER TABLE public.backlog_issue_id_map OWNER TO postgres;
+GRANT ALL ON TABLE public.backlog_issue_id_map TO postgres;
+
+-- Backlog sync queue (Togglの変更イベントで同期待ちになったissue。issue毎にdebounceする)
+
+CREATE TABLE public.backlog_sync_queue (
+	issue_key varchar(255) NOT NULL,
+	due_at timestamptz NOT NULL,
+	max_due_at timestamptz NOT NULL,
+	event_count int4 NOT NULL DEFAULT 1,
+	queued_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT backlog_sync_queue_pkey PRIMARY KEY (issue_key)
+);
+
+CREATE INDEX backlog_sync_queue_due_at_idx ON public.backlog_sync_queue USING btree (due_at);
+
+ALTER TABLE public.backlog_sync_queue OWNER TO postgres;
+GRANT ALL ON TABLE public.backlog_sync_queue TO postgres;
+
+-- Toggl daily rollup (日・issue・ユーザー毎の集計。取り込み時に再計算し、集計APIで参照する)
+
+CREATE TABLE public.toggl_daily_rollup (
+	day date NOT NULL,
+	backlog_issue_key varchar(255) NOT NULL,
+	uid int4 NOT NULL,
+	user_name varchar(1000) NULL,
+	sum_dur int8 NOT NULL,
+	entry_count int8 NOT NULL,
+	CONSTRAINT toggl_daily_rollup_pkey PRIMARY KEY (day, backlog_issue_key, uid)
+);
+
+CREATE INDEX toggl_daily_rollup_backlog_issue_key_idx ON public.toggl_daily_rollup USING btree (backlog_issue_key, day);
+CREATE INDEX toggl_daily_rollup_user_name_idx ON public.toggl_daily_rollup USING btree (user_name, day);
+
+ALTER TABLE public.toggl_daily_rollup OWNER TO postgres;
+GRANT ALL ON TABLE public.toggl_daily_rollup TO postgres;
+
+-- Toggl report retired (保存期間を過ぎて切り離したパーティションの月・issue毎の集計)
+
+CREATE TABLE public.toggl_report_retired (
+	month date NOT NULL,
+	backlog_issue_key varchar(255) NOT NULL,
+	sum_dur int8 NOT NULL,
+	entry_count int8 NOT NULL,
+	retired_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT toggl_report_retired_pkey PRIMARY KEY (month, backlog_issue_key)
+);
 
+ALTER TABLE public.toggl_report_retired OWNER TO postgres;
+GRANT ALL ON TABLE public.toggl_report_retired TO postgres;
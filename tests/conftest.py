@@ -0,0 +1,57 @@
+"""
+Test fixtures.
+
+chalicelibのimport前に必須の環境変数（値は使わない）を設定する。
+DBを使うテストはTEST_DB_*が設定されている場合のみ実行する（テストでテーブルを全削除するので専用のDBを使う）。
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# get_configは最初の呼び出しで読み込むため、chalicelibのimport前に設定する
+for _name, _value in {
+        'TOGGL_API_TOKEN': 'dummy',
+        'TOGGL_BASE_URL': 'http://toggl.test',
+        'TOGGL_PAST_DAYS': '6',
+        'BACKLOG_PRJ_KEY': 'TEST',
+        'BACKLOG_BASE_URL': 'http://backlog.test',
+        'BACKLOG_APIKEY': 'dummy',
+        'BACKLOG_COMMENT': '[togglより連携]',
+        'BACKLOG_COMMENT_COUNT': '100',
+        'TOGGL_IDENTITY_CACHE_PATH': os.path.join(tempfile.mkdtemp(), 'toggl_identity.json'),
+        'TOGGL_RATE_LIMIT': '1000',
+        'TOGGL_RATE_BURST': '100',
+        'BACKLOG_RATE_LIMIT': '1000',
+        'BACKLOG_RATE_BURST': '100',
+        }.items():
+    os.environ.setdefault(_name, _value)
+for _name in ('HOST', 'PORT', 'NAME', 'USER', 'PASSWORD'):
+    os.environ[f'DB_{_name}'] = os.environ.get(f'TEST_DB_{_name}', '')
+os.environ['DB_PORT'] = os.environ['DB_PORT'] or '5432'
+
+# テストで使う（毎回全削除する）テーブル
+DB_TABLES = ('toggl_report', 'toggl_issue_summary', 'toggl_daily_rollup',
+             'backlog_sync_ledger', 'backlog_sync_pending', 'backlog_sync_retry', 'backlog_sync_queue')
+
+
+@pytest.fixture
+def db():
+    """DB（toggl_reportのコネクション）。TEST_DB_NAMEがなければskip"""
+    if not os.environ.get('TEST_DB_NAME'):
+        pytest.skip('TEST_DB_NAME is not set')
+    from chalicelib.repositories import get_db_connection
+    _conn = get_db_connection('toggl_report').get()
+    with _conn.cursor() as _cur:
+        _cur.execute("SELECT to_regclass('public.backlog_sync_retry')")
+        if _cur.fetchone()[0] is None:
+            with open(os.path.join(ROOT, 'ddl.sql'), encoding='utf-8') as _file:
+                _cur.execute(_file.read())
+        _cur.execute(f'TRUNCATE {",".join(DB_TABLES)}')
+    _conn.commit()
+    yield _conn
+    _conn.rollback()
@@ -0,0 +1,45 @@
+"""
+Test fakes.
+
+APIを呼ばずにrepositoryを動かすためのHttpClient相当。
+"""
+import json
+
+
+class FakeResponse():
+    """requests.Response相当"""
+
+    def __init__(self, status_code: int, data=None, headers: dict = None):
+        self.status_code = status_code
+        self.text = json.dumps(data) if data is not None else ''
+        self.content = self.text.encode()
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeHttpClient():
+    """HttpClient相当。urlに含まれる文字列毎に返すレスポンスを指定する
+    レスポンスのlistを指定した場合は、リクエスト毎に先頭から順に返す
+    """
+
+    def __init__(self, responses: dict):
+        self.responses = responses
+        self.requests = []
+
+    def _response(self, method: str, url: str, kwargs: dict) -> FakeResponse:
+        self.requests.append((method, url, kwargs))
+        for pattern, response in self.responses.items():
+            if pattern in url:
+                return response.pop(0) if isinstance(response, list) else response
+        return FakeResponse(404)
+
+    def get(self, url, **kwargs):
+        return self._response('GET', url, kwargs)
+
+    def post(self, url, **kwargs):
+        return self._response('POST', url, kwargs)
+
+    def patch(self, url, **kwargs):
+        return self._response('PATCH', url, kwargs)
@@ -0,0 +1,43 @@
+"""
+Backlog comment tests.
+
+ページの境界のコメントを二重に数えないこと（minIdが含む・含まないどちらの場合も）。
+"""
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import pytest
+from fakes import FakeResponse
+
+from chalicelib.config import get_config
+from chalicelib.repositories import BacklogIssueRepository
+
+
+class FakeCommentClient():
+    """コメント一覧API相当。minId以上（inclusive=False なら minIdより大きい）のコメントをcount件ずつ返す"""
+
+    def __init__(self, comment_ids: list, inclusive: bool):
+        self.comment_ids = comment_ids
+        self.inclusive = inclusive
+        self.min_ids = []
+
+    def get(self, url, **kwargs):
+        _query = parse_qs(urlparse(url).query)
+        _min_id = int(_query['minId'][0]) if 'minId' in _query else 0
+        self.min_ids.append(_min_id)
+        _ids = [comment_id for comment_id in self.comment_ids
+                if comment_id > _min_id or (self.inclusive and comment_id == _min_id)]
+        return FakeResponse(200, [{'id': comment_id} for comment_id in _ids[:int(_query['count'][0])]])
+
+
+@pytest.mark.parametrize('inclusive', [True, False])
+@pytest.mark.parametrize('min_id', [0, 120])
+def test_iter_comments_data_pages_without_duplicates(inclusive, min_id):
+    _count = get_config().backlog_comment_count
+    _comment_ids = list(range(1, _count * 2 + 51))
+    _client = FakeCommentClient(_comment_ids, inclusive)
+    _repository = BacklogIssueRepository(http_client=_client)
+
+    ids = [comment['id'] for comment in _repository._iter_comments_data('TEST-1', min_id)]
+
+    assert ids == [comment_id for comment_id in _comment_ids if comment_id > min_id]
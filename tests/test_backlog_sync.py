@@ -0,0 +1,93 @@
+"""
+Backlog sync tests.
+
+issueの取得に失敗したときに同期済み（backlog_sync_ledger）にしないこと。
+"""
+import pytest
+from fakes import FakeHttpClient
+from fakes import FakeResponse
+
+from chalicelib.error import BacklogAPIError
+from chalicelib.models import TogglReportSummary
+from chalicelib.repositories import BacklogIssueRepository
+from chalicelib.repositories import DbTogglReportRepository
+from chalicelib.usecases import ImportFromTogglUsecase
+
+
+class RecordingDbTogglReportRepository(DbTogglReportRepository):
+    """DBの代わりに登録内容を記録する"""
+
+    def __init__(self):
+        super().__init__()
+        self.synced = []
+        self.failures = {}
+        self.succeeded_keys = []
+
+    def save_synced_summary(self, toggl_summary_data):
+        self.synced.extend(toggl_summary_data)
+        return True
+
+    def save_pending_issues(self, deferred_data, processed_keys):
+        return True
+
+    def save_sync_failures(self, failures, succeeded_keys, base_seconds=None, max_seconds=None):
+        self.failures.update(failures)
+        self.succeeded_keys.extend(succeeded_keys)
+        return True
+
+
+def _summary(issue_key: str = 'TEST-1', sum_dur: int = 3600000) -> TogglReportSummary:
+    return TogglReportSummary(backlog_issue_key=issue_key, sum_dur=sum_dur,
+                              sum_dur_hours=round(sum_dur/(60*60*1000), 2), drift=sum_dur)
+
+
+def _usecase(db_toggl_report_repository, status_code: int) -> ImportFromTogglUsecase:
+    _http_client = FakeHttpClient({'/api/v2/issues/': FakeResponse(status_code)})
+    return ImportFromTogglUsecase(
+        None, db_toggl_report_repository,
+        BacklogIssueRepository(http_client=_http_client), max_workers=1)
+
+
+@pytest.mark.parametrize('status_code', [429, 500, 503])
+def test_get_issue_raises_on_server_error(status_code):
+    _repository = BacklogIssueRepository(
+        http_client=FakeHttpClient({'/api/v2/issues/': FakeResponse(status_code)}))
+    with pytest.raises(BacklogAPIError):
+        _repository.get_issue_data(_summary())
+
+
+def test_get_issue_returns_empty_on_not_found():
+    _repository = BacklogIssueRepository(
+        http_client=FakeHttpClient({'/api/v2/issues/': FakeResponse(404)}))
+    assert not _repository.get_issue_data(_summary()).issue_key
+
+
+def test_sync_failed_issue_is_not_saved_to_ledger():
+    _db_repository = RecordingDbTogglReportRepository()
+    results = _usecase(_db_repository, 503).sync_summaries([_summary()])
+
+    assert isinstance(results[0].error, BacklogAPIError)
+    assert _db_repository.synced == []
+    assert list(_db_repository.failures) == ['TEST-1']
+    assert _db_repository.succeeded_keys == []
+
+
+def test_sync_not_found_issue_is_not_saved_to_ledger():
+    _db_repository = RecordingDbTogglReportRepository()
+    results = _usecase(_db_repository, 404).sync_summaries([_summary()])
+
+    assert results[0].not_found and not results[0].error
+    assert _db_repository.synced == []
+    assert _db_repository.failures == {}
+
+
+def test_sync_failed_issue_is_not_saved_to_ledger_db(db):
+    results = _usecase(DbTogglReportRepository(), 503).sync_summaries([_summary()])
+
+    assert isinstance(results[0].error, BacklogAPIError)
+    with db.cursor() as _cur:
+        _cur.execute('SELECT count(*) FROM backlog_sync_ledger')
+        assert _cur.fetchone()[0] == 0
+        _cur.execute('SELECT backlog_issue_key FROM backlog_sync_retry')
+        assert [row[0] for row in _cur.fetchall()] == ['TEST-1']
+    db.rollback()
@@ -0,0 +1,62 @@
+"""
+Http client tests.
+
+5xxのリトライ対象（Toggl Reports API v3の検索のPOSTはリトライし、PATCHはリトライしない）と、
+API毎のレート制限をconfigから読むこと。
+"""
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import threading
+
+import pytest
+
+from chalicelib.config import get_config
+from chalicelib.http_client import HttpClient
+from chalicelib.rate_limiter import get_rate_limiter
+
+
+@pytest.fixture
+def server():
+    """1回目は503、2回目以降は200を返すサーバー"""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            requests.append(self.command)
+            self.send_response(503 if len(requests) == 1 else 200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'[]')
+
+        do_GET = do_POST = do_PATCH = _respond
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{_server.server_port}', requests
+    _server.shutdown()
+    _server.server_close()
+
+
+@pytest.mark.parametrize('method', ['GET', 'POST'])
+def test_retry_on_server_error(server, method):
+    _url, _requests = server
+    _res = HttpClient(retry_total=2, retry_backoff=0).request(method, _url, json={})
+    assert _res.status_code == 200
+    assert _requests == [method, method]
+
+
+def test_patch_is_not_retried(server):
+    _url, _requests = server
+    _res = HttpClient(retry_total=2, retry_backoff=0).patch(_url, json={})
+    assert _res.status_code == 503
+    assert _requests == ['PATCH']
+
+
+def test_rate_limiter_uses_config():
+    _limiter = get_rate_limiter('backlog')
+    assert _limiter.max_rate == get_config().backlog_rate_limit == 1000
+    assert _limiter.capacity == get_config().backlog_rate_burst == 100
@@ -0,0 +1,46 @@
+"""
+Sync queue tests.
+
+同期中に来たイベントを失わないこと、最大待ち時刻を過ぎたissueもdebounceすること。
+"""
+from chalicelib.repositories import DbSyncQueueRepository
+
+
+def _queue_rows(db) -> dict:
+    with db.cursor() as _cur:
+        _cur.execute('SELECT issue_key, event_count, due_at > now() AS waiting, max_due_at > now() AS capped_later '
+                     'FROM backlog_sync_queue')
+        rows = {row[0]: tuple(row[1:]) for row in _cur.fetchall()}
+    db.rollback()
+    return rows
+
+
+def test_event_during_sync_of_capped_issue_is_kept(db):
+    _repository = DbSyncQueueRepository()
+    # 最大待ち時刻に達した（due_at = max_due_at）issue
+    _repository.enqueue(['TEST-1'], debounce_seconds=0, max_wait_seconds=0)
+    _items = _repository.find_due()
+    assert [item.issue_key for item in _items] == ['TEST-1']
+
+    # 同期中に新しいイベント
+    _repository.enqueue(['TEST-1'], debounce_seconds=300, max_wait_seconds=1800)
+    _repository.complete(_items)
+
+    # 残り、最大待ち時刻を数え直してdebounceされる
+    assert _queue_rows(db) == {'TEST-1': (2, True, True)}
+
+
+def test_complete_keeps_issue_with_new_event_count(db):
+    _repository = DbSyncQueueRepository()
+    _repository.enqueue(['TEST-1'], debounce_seconds=0, max_wait_seconds=0)
+    _items = _repository.find_due()
+    # due_atが変わらないイベント（最大待ち時刻に達している）
+    with db.cursor() as _cur:
+        _cur.execute('UPDATE backlog_sync_queue SET event_count = event_count + 1')
+    db.commit()
+
+    _repository.complete(_items)
+    assert list(_queue_rows(db)) == ['TEST-1']
+
+    _repository.complete(_repository.find_due())
+    assert _queue_rows(db) == {}
@@ -0,0 +1,89 @@
+"""
+Sync retry tests.
+
+同期に失敗したissueをbacklog_sync_retryに記録し、待ち時間を倍にしながら（上限まで）再同期すること。
+"""
+from fakes import FakeHttpClient
+from fakes import FakeResponse
+
+from chalicelib.error import BacklogAPIError
+from chalicelib.models import TogglReportSummary
+from chalicelib.repositories import BacklogIssueRepository
+from chalicelib.repositories import DbTogglReportRepository
+from chalicelib.usecases import ImportFromTogglUsecase
+
+
+def _retry_rows(db) -> dict:
+    with db.cursor() as _cur:
+        _cur.execute('SELECT backlog_issue_key, attempts, '
+                     'extract(epoch FROM next_retry_at - failed_at) AS delay FROM backlog_sync_retry')
+        rows = {row[0]: (row[1], float(row[2])) for row in _cur.fetchall()}
+    db.rollback()
+    return rows
+
+
+def _ledger_keys(db) -> list:
+    with db.cursor() as _cur:
+        _cur.execute('SELECT backlog_issue_key FROM backlog_sync_ledger ORDER BY backlog_issue_key')
+        keys = [row[0] for row in _cur.fetchall()]
+    db.rollback()
+    return keys
+
+
+def _summary(issue_key: str) -> TogglReportSummary:
+    return TogglReportSummary(backlog_issue_key=issue_key, sum_dur=3600000, sum_dur_hours=1.0, drift=3600000)
+
+
+def _issue_response(issue_key: str) -> FakeResponse:
+    return FakeResponse(200, {'id': int(issue_key.rsplit('-', 1)[1]), 'issueKey': issue_key, 'actualHours': 1.0})
+
+
+def test_backoff_doubles_until_cap(db):
+    _repository = DbTogglReportRepository()
+    delays = []
+    for attempts in range(1, 5):
+        _repository.save_sync_failures({'TEST-1': 'error'}, [], base_seconds=10, max_seconds=35)
+        _attempts, _delay = _retry_rows(db)['TEST-1']
+        assert _attempts == attempts
+        delays.append(_delay)
+    assert delays == [10, 20, 35, 35]
+
+
+def test_success_clears_retry(db):
+    _repository = DbTogglReportRepository()
+    _repository.save_sync_failures({'TEST-1': 'error', 'TEST-2': 'error'}, [])
+    _repository.save_sync_failures({}, ['TEST-1'])
+    assert list(_retry_rows(db)) == ['TEST-2']
+
+
+def test_find_retry_issues_returns_due_issues(db):
+    _repository = DbTogglReportRepository()
+    _repository.save_sync_failures({'TEST-1': 'error'}, [], base_seconds=0)
+    _repository.save_sync_failures({'TEST-2': 'error'}, [], base_seconds=3600)
+    assert [item.issue_key for item in _repository.find_retry_issues(10)] == ['TEST-1']
+
+
+def test_failed_get_is_isolated_and_retried(db):
+    _responses = {
+        '/issues/TEST-2/comments': FakeResponse(200, []),
+        '/issues/TEST-1?': FakeResponse(503),
+        '/issues/TEST-2?': _issue_response('TEST-2'),
+    }
+    _usecase = ImportFromTogglUsecase(
+        None, DbTogglReportRepository(),
+        BacklogIssueRepository(http_client=FakeHttpClient(_responses)), max_workers=1)
+
+    for attempts in range(1, 3):
+        results = _usecase.sync_summaries([_summary('TEST-1'), _summary('TEST-2')])
+        assert isinstance(results[0].error, BacklogAPIError)
+        assert results[1].error is None
+        assert _retry_rows(db)['TEST-1'][0] == attempts
+        assert _ledger_keys(db) == ['TEST-2']
+
+    # Backlogが復旧したら再同期でbacklog_sync_retryから消える
+    _responses.update({'/issues/TEST-1/comments': FakeResponse(200, []),
+                       '/issues/TEST-1?': _issue_response('TEST-1')})
+    results = _usecase.sync_summaries([_summary('TEST-1')])
+    assert results[0].error is None
+    assert _retry_rows(db) == {}
+    assert _ledger_keys(db) == ['TEST-1', 'TEST-2']
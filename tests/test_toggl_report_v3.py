@@ -0,0 +1,48 @@
+"""
+Toggl Reports API v3 tests.
+
+X-Next-Row-Numberでのページング、time entry毎の展開（durはミリ秒）、実行中のtime entryを含めないこと。
+"""
+import datetime
+
+from fakes import FakeHttpClient
+from fakes import FakeResponse
+
+from chalicelib.repositories import TogglReportSummaryRepository
+
+
+def _entry(toggl_id: int, seconds: int, stop: str = '2026-10-14T13:00:00+00:00') -> dict:
+    return {'id': toggl_id, 'seconds': seconds, 'start': '2026-10-14T12:00:00+00:00',
+            'stop': stop, 'at': '2026-10-14T13:00:00+00:00'}
+
+
+def _row(description: str, entries: list) -> dict:
+    return {'user_id': 1, 'username': 'user', 'project_id': 2, 'task_id': None,
+            'description': description, 'time_entries': entries}
+
+
+def test_iter_data_v3_pages_by_next_row_number():
+    _pages = [
+        FakeResponse(200, [_row('TEST-1 work', [_entry(1, 60), _entry(2, 90)])],
+                     headers={'X-Next-Row-Number': '2'}),
+        FakeResponse(200, [_row('TEST-2 work', [_entry(3, 30), _entry(4, -1700000000, stop=None)]),
+                           _row('other work', [_entry(5, 30)])]),
+    ]
+    _http_client = FakeHttpClient({
+        '/api/v8/workspaces': FakeResponse(200, [{'id': 100}]),
+        '/api/v8/me': FakeResponse(200, {'data': {'email': 'user@example.com', 'timezone': 'UTC'}}),
+        '/search/time_entries': _pages,
+    })
+    _repository = TogglReportSummaryRepository(http_client=_http_client, report_api='v3')
+
+    data = list(_repository.iter_data(since=datetime.date(2026, 10, 12), until=datetime.date(2026, 10, 18)))
+
+    # 実行中（stopなし）とissue keyのないtime entryは含めない
+    assert [(detail.id, detail.dur, detail.backlog_issue_key) for detail in data] == [
+        (1, 60000, 'TEST-1'), (2, 90000, 'TEST-1'), (3, 30000, 'TEST-2')]
+    _bodies = [kwargs['json'] for method, url, kwargs in _http_client.requests
+               if url.endswith('/workspace/100/search/time_entries')]
+    assert len(_bodies) == 2
+    assert 'first_row_number' not in _bodies[0]
+    assert _bodies[1]['first_row_number'] == 2
+    assert (_bodies[1]['start_date'], _bodies[1]['end_date']) == ('2026-10-12', '2026-10-18')
@@ -0,0 +1,47 @@
+"""
+Toggl sync tests.
+
+DBとの比較はTogglから取得した期間（Togglユーザーのタイムゾーン）のみで行い、期間外のデータを削除しないこと。
+"""
+import datetime
+
+from chalicelib.models import TogglReportDetail
+from chalicelib.models import TogglReportWindow
+from chalicelib.repositories import DbTogglReportRepository
+
+UPDATED = '2026-10-18T00:00:00+00:00'
+
+
+def _detail(toggl_id: int, start: str) -> TogglReportDetail:
+    return TogglReportDetail(id=toggl_id, pid=1, tid=None, uid=1, user='user', description='TEST-1 work',
+                             start=start, end=start, updated=UPDATED, dur=60000, backlog_issue_key='TEST-1')
+
+
+def _stored_ids(db) -> list:
+    with db.cursor() as _cur:
+        _cur.execute('SELECT toggl_id FROM toggl_report ORDER BY toggl_id')
+        ids = [row[0] for row in _cur.fetchall()]
+    db.rollback()
+    return ids
+
+
+def test_sync_compares_only_window_in_user_timezone(db):
+    _repository = DbTogglReportRepository()
+    _repository.sync([
+        # ニューヨーク（UTC-4）の10/11 22時。UTCでは10/12だが、Togglの取得期間（10/12〜）の外
+        _detail(1, '2026-10-12T02:00:00+00:00'),
+        # 期間内でTogglから削除されたもの
+        _detail(2, '2026-10-13T12:00:00+00:00'),
+        # 期間内で変更なし
+        _detail(3, '2026-10-14T12:00:00+00:00'),
+        # ニューヨークの10/18 22時。UTCでは10/19だが期間内
+        _detail(4, '2026-10-19T02:00:00+00:00'),
+    ], window=TogglReportWindow(since=datetime.date(2026, 10, 1), until=datetime.date(2026, 10, 31)))
+    _window = TogglReportWindow(since=datetime.date(2026, 10, 12), until=datetime.date(2026, 10, 18),
+                                timezone='America/New_York')
+
+    result = _repository.sync([_detail(3, '2026-10-14T12:00:00+00:00'), _detail(4, '2026-10-19T02:00:00+00:00')],
+                              window=_window)
+
+    assert (result.deleted, result.unchanged) == (1, 2)
+    assert _stored_ids(db) == [1, 3, 4]
@@ -0,0 +1,52 @@
+"""
+Webhook tests.
+
+削除・descriptionを変更したtime entryは、変更前のissueも同期待ちにすること。
+"""
+import datetime
+
+from chalicelib.models import TogglReportDetail
+from chalicelib.models import TogglReportWindow
+from chalicelib.repositories import DbSyncQueueRepository
+from chalicelib.repositories import DbTogglReportRepository
+from chalicelib.usecases import EnqueueIssueEventsUsecase
+from chalicelib.webhooks import extract_issue_keys
+from chalicelib.webhooks import extract_toggl_ids
+
+
+def _event(action: str, payload: dict) -> dict:
+    return {'metadata': {'action': action, 'model': 'time_entry', 'time_entry_id': payload.get('id')},
+            'payload': payload}
+
+
+def test_extract_issue_keys_includes_previous_description():
+    _event_data = dict(_event('updated', {'id': 10, 'description': 'TEST-2 work'}),
+                       previous={'description': 'test-1 work'})
+    assert extract_issue_keys(_event_data) == ['TEST-2', 'TEST-1']
+
+
+def test_extract_toggl_ids():
+    assert extract_toggl_ids(_event('deleted', {'id': 10})) == [10]
+    assert extract_toggl_ids({'metadata': {'model': 'project'}, 'payload': {'id': 3}}) == []
+    assert extract_toggl_ids({'issue_keys': ['TEST-1']}) == []
+
+
+def test_enqueue_stored_issue_of_changed_entry(db):
+    DbTogglReportRepository().sync([TogglReportDetail(
+        id=10, pid=1, tid=None, uid=1, user='user', description='TEST-1 work',
+        start='2026-10-14T12:00:00+00:00', end='2026-10-14T13:00:00+00:00',
+        updated='2026-10-14T13:00:00+00:00', dur=3600000, backlog_issue_key='TEST-1')],
+        window=TogglReportWindow(since=datetime.date(2026, 10, 14), until=datetime.date(2026, 10, 14)))
+    _usecase = EnqueueIssueEventsUsecase(DbSyncQueueRepository(), DbTogglReportRepository())
+
+    # descriptionをTEST-2に変更
+    _updated = _event('updated', {'id': 10, 'description': 'TEST-2 work'})
+    assert _usecase.handle(extract_issue_keys(_updated), extract_toggl_ids(_updated)) == 2
+    # 削除（payloadにdescriptionがない）
+    _deleted = _event('deleted', {'id': 10})
+    assert _usecase.handle(extract_issue_keys(_deleted), extract_toggl_ids(_deleted)) == 1
+
+    with db.cursor() as _cur:
+        _cur.execute('SELECT issue_key, event_count FROM backlog_sync_queue ORDER BY issue_key')
+        assert [tuple(row) for row in _cur.fetchall()] == [('TEST-1', 2), ('TEST-2', 1)]
+    db.rollback()
@@ -0,0 +1,62 @@
+"""
+Partition tool for toggl_report.
+
+toggl_reportを月次パーティション（start_timeの範囲）に移行し、パーティションの作成・保存期間の適用を行う。
+DB設定はconfig.jsonと同じ環境変数（DB_HOST等）を使用する。
+
+    python tools/toggl_partitions.py migrate --months-ahead 2
+    python tools/toggl_partitions.py ensure
+    python tools/toggl_partitions.py retain --keep-months 24 --policy archive
+
+migrateは移行中toggl_reportをlockするため、取り込みが動いていない時間に実行すること。
+移行元はtoggl_report_heapとして残る（--drop-oldで削除）。
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# DB以外の設定は使わないため、未設定なら空にする
+for _key in ('TOGGL_API_TOKEN', 'TOGGL_BASE_URL', 'BACKLOG_PRJ_KEY', 'BACKLOG_BASE_URL',
+             'BACKLOG_APIKEY', 'BACKLOG_COMMENT'):
+    os.environ.setdefault(_key, '')
+os.environ.setdefault('TOGGL_PAST_DAYS', '6')
+os.environ.setdefault('BACKLOG_COMMENT_COUNT', '100')
+
+from chalicelib.repositories import RETENTION_POLICIES  # noqa: E402
+from chalicelib.repositories import DbTogglPartitionRepository  # noqa: E402
+
+
+def _parse_args():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _sub = _parser.add_subparsers(dest='command', required=True)
+    _migrate = _sub.add_parser('migrate', help='toggl_reportを月次パーティションに移行する')
+    _migrate.add_argument('--months-ahead', type=int, default=None, help='何か月先までパーティションを作成するか')
+    _migrate.add_argument('--drop-old', action='store_true', help='移行元（toggl_report_heap）を削除する')
+    _ensure = _sub.add_parser('ensure', help='先の月とdefaultパーティションにデータがある月のパーティションを作成する')
+    _ensure.add_argument('--months-ahead', type=int, default=None, help='何か月先までパーティションを作成するか')
+    _retain = _sub.add_parser('retain', help='保存期間を過ぎたパーティションを切り離す')
+    _retain.add_argument('--keep-months', type=int, default=None, help='残す月数（今月を含む）')
+    _retain.add_argument('--policy', choices=RETENTION_POLICIES, default=None,
+                         help='archive：toggl_archiveスキーマに移す、drop：削除する')
+    return _parser.parse_args()
+
+
+def main():
+    _args = _parse_args()
+    _repository = DbTogglPartitionRepository()
+    if _args.command == 'migrate':
+        if _repository.migrate(_args.months_ahead, _args.drop_old):
+            print('migrated toggl_report to monthly partitions')
+        else:
+            print('toggl_report is already partitioned')
+    elif _args.command == 'ensure':
+        print(f'created: {_repository.ensure_partitions(_args.months_ahead)}')
+    elif _args.command == 'retain':
+        print(f'retired: {_repository.apply_retention(_args.keep_months, _args.policy)}')
+
+
+if __name__ == '__main__':
+    main()